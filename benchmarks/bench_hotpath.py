@@ -0,0 +1,344 @@
+"""Benchmark đường nóng của DJRuntime với HomeAssistant giả lập (fake_hass).
+
+Chạy từ thư mục gốc repo:
+
+    python benchmarks/bench_hotpath.py            # đầy đủ
+    python benchmarks/bench_hotpath.py --quick    # ít vòng, file nhỏ hơn
+    python benchmarks/bench_hotpath.py -s tick -s cost --out bench_output.txt
+
+Các kịch bản:
+  tick      độ trễ một tick (tính trong event loop + job ghi lịch sử) với file
+            CSV năm từ rỗng tới cả năm dòng 1 phút, có/không file nhị phân
+  cost      thông lượng bộ tính tiền bậc thang (cost_K, iter_hour_deltas trên một năm dòng giờ)
+  rollover  tick qua ngày / tháng / năm (ghi dòng ngày, chốt tháng, lưu ngay)
+  fanout    một tick coordinator với nhiều công tơ cùng tới hạn
+
+Mỗi dòng báo cáo p50/p99 (µs) và bộ nhớ đỉnh (tracemalloc, lượt chạy riêng
+để không làm lệch thời gian).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_hass  # noqa: E402
+
+fake_hass.install()
+
+from evn import DJRuntime  # noqa: E402
+from evn.const import CSV_HEADER  # noqa: E402
+from evn.coordinator import DJCoordinator  # noqa: E402
+from evn.query import iter_hour_deltas  # noqa: E402
+from evn.tariff import default_schedule  # noqa: E402
+
+TZ = fake_hass.TZ
+FWD, REV = "sensor.bench_forward", "sensor.bench_reverse"
+START = datetime(2025, 6, 15, 8, 0, tzinfo=TZ)
+
+SIZES = {"empty": 0, "1 day": 1440, "1 month": 43_200, "1 year": 525_600}
+QUICK_SIZES = {"empty": 0, "1 day": 1440, "1 month": 43_200}
+
+Results = List[Dict[str, object]]
+
+
+# -------------------- đo --------------------
+
+def _pct(samples: List[float], p: float) -> float:
+    s = sorted(samples)
+    return s[min(int(round(p / 100 * (len(s) - 1))), len(s) - 1)]
+
+
+def _summary(name: str, samples: List[float], peak: int, extra: str = "") -> Dict[str, object]:
+    return {
+        "name": name, "n": len(samples),
+        "p50": _pct(samples, 50) * 1e6, "p99": _pct(samples, 99) * 1e6,
+        "mean": statistics.fmean(samples) * 1e6, "peak_kb": peak / 1024, "extra": extra,
+    }
+
+
+async def _time_async(step: Callable[[int], Awaitable[None]], n: int) -> List[float]:
+    out = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        await step(i)
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+async def _peak_async(step: Callable[[int], Awaitable[None]], n: int, offset: int) -> int:
+    tracemalloc.start()
+    try:
+        for i in range(n):
+            await step(offset + i)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# -------------------- dựng runtime --------------------
+
+def _write_history_file(path: str, rows: int, end: datetime) -> None:
+    """CSV năm gồm `rows` dòng 1 phút kết thúc ngay trước `end` (như bản cũ ghi mỗi tick)."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(CSV_HEADER + "\n")
+        t = end - timedelta(minutes=rows)
+        f_total = 10_000.0
+        buf = []
+        for _ in range(rows):
+            f_total += 0.01
+            buf.append(
+                f"{t.date().isoformat()}|{t.strftime('%H')}|{t.strftime('%M:%S')}|"
+                f"{f_total:.3f}|1.000|100.000|1000.000|500.000|0.500|10.000|100.000\n"
+            )
+            if len(buf) >= 10_000:
+                f.writelines(buf)
+                buf.clear()
+            t += timedelta(minutes=1)
+        f.writelines(buf)
+
+
+def _make_runtime(hass: fake_hass.FakeHass, base_dir: str, entry_id: str,
+                  now: datetime, binary: bool = False) -> DJRuntime:
+    fake_hass.set_now(now)
+    fwd, rev = f"{FWD}_{entry_id}", f"{REV}_{entry_id}"
+    hass.states.set(fwd, 10_000.0)
+    hass.states.set(rev, 500.0)
+    csv_path = os.path.join(base_dir, f"{now.year}.csv")
+    entry = fake_hass.FakeEntry(entry_id)
+    dj = DJRuntime(hass, entry, fwd, rev, csv_path, fake_hass.FakeStore(), {})
+    dj.binary_history = binary
+    dj.tariffs = default_schedule()
+    return dj
+
+
+def _advance(hass: fake_hass.FakeHass, dj: DJRuntime, now: datetime, kwh: float = 0.01) -> None:
+    fake_hass.set_now(now)
+    for ent in (dj.forward_entity, dj.reverse_entity):
+        hass.states.set(ent, float(hass.states.get(ent).state) + kwh)
+
+
+# -------------------- kịch bản --------------------
+
+async def bench_tick(quick: bool, workdir: str) -> Results:
+    results: Results = []
+    n = 200 if quick else 1000
+    sizes = QUICK_SIZES if quick else SIZES
+    for binary in (False, True):
+        for label, rows in sizes.items():
+            base = os.path.join(workdir, f"tick_{rows}_{int(binary)}")
+            os.makedirs(base)
+            _write_history_file(os.path.join(base, f"{START.year}.csv"), rows, START)
+            hass = fake_hass.FakeHass()
+            dj = _make_runtime(hass, base, "tick", START, binary)
+            await dj.async_compute(START)  # khởi tạo baseline
+
+            compute: List[float] = []
+            write: List[float] = []
+
+            async def step(i: int) -> None:
+                now = START + timedelta(minutes=i + 1)
+                _advance(hass, dj, now)
+                t0 = time.perf_counter()
+                job = await dj.async_compute(now)
+                t1 = time.perf_counter()
+                job()  # đo trực tiếp, không qua executor
+                compute.append(t1 - t0)
+                write.append(time.perf_counter() - t1)
+
+            await _time_async(step, n)
+            compute_only, write_only = list(compute), list(write)
+            peak = await _peak_async(step, max(n // 10, 20), n)
+            dj._close_writers_sync()
+            await hass.async_block_till_done()
+            hass.close()
+            size_mb = os.path.getsize(dj.csv_path) / 1e6
+            tag = "csv+bin" if binary else "csv"
+            results.append(_summary(f"tick compute  [{tag}, {label}]", compute_only, peak,
+                                    f"saves={dj.store.saves} delayed={dj.store.delayed}"))
+            results.append(_summary(f"tick write    [{tag}, {label}]", write_only, peak,
+                                    f"csv={size_mb:.1f}MB"))
+    return results
+
+
+async def bench_cost(quick: bool, workdir: str) -> Results:
+    results: Results = []
+    n = 20_000 if quick else 200_000
+    table = default_schedule().table_for(START.date())
+    rng = random.Random(1)
+    kwhs = [rng.uniform(0, 1200) for _ in range(n)]
+
+    def run(fn: Callable[[float], float]) -> List[float]:
+        out = []
+        for k in kwhs:
+            t0 = time.perf_counter()
+            fn(k)
+            out.append(time.perf_counter() - t0)
+        return out
+
+    def peak_of(fn: Callable[[], object]) -> int:
+        tracemalloc.start()
+        try:
+            fn()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    samples = run(table.cost_K)
+    results.append(_summary("cost_K", samples, peak_of(lambda: [table.cost_K(k) for k in kwhs[:1000]]),
+                            f"{n / sum(samples) / 1e6:.2f}M calls/s"))
+
+    # đường lịch sử/backfill: một năm dòng giờ -> kWh + tiền từng giờ
+    schedule = default_schedule()
+    rows = []
+    t = datetime(2025, 1, 1, 0, 0, tzinfo=TZ)
+    bd = bm = 0.0
+    for _ in range(8760):
+        if t.hour == 0:
+            bd = 0.0
+            if t.day == 1:
+                bm = 0.0
+        kwh = rng.uniform(0.1, 2.0)
+        bd += kwh
+        bm += kwh
+        rows.append((t.date(), t.hour, (0.0, bd, bm, 0.0, 0.0, 0.0, 0.0, 0.0)))
+        t += timedelta(hours=1)
+    samples = []
+    for _ in range(3 if quick else 10):
+        t0 = time.perf_counter()
+        for _row in iter_hour_deltas(iter(rows), schedule):
+            pass
+        samples.append(time.perf_counter() - t0)
+    results.append(_summary(f"iter_hour_deltas x{len(rows)}", samples,
+                            peak_of(lambda: sum(1 for _ in iter_hour_deltas(iter(rows), schedule))),
+                            f"{len(rows) * len(samples) / sum(samples) / 1e6:.2f}M rows/s"))
+    return results
+
+
+async def bench_rollover(quick: bool, workdir: str) -> Results:
+    results: Results = []
+    n = 20 if quick else 100
+    edges = {
+        "day":   datetime(2025, 6, 16, 0, 0, tzinfo=TZ),
+        "month": datetime(2025, 7, 1, 0, 0, tzinfo=TZ),
+        "year":  datetime(2026, 1, 1, 0, 0, tzinfo=TZ),
+    }
+    for label, edge in edges.items():
+        hass = fake_hass.FakeHass()
+        runtimes = []
+        for i in range(n + max(n // 5, 5)):
+            base = os.path.join(workdir, f"roll_{label}_{i}")
+            os.makedirs(base)
+            dj = _make_runtime(hass, base, f"roll{i}", edge - timedelta(minutes=2))
+            await dj.async_compute(edge - timedelta(minutes=2))
+            _advance(hass, dj, edge - timedelta(minutes=1))
+            (await dj.async_compute(edge - timedelta(minutes=1)))()
+            runtimes.append(dj)
+
+        async def step(i: int) -> None:
+            dj = runtimes[i]
+            _advance(hass, dj, edge)
+            job = await dj.async_compute(edge)
+            job()
+
+        samples = await _time_async(step, n)
+        peak = await _peak_async(step, len(runtimes) - n, n)
+        for dj in runtimes:
+            dj._close_writers_sync()
+        await hass.async_block_till_done()
+        hass.close()
+        results.append(_summary(f"rollover tick [{label}]", samples, peak,
+                                f"saves/tick={runtimes[0].store.saves - 1}"))
+    return results
+
+
+async def bench_fanout(quick: bool, workdir: str) -> Results:
+    results: Results = []
+    n = 20 if quick else 100
+    for count in (1, 10, 50):
+        hass = fake_hass.FakeHass()
+        coord = DJCoordinator(hass)
+        runtimes = []
+        for i in range(count):
+            base = os.path.join(workdir, f"fan_{count}_{i}")
+            os.makedirs(base)
+            dj = _make_runtime(hass, base, f"fan{count}_{i}", START)
+            dj.writer = coord.writer
+            coord.register(dj, 1)
+            await dj.async_compute(START)
+            runtimes.append(dj)
+
+        async def step(i: int) -> None:
+            now = START + timedelta(minutes=i + 1)
+            for dj in runtimes:
+                _advance(hass, dj, now)
+            await coord._async_tick(now)
+
+        samples = await _time_async(step, n)
+        t0 = time.perf_counter()
+        coord.writer.flush()
+        drain = time.perf_counter() - t0
+        peak = await _peak_async(step, max(n // 5, 5), n)
+        coord.writer.flush()
+        stats = coord.writer.stats()
+        coord.writer.submit_many(dj._close_writers_sync for dj in runtimes)
+        await coord.async_shutdown()
+        await hass.async_block_till_done()
+        hass.close()
+        results.append(_summary(f"fan-out tick  [{count} entries]", samples, peak,
+                                f"drain={drain * 1e3:.1f}ms max_backlog={stats['max_backlog']} "
+                                f"batches={stats['batches']} dropped={stats['dropped']}"))
+    return results
+
+
+SCENARIOS = {"tick": bench_tick, "cost": bench_cost, "rollover": bench_rollover, "fanout": bench_fanout}
+
+
+# -------------------- main --------------------
+
+def _format(results: Results) -> str:
+    lines = [f"{'benchmark':<34}{'n':>8}{'p50 µs':>11}{'p99 µs':>11}{'mean µs':>11}{'peak KiB':>11}  notes"]
+    for r in results:
+        lines.append(
+            f"{r['name']:<34}{r['n']:>8}{r['p50']:>11.1f}{r['p99']:>11.1f}"
+            f"{r['mean']:>11.1f}{r['peak_kb']:>11.1f}  {r['extra']}"
+        )
+    return "\n".join(lines)
+
+
+async def _main(args: argparse.Namespace) -> str:
+    workdir = tempfile.mkdtemp(prefix="evn_bench_")
+    try:
+        results: Results = []
+        for name in args.scenario or list(SCENARIOS):
+            results.extend(await SCENARIOS[name](args.quick, workdir))
+        return _format(results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-s", "--scenario", action="append", choices=list(SCENARIOS))
+    parser.add_argument("--quick", action="store_true", help="ít vòng lặp, bỏ file cả năm")
+    parser.add_argument("--out", help="ghi thêm báo cáo ra file")
+    args = parser.parse_args(argv)
+    report = asyncio.run(_main(args))
+    print(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Kiểm tra hồi quy cho đường đọc lịch sử, chạy với HomeAssistant giả lập (fake_hass).
+
+Chạy từ thư mục gốc repo:
+
+    python benchmarks/check_history.py
+
+Các kiểm tra:
+  binary_toggle   tắt .bin giữa năm rồi bật lại: các ngày chỉ có trong CSV
+                  (kể cả ngày tắt/bật giữa chừng) vẫn được đọc đủ
+  month_gap       HA tắt qua nhiều tháng (cùng năm / qua năm): mỗi tháng bị bỏ
+                  qua có ledger ước tính, tổng ledger + tháng này = lượng tăng
+  intraday_restart HA sập khi `accepted` chưa kịp ghi (ghi trễ): bucket theo giờ
+                  dựng lại từ CSV không cộng lại phần đã có ở dòng cuối
+"""
+from __future__ import annotations
+
+import asyncio
+import copy
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_hass  # noqa: E402
+
+fake_hass.install()
+
+import bench_hotpath as B  # noqa: E402
+from evn import DJRuntime  # noqa: E402
+from evn.history import iter_csv_rows  # noqa: E402
+from evn.intraday import load_intraday_sync  # noqa: E402
+from evn.query import aggregate, binary_days, query_history_sync  # noqa: E402
+from evn.tariff import default_schedule  # noqa: E402
+
+TZ = fake_hass.TZ
+
+
+async def check_binary_toggle(workdir: str) -> str:
+    hass = fake_hass.FakeHass()
+    start = datetime(2025, 3, 1, 0, 0, tzinfo=TZ)
+    off = datetime(2025, 3, 4, 10, 0, tzinfo=TZ)
+    on = datetime(2025, 3, 6, 14, 0, tzinfo=TZ)
+    dj = B._make_runtime(hass, workdir, "toggle", start, binary=True)
+    now = start
+    while now < datetime(2025, 3, 10, 0, 0, tzinfo=TZ):
+        now += timedelta(minutes=15)
+        dj.binary_history = not (off <= now < on)
+        B._advance(hass, dj, now, 0.25)
+        (await dj.async_compute(now))()
+    dj._close_writers_sync()
+    await hass.async_block_till_done()
+    hass.close()
+
+    tariffs = default_schedule()
+    first, last = date(2025, 3, 1), date(2025, 3, 9)
+    got = query_history_sync(workdir, first, last, "day", tariffs, TZ)
+    want = aggregate(iter_csv_rows(os.path.join(workdir, "2025.csv"), first, last), "day", tariffs)
+    assert got["buckets"] == want["buckets"], (got["buckets"], want["buckets"])
+    covered = binary_days(workdir, 2025, TZ)
+    for d in (date(2025, 3, 4), date(2025, 3, 5), date(2025, 3, 6)):
+        assert d not in covered, d   # tắt/bật giữa ngày hoặc không có trong .bin
+    assert date(2025, 3, 8) in covered
+    total = sum(b["buy"] for b in got["buckets"])
+    return f"binary_toggle   ok  buy={total:.2f} kWh, ngày đọc từ .bin={len(covered)}"
+
+
+async def _run_gap(workdir: str, before: datetime, after: datetime, kwh: float) -> DJRuntime:
+    os.makedirs(workdir)
+    hass = fake_hass.FakeHass()
+    dj = B._make_runtime(hass, workdir, f"gap{before:%Y%m}", before)
+    dj.writer = None
+    (await dj.async_compute(before))()
+    B._advance(hass, dj, before + timedelta(minutes=1), 1.0)
+    (await dj.async_compute(before + timedelta(minutes=1)))()
+    B._advance(hass, dj, after, kwh)
+    (await dj.async_compute(after))()
+    await hass.async_block_till_done()
+    hass.close()
+    return dj
+
+
+async def check_month_gap(workdir: str) -> str:
+    out = []
+    cases = (
+        (datetime(2025, 1, 20, 12, 0, tzinfo=TZ), datetime(2025, 4, 10, 12, 0, tzinfo=TZ),
+         ["2025-01", "2025-02", "2025-03"]),
+        (datetime(2024, 11, 20, 12, 0, tzinfo=TZ), datetime(2025, 2, 10, 12, 0, tzinfo=TZ),
+         ["2024-11", "2024-12", "2025-01"]),
+    )
+    for before, after, months in cases:
+        dj = await _run_gap(os.path.join(workdir, f"{before:%Y%m}"), before, after, 800.0)
+        ledger, st = dj.data["ledger"], dj.state
+        assert sorted(ledger) == months, sorted(ledger)
+        assert all(ledger[m].get("estimated") for m in months[1:]), ledger
+        total = sum(e["buy"] for e in ledger.values()) + st["buy_month"]
+        assert abs(total - 801.0) < 0.01, total
+        closed = sum(e["buy"] for m, e in ledger.items() if m[:4] == str(after.year))
+        assert abs(st["buy_year"] - (closed + st["buy_month"])) < 0.01, (st["buy_year"], closed)
+        assert abs(dj.data["year"]["closed"]["buy"] - closed) < 0.01, dj.data["year"]["closed"]
+        out.append(f"{before:%Y-%m}->{after:%Y-%m} tháng này={st['buy_month']:.1f}")
+    return "month_gap       ok  " + ", ".join(out)
+
+
+async def check_intraday_restart(workdir: str) -> str:
+    hass = fake_hass.FakeHass()
+    start = datetime(2025, 6, 15, 8, 0, tzinfo=TZ)
+    dj = B._make_runtime(hass, workdir, "restart", start)
+    dj.writer = None
+    now = start
+    saved = None
+    for i in range(120):
+        now += timedelta(minutes=1)
+        B._advance(hass, dj, now, 0.05)
+        (await dj.async_compute(now))()
+        if i == 109:   # lần ghi trễ cuối trước khi sập: 10 phút cuối chưa vào .storage
+            saved = copy.deepcopy(dj.data)
+    dj._close_writers_sync()
+
+    dj = DJRuntime(hass, fake_hass.FakeEntry("restart"), dj.forward_entity,
+                   dj.reverse_entity, dj.csv_path, fake_hass.FakeStore(), saved)
+    dj.writer = None
+    dj.tariffs = default_schedule()
+    dj.intraday = load_intraday_sync(workdir, now.date(), TZ, dj.tariffs)
+    now += timedelta(minutes=1)
+    B._advance(hass, dj, now, 0.05)
+    (await dj.async_compute(now))()
+    dj._close_writers_sync()
+    await hass.async_block_till_done()
+    hass.close()
+
+    want = aggregate(iter_csv_rows(dj.csv_path, now.date(), now.date()), "hour", dj.tariffs)
+    got = dj.intraday.attributes("buy", "day")["hourly"]
+    for bucket in want["buckets"]:
+        hour = int(bucket["start"][11:13])
+        assert abs(got[hour] - bucket["buy"]) < 0.002, (hour, got[hour], bucket["buy"])
+    csv_buy = sum(b["buy"] for b in want["buckets"])
+    return f"intraday_restart ok  buy hôm nay={sum(got):.2f} kWh (CSV {csv_buy:.2f})"
+
+
+CHECKS: Dict[str, Callable[[str], "asyncio.Future[str]"]] = {
+    "binary_toggle": check_binary_toggle,
+    "month_gap": check_month_gap,
+    "intraday_restart": check_intraday_restart,
+}
+
+
+async def _main() -> List[str]:
+    out = []
+    for name, check in CHECKS.items():
+        workdir = tempfile.mkdtemp(prefix=f"evn_check_{name}_")
+        try:
+            out.append(await check(workdir))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return out
+
+
+if __name__ == "__main__":
+    print("\n".join(asyncio.run(_main())))
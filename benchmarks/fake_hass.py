@@ -0,0 +1,233 @@
+"""Home Assistant giả lập tối thiểu để benchmark DJRuntime ngoài HA.
+
+Cài các module `homeassistant.*` (và `voluptuous` nếu chưa có) dạng stub vào
+sys.modules TRƯỚC khi import `custom_components.evn`, rồi cung cấp FakeHass
+(state machine, executor thật, bus), FakeStore (serialize JSON như Store thật
+để đo chi phí lưu) và FakeEntry. Đồng hồ `dt_util.now()` điều khiển được qua
+`set_now()` để dựng tick qua ngày/tháng/năm.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Any, Callable, Dict, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TZ = timezone(timedelta(hours=7))  # Asia/Ho_Chi_Minh, không DST
+
+_now: Dict[str, datetime] = {"v": datetime(2025, 1, 1, tzinfo=TZ)}
+
+
+def set_now(value: datetime) -> None:
+    _now["v"] = value
+
+
+def _mod(name: str, **attrs: Any) -> types.ModuleType:
+    m = types.ModuleType(name)
+    m.__dict__.update(attrs)
+    sys.modules[name] = m
+    parent, _, child = name.rpartition(".")
+    if parent in sys.modules:
+        setattr(sys.modules[parent], child, m)
+    return m
+
+
+# -------------------- stub modules --------------------
+
+def _dt_module() -> types.ModuleType:
+    def now(time_zone: Optional[tzinfo] = None) -> datetime:
+        return _now["v"]
+
+    def utcnow() -> datetime:
+        return _now["v"].astimezone(timezone.utc)
+
+    def as_local(value: datetime) -> datetime:
+        return value.astimezone(TZ)
+
+    def start_of_local_day(day: Optional[date] = None) -> datetime:
+        day = day or _now["v"].date()
+        return datetime(day.year, day.month, day.day, tzinfo=TZ)
+
+    return _mod(
+        "homeassistant.util.dt",
+        now=now, utcnow=utcnow, as_local=as_local, as_utc=lambda v: v.astimezone(timezone.utc),
+        start_of_local_day=start_of_local_day, get_default_time_zone=lambda: TZ,
+        DEFAULT_TIME_ZONE=TZ, UTC=timezone.utc,
+    )
+
+
+class _Vol(types.ModuleType):
+    """voluptuous giả: mọi validator trả về chính giá trị (chỉ cần import được)."""
+
+    def __getattr__(self, name: str) -> Any:
+        def _factory(*args: Any, **kwargs: Any) -> Any:
+            return args[0] if args else None
+        return _factory
+
+
+def install() -> None:
+    """Cài stub homeassistant.* vào sys.modules (gọi trước khi import evn)."""
+    if getattr(install, "_done", False):
+        return
+    install._done = True  # type: ignore[attr-defined]
+
+    def callback(func: Callable) -> Callable:
+        return func
+
+    class HomeAssistantError(Exception):
+        pass
+
+    class SupportsResponse:
+        NONE, OPTIONAL, ONLY = "none", "optional", "only"
+
+    _mod("homeassistant")
+    _mod("homeassistant.util")
+    _dt_module()
+    _mod("homeassistant.core", HomeAssistant=object, ServiceCall=object, ServiceResponse=dict,
+         SupportsResponse=SupportsResponse, callback=callback, Event=object)
+    _mod("homeassistant.const", EVENT_HOMEASSISTANT_STOP="homeassistant_stop")
+    _mod("homeassistant.config_entries", ConfigEntry=object)
+    _mod("homeassistant.exceptions", HomeAssistantError=HomeAssistantError,
+         ServiceValidationError=HomeAssistantError)
+    _mod("homeassistant.helpers")
+    _mod("homeassistant.helpers.config_validation",
+         string=str, date=str, boolean=bool, positive_int=int,
+         config_entry_only_config_schema=lambda domain: None)
+    _mod("homeassistant.helpers.dispatcher",
+         async_dispatcher_send=lambda hass, signal, *a: hass.dispatched.append(signal),
+         async_dispatcher_connect=lambda hass, signal, cb: (lambda: None))
+    _mod("homeassistant.helpers.event",
+         async_call_later=lambda hass, delay, action: (lambda: None),
+         async_track_state_change_event=lambda hass, ids, action: (lambda: None),
+         async_track_time_interval=lambda hass, action, interval: (lambda: None))
+    _mod("homeassistant.helpers.storage", Store=FakeStore)
+    try:
+        import voluptuous  # noqa: F401
+    except ImportError:
+        sys.modules["voluptuous"] = _Vol("voluptuous")
+
+    comp = os.path.join(ROOT, "custom_components")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    if comp not in sys.path:
+        sys.path.insert(0, comp)
+
+
+# -------------------- fake objects --------------------
+
+class FakeState:
+    __slots__ = ("entity_id", "state")
+
+    def __init__(self, entity_id: str, state: str) -> None:
+        self.entity_id = entity_id
+        self.state = state
+
+
+class FakeStates:
+    def __init__(self) -> None:
+        self._states: Dict[str, FakeState] = {}
+
+    def get(self, entity_id: str) -> Optional[FakeState]:
+        return self._states.get(entity_id)
+
+    def set(self, entity_id: str, value: Any) -> None:
+        self._states[entity_id] = FakeState(entity_id, str(value))
+
+
+class FakeBus:
+    def async_listen_once(self, event_type: str, cb: Callable) -> Callable[[], None]:
+        return lambda: None
+
+    def async_listen(self, event_type: str, cb: Callable) -> Callable[[], None]:
+        return lambda: None
+
+
+class FakeHass:
+    def __init__(self, workers: int = 4) -> None:
+        self.states = FakeStates()
+        self.bus = FakeBus()
+        self.data: Dict[str, Any] = {}
+        self.dispatched: list = []
+        self._tasks: set = set()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fake_hass")
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_running_loop()
+
+    async def async_add_executor_job(self, func: Callable, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def async_create_task(self, coro, *args: Any, **kwargs: Any) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def async_create_background_task(self, coro, *args: Any, **kwargs: Any) -> asyncio.Task:
+        return self.async_create_task(coro)
+
+    async def async_block_till_done(self) -> None:
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class FakeStore:
+    """Giống Store: async_save serialize toàn bộ JSON.
+
+    async_delay_save như HA: mỗi lần gọi huỷ timer cũ và hẹn lại từ đầu;
+    async_save huỷ lần ghi trễ đang chờ.
+    """
+
+    def __init__(self, hass: Any = None, version: int = 1, key: str = "bench") -> None:
+        self.saves = 0
+        self.delayed = 0          # số lần gọi async_delay_save
+        self.delayed_writes = 0   # số lần ghi trễ thực sự tới hạn
+        self.bytes = 0
+        self._data: Any = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._data_func: Optional[Callable[[], Any]] = None
+
+    async def async_load(self) -> Any:
+        return self._data
+
+    def _write(self, data: Any) -> None:
+        self.saves += 1
+        raw = json.dumps(data, default=str)
+        self.bytes += len(raw)
+        self._data = json.loads(raw)
+
+    def _cancel_delay(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def async_save(self, data: Any) -> None:
+        self._cancel_delay()
+        self._write(data)
+
+    def async_delay_save(self, data_func: Callable[[], Any], delay: float = 0) -> None:
+        self.delayed += 1
+        self._cancel_delay()
+        self._data_func = data_func
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_delay)
+
+    def _on_delay(self) -> None:
+        self._timer = None
+        self.delayed_writes += 1
+        self._write(self._data_func())
+
+
+class FakeEntry:
+    def __init__(self, entry_id: str, data: Optional[Dict[str, Any]] = None) -> None:
+        self.entry_id = entry_id
+        self.data = data or {}
+        self.options: Dict[str, Any] = {}
@@ -1,11 +1,19 @@
 from __future__ import annotations
+import asyncio
+import logging
 import os
-from datetime import timedelta
-from typing import Any, Dict, Tuple
+import time
+from datetime import date, datetime, timedelta
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Tuple
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant, callback
-from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.event import (
+    async_call_later, async_track_state_change_event, async_track_time_interval,
+)
+from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.storage import Store
 from homeassistant.util import dt as dt_util
 from homeassistant.helpers.dispatcher import async_dispatcher_send, async_dispatcher_connect
@@ -13,15 +21,57 @@ from homeassistant.helpers.dispatcher import async_dispatcher_send, async_dispat
 from .const import (
     DOMAIN, NAME,
     CONF_FORWARD, CONF_REVERSE, CONF_INTERVAL_MIN, CONF_DIR,
+    CONF_SAVE_DELAY_SEC, DEFAULT_SAVE_DELAY_SEC,
+    CONF_UPDATE_MODE, CONF_MIN_SPACING_SEC, CONF_MAX_STALE_MIN,
+    DEFAULT_UPDATE_MODE, DEFAULT_MIN_SPACING_SEC, DEFAULT_MAX_STALE_MIN,
+    UPDATE_MODE_EVENT, UPDATE_MODES,
+    CONF_HEARTBEAT_MIN, DEFAULT_HEARTBEAT_MIN,
+    CONF_BINARY_HISTORY, DEFAULT_BINARY_HISTORY,
+    CONF_RETENTION_YEARS, DEFAULT_RETENTION_YEARS,
+    CONF_EXTERNAL_STATS, DEFAULT_EXTERNAL_STATS, CONF_PREFIX, DEFAULT_PREFIX,
+    CONF_SAMPLE_SEC, DEFAULT_SAMPLE_SEC,
+    CONF_BILLING_MODE, DEFAULT_BILLING_MODE, BILLING_MODES, BILLING_TOU,
+    DATA_COORDINATOR, PERF_KEY,
     STORAGE_KEY_FMT, STORAGE_VERSION,
     CSV_HEADER,
-    EVN_TIERS, EVN_SELL_PRICE,
     OPT_BUY_DAY, OPT_BUY_MONTH, OPT_BUY_YEAR,
     OPT_SELL_DAY, OPT_SELL_MONTH, OPT_SELL_YEAR,
 )
+from .analytics import analyze_year_sync, source_signature
+from .coordinator import DJCoordinator
+from .external_stats import (
+    IMPORT_BATCH, STAT_KINDS, last_stat, statistic_id, statistic_metadata, statistics_since_sync,
+)
+from .forecast import close_days, empty_forecast, project_month, tier_crossings
+from .perf import HotPathStats
+from .writer import HistoryWriterThread
+from .history import BIN_COLS, BinaryHistoryWriter, CsvTailWriter, bin_paths
+from .intraday import IntradayBuckets, load_intraday_sync
+from .rebuild import (
+    history_years, rebuild_from_statistics, rebuild_from_summaries, summarize_year_sync,
+)
+from .rollup import (
+    append_daily_sync, compact_years_sync, compress_closed_years_sync, daily_path, format_daily_row,
+)
+from .sampling import POWER_WINDOW_SEC, SampleRing
+from .services import async_setup_services
+from .tariff import TariffSchedule, default_schedule, load_schedule_sync
+from .tou import (
+    TOU_STATE_KEYS, TouTariff, add_delta, default_tou, empty_scope, load_tou_sync, period_values,
+    seed_scope,
+)
+
+_LOGGER = logging.getLogger(__name__)
 
 PLATFORMS = ["sensor"]
 
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+
+async def async_setup(hass: HomeAssistant, config: Dict[str, Any]):
+    async_setup_services(hass)
+    return True
+
 
 # -------------------- Setup entry --------------------
 
@@ -29,74 +79,109 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     data = dict(entry.data)
     forward = data[CONF_FORWARD]
     reverse  = data[CONF_REVERSE]
-    interval_min = int(data[CONF_INTERVAL_MIN])
 
     base_dir = data[CONF_DIR]
 
-    # ==== FIX: makedirs với exist_ok=True trong executor ====
-    def _makedirs_sync(path: str):
-        os.makedirs(path, exist_ok=True)
-    await hass.async_add_executor_job(_makedirs_sync, base_dir)
-
-    # CSV theo năm trong đúng thư mục đã cấu hình
+    # CSV theo năm trong đúng thư mục đã cấu hình (thư mục/file được tạo ở nền)
     year = dt_util.now().strftime("%Y")
     csv_path = os.path.join(base_dir, f"{year}.csv")
 
-    async def _ensure_csv(path: str):
-        def _sync():
-            if not os.path.exists(path):
-                with open(path, "w", encoding="utf-8") as f:
-                    f.write(CSV_HEADER + "\n")
-        await hass.async_add_executor_job(_sync)
-    await _ensure_csv(csv_path)
+    def _prepare_dir_sync(path: str):
+        os.makedirs(base_dir, exist_ok=True)
+        if not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(CSV_HEADER + "\n")
 
     store  = Store(hass, STORAGE_VERSION, STORAGE_KEY_FMT.format(entry_id=entry.entry_id))
     stored = await store.async_load() or {}
 
     dj = DJRuntime(hass, entry, forward, reverse, csv_path, store, stored)
-    hass.data.setdefault(DOMAIN, {})[entry.entry_id] = dj
+    dj.save_delay = int(data.get(CONF_SAVE_DELAY_SEC, DEFAULT_SAVE_DELAY_SEC))
+    dj.heartbeat = int(data.get(CONF_HEARTBEAT_MIN, DEFAULT_HEARTBEAT_MIN)) * 60
+    dj.set_billing_mode(data.get(CONF_BILLING_MODE, DEFAULT_BILLING_MODE))
+    # sensor hiện ngay giá trị đã lưu lần trước, chưa cần chờ lần tính đầu
+    dj.restore_snapshot()
+    dj.binary_history = bool(data.get(CONF_BINARY_HISTORY, DEFAULT_BINARY_HISTORY))
+    dj.retention_years = int(data.get(CONF_RETENTION_YEARS, DEFAULT_RETENTION_YEARS))
+    dj.external_statistics = bool(data.get(CONF_EXTERNAL_STATS, DEFAULT_EXTERNAL_STATS))
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    domain_data[entry.entry_id] = dj
+    # Một bộ hẹn giờ + một luồng ghi file dùng chung cho mọi công tơ
+    if DATA_COORDINATOR not in domain_data:
+        domain_data[DATA_COORDINATOR] = DJCoordinator(hass)
+    coordinator: DJCoordinator = domain_data[DATA_COORDINATOR]
+    dj.writer = coordinator.writer
 
     async def _start_interval(minutes: int):
         if getattr(dj, "unsub", None):
             dj.unsub()
-        @callback
-        async def _tick(now):
-            await dj.async_update(now)
-        dj.unsub = async_track_time_interval(hass, _tick, timedelta(minutes=minutes))
+            dj.unsub = None
+        coordinator.register(dj, minutes)
+        dj.unsub = partial(coordinator.unregister, dj)
+
+    async def _start_schedule(cfg: Dict[str, Any]):
+        if cfg.get(CONF_UPDATE_MODE, DEFAULT_UPDATE_MODE) == UPDATE_MODE_EVENT:
+            dj.start_event_mode(
+                int(cfg.get(CONF_MIN_SPACING_SEC, DEFAULT_MIN_SPACING_SEC)),
+                int(cfg.get(CONF_MAX_STALE_MIN, DEFAULT_MAX_STALE_MIN)),
+            )
+        else:
+            await _start_interval(int(cfg[CONF_INTERVAL_MIN]))
 
-    await dj.async_update(now=None)
-    await _start_interval(interval_min)
+    async def _async_start() -> None:
+        """Phần phụ thuộc đĩa/lịch sử của setup: chạy nền sau khi sensor đã lên.
+
+        Bước nào lỗi (thư mục không ghi được, file giá hỏng...) thì ghi log và vẫn
+        bật lịch cập nhật, để sensor không đứng yên ở snapshot cho tới lần reload.
+        """
+        try:
+            await hass.async_add_executor_job(_prepare_dir_sync, csv_path)
+            dj.tariffs = await hass.async_add_executor_job(load_schedule_sync, base_dir)
+            dj.tou = await hass.async_add_executor_job(load_tou_sync, base_dir)
+            dj.intraday = await hass.async_add_executor_job(
+                load_intraday_sync, base_dir, dt_util.now().date(),
+                dt_util.get_default_time_zone(), dj.tariffs,
+            )
+            # năm cũ còn để thô (vd. HA tắt lúc qua năm, hoặc bản cũ chưa nén)
+            dj.async_start_archive(int(year))
+            if dj.external_statistics:
+                dj.async_schedule_statistics()   # lần đầu = backfill từ các file lịch sử
+            await dj.async_update(now=None)
+        except asyncio.CancelledError:
+            raise   # entry bị unload giữa chừng: không bật lịch nữa
+        except Exception:
+            _LOGGER.exception("Khởi động %s lỗi (thư mục %s); vẫn bật lịch cập nhật",
+                              entry.entry_id, base_dir)
+        if dj.closed:
+            return   # unload đã bắt đầu trong lúc chờ I/O: không bật lịch cho runtime đã gỡ
+        # options có thể đã đổi trong lúc chờ -> đọc lại entry.data
+        cfg = dict(entry.data)
+        await _start_schedule(cfg)
+        dj.start_sampling(int(cfg.get(CONF_SAMPLE_SEC, DEFAULT_SAMPLE_SEC)))
 
     async def _apply_one_shot(values: Dict[str, Any]) -> None:
         if not values:
             return
-        acc_f, acc_r = dj._refresh_accepted()
 
-        def base_from(total: float, desired: Any) -> float | None:
+        def reading(desired: Any) -> float | None:
             if desired is None or desired == "":
                 return None
             try:
-                v = max(float(desired), 0.0)
+                return max(float(desired), 0.0)
             except Exception:
                 return None
-            return max(total - v, 0.0)
-
-        b_day = base_from(acc_f, values.get(OPT_BUY_DAY))
-        s_day = base_from(acc_r, values.get(OPT_SELL_DAY))
-        if b_day is not None: dj.data["day"]["f_base"] = b_day
-        if s_day is not None: dj.data["day"]["r_base"] = s_day
 
-        b_mon = base_from(acc_f, values.get(OPT_BUY_MONTH))
-        s_mon = base_from(acc_r, values.get(OPT_SELL_MONTH))
-        if b_mon is not None: dj.data["month"]["f_base"] = b_mon
-        if s_mon is not None: dj.data["month"]["r_base"] = s_mon
-
-        b_year = base_from(acc_f, values.get(OPT_BUY_YEAR))
-        s_year = base_from(acc_r, values.get(OPT_SELL_YEAR))
-        if b_year is not None: dj.data["year"]["f_base"] = b_year
-        if s_year is not None: dj.data["year"]["r_base"] = s_year
-
-        await dj.store.async_save(dj.data)
+        wanted = {
+            ("day", "f_base"): reading(values.get(OPT_BUY_DAY)),
+            ("day", "r_base"): reading(values.get(OPT_SELL_DAY)),
+            ("month", "f_base"): reading(values.get(OPT_BUY_MONTH)),
+            ("month", "r_base"): reading(values.get(OPT_SELL_MONTH)),
+            ("year", "f_base"): reading(values.get(OPT_BUY_YEAR)),
+            ("year", "r_base"): reading(values.get(OPT_SELL_YEAR)),
+        }
+        # baseline được tính và ghi trong lần chạy pipeline kế tiếp (không chen giữa một tick);
+        # async_update sẽ lưu ngay nếu có baseline thay đổi
+        dj.queue_baselines({k: v for k, v in wanted.items() if v is not None})
         await dj.async_update(now=None)
 
     async def _options_updated(hass: HomeAssistant, updated_entry: ConfigEntry):
@@ -104,17 +189,39 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
             return
         opts = dict(updated_entry.options or {})
 
-        # 1) đổi interval (KHÔNG await – đây không phải coroutine)
-        if CONF_INTERVAL_MIN in opts and opts[CONF_INTERVAL_MIN] is not None:
+        # 1) đổi chế độ cập nhật / interval / độ trễ ghi -> lưu vào entry.data
+        new_data = dict(updated_entry.data)
+        for key, lo in ((CONF_INTERVAL_MIN, 1), (CONF_MIN_SPACING_SEC, 0),
+                        (CONF_MAX_STALE_MIN, 1), (CONF_SAVE_DELAY_SEC, 0),
+                        (CONF_HEARTBEAT_MIN, 0), (CONF_RETENTION_YEARS, 0),
+                        (CONF_SAMPLE_SEC, 0)):
+            if opts.get(key) is None:
+                continue
             try:
-                new_min = max(1, int(opts.get(CONF_INTERVAL_MIN)))
+                new_data[key] = max(lo, int(opts[key]))
             except Exception:
-                new_min = None
-            if new_min:
-                new_data = dict(updated_entry.data)
-                new_data[CONF_INTERVAL_MIN] = new_min
-                hass.config_entries.async_update_entry(updated_entry, data=new_data)
-                await _start_interval(new_min)
+                pass
+        if opts.get(CONF_UPDATE_MODE) in UPDATE_MODES:
+            new_data[CONF_UPDATE_MODE] = opts[CONF_UPDATE_MODE]
+        for key in (CONF_BINARY_HISTORY, CONF_EXTERNAL_STATS):
+            if opts.get(key) is not None:
+                new_data[key] = bool(opts[key])
+        if opts.get(CONF_BILLING_MODE) in BILLING_MODES:
+            new_data[CONF_BILLING_MODE] = opts[CONF_BILLING_MODE]
+
+        if new_data != dict(updated_entry.data):
+            # KHÔNG await – đây không phải coroutine
+            hass.config_entries.async_update_entry(updated_entry, data=new_data)
+            dj.save_delay = int(new_data.get(CONF_SAVE_DELAY_SEC, DEFAULT_SAVE_DELAY_SEC))
+            dj.heartbeat = int(new_data.get(CONF_HEARTBEAT_MIN, DEFAULT_HEARTBEAT_MIN)) * 60
+            dj.binary_history = bool(new_data.get(CONF_BINARY_HISTORY, DEFAULT_BINARY_HISTORY))
+            dj.retention_years = int(new_data.get(CONF_RETENTION_YEARS, DEFAULT_RETENTION_YEARS))
+            dj.external_statistics = bool(new_data.get(CONF_EXTERNAL_STATS, DEFAULT_EXTERNAL_STATS))
+            dj.set_billing_mode(new_data.get(CONF_BILLING_MODE, DEFAULT_BILLING_MODE))
+            if dj.external_statistics:
+                dj.async_schedule_statistics()
+            await _start_schedule(new_data)
+            dj.start_sampling(int(new_data.get(CONF_SAMPLE_SEC, DEFAULT_SAMPLE_SEC)))
 
         # 2) áp các ô one-shot vào baseline
         await _apply_one_shot(opts)
@@ -125,30 +232,85 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
 
     entry.async_on_unload(entry.add_update_listener(_options_updated))
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    # unload entry sẽ tự huỷ task này nếu nó chưa xong
+    dj.start_task = entry.async_create_background_task(
+        hass, _async_start(), f"{DOMAIN} start {entry.entry_id}"
+    )
     return True
 
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     dj: DJRuntime | None = hass.data[DOMAIN].pop(entry.entry_id, None)
+    if dj:
+        dj.closed = True
+        # HA chỉ huỷ background task sau khi unload xong -> tự huỷ và chờ phần khởi động nền
+        task = dj.start_task
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.wait([task])
     if dj and dj.unsub:
         dj.unsub()
+    if dj:
+        dj.stop_sampling()
+    if dj and dj.profile:
+        await dj.profile.async_stop()
+    if dj and dj._stats_task and not dj._stats_task.done():
+        dj._stats_task.cancel()
+    if dj:
+        await dj.async_flush()
+        await dj.async_close_history()
+    coordinator: DJCoordinator | None = hass.data[DOMAIN].get(DATA_COORDINATOR)
+    if coordinator and coordinator.idle and not any(
+        isinstance(v, DJRuntime) for v in hass.data[DOMAIN].values()
+    ):
+        hass.data[DOMAIN].pop(DATA_COORDINATOR)
+        await coordinator.async_shutdown()
     return await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
 
 
 # -------------------- Dispatcher helpers --------------------
 
-def _sig(entry_id: str) -> str:
-    return f"{DOMAIN}_update_{entry_id}"
+def _sig(entry_id: str, key: str | None = None) -> str:
+    if key is None:
+        return f"{DOMAIN}_update_{entry_id}"
+    return f"{DOMAIN}_update_{entry_id}_{key}"
 
-def async_dispatch_update(hass: HomeAssistant, entry_id: str):
-    async_dispatcher_send(hass, _sig(entry_id))
+def async_dispatch_update(hass: HomeAssistant, entry_id: str, keys: Iterable[str] | None = None):
+    """keys=None: báo cho mọi listener của entry; ngược lại chỉ các key đã đổi."""
+    if keys is None:
+        async_dispatcher_send(hass, _sig(entry_id))
+        return
+    for key in keys:
+        async_dispatcher_send(hass, _sig(entry_id, key))
 
-def async_listen_update(hass: HomeAssistant, entry_id: str, update_cb):
-    return async_dispatcher_connect(hass, _sig(entry_id), update_cb)
+def async_listen_update(hass: HomeAssistant, entry_id: str, update_cb, key: str | None = None):
+    return async_dispatcher_connect(hass, _sig(entry_id, key), update_cb)
 
 
 # -------------------- Runtime --------------------
 
+# Không khôi phục sau khởi động lại: công suất cũ không còn đúng
+_VOLATILE_KEYS = ("import_power", "export_power")
+
+def _empty_closed() -> Dict[str, float]:
+    return {"buy": 0.0, "sell": 0.0, "cost": 0.0, "revenue": 0.0}
+
+def _months_from(first: str, stop: str) -> List[str]:
+    """Các tháng "YYYY-MM" từ `first` tới trước `stop`."""
+    y, m = int(first[:4]), int(first[5:7])
+    out = []
+    while f"{y:04d}-{m:02d}" < stop:
+        out.append(f"{y:04d}-{m:02d}")
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return out
+
+def _state_float(st) -> float | None:
+    try:
+        return float(st.state) if st and st.state not in ("unknown","unavailable","none","") else None
+    except Exception:
+        return None
+
+
 class DJRuntime:
     def __init__(self, hass: HomeAssistant, entry: ConfigEntry,
                  forward_entity: str, reverse_entity: str,
@@ -161,70 +323,242 @@ class DJRuntime:
         self.store = store
         self.data = stored
         self.unsub = None
+        self._csv_writer: CsvTailWriter | None = None
+        self._bin_writer: BinaryHistoryWriter | None = None
+        self.writer: HistoryWriterThread | None = None   # luồng ghi (từ coordinator)
+        self.binary_history: bool = False
+        self.retention_years: int = 0
+
+        # Thống kê dài hạn: giờ (date, hour) của tick trước + job nhập đang chạy
+        self.external_statistics: bool = False
+        self._stats_hour: Tuple[str, int] | None = None
+        self._stats_task: asyncio.Task | None = None
+        # phần khởi động nền (_async_start) và cờ đã unload
+        self.start_task: asyncio.Task | None = None
+        self.closed = False
+
+        # Đường cập nhật một luồng: future của lần chạy đang dở + cờ "chạy thêm một lần"
+        self._running: asyncio.Future | None = None
+        self._rerun: bool = False
+
+        # Các phần của self.data đã đổi nhưng chưa ghi xuống .storage
+        self._dirty: set[str] = set()
+        self.save_delay: int = DEFAULT_SAVE_DELAY_SEC
+        # Đã hẹn một lần ghi trễ chưa tới hạn (Store huỷ/hẹn lại timer mỗi lần gọi)
+        self._save_pending: bool = False
+
+        # Chế độ event: thời điểm tính gần nhất (monotonic) + các hẹn giờ
+        self._last_run: float = 0.0
+        self._min_spacing: float = 0.0
+        self._max_stale: float = 0.0
+        self._pending_unsub = None
+        self._stale_unsub = None
+
+        # Snapshot đã phát cho sensor (đúng độ chính xác sensor hiển thị)
+        self._published: Dict[str, Any] = {}
+        self._published_at: Dict[str, float] = {}
+        self.heartbeat: int = 0  # giây; 0 = chỉ phát khi đổi
+
+        self.tariffs: TariffSchedule = default_schedule()
+
+        # Tính tiền theo khung giờ: bộ cộng dồn kWh/tiền theo khung nằm ở data["tou"]
+        self.billing_mode: str = DEFAULT_BILLING_MODE
+        self.tou: TouTariff = default_tou()
+
+        # Thời lượng từng pha của tick + bộ đếm ghi (sensor chẩn đoán / diagnostics)
+        self.perf = HotPathStats()
+        self.profile = None   # ProfileSession đang chạy (service evn.profile)
 
         self.state: Dict[str, Any] = {
             "total_buy": 0.0, "buy_day": 0.0, "buy_month": 0.0, "buy_year": 0.0,
             "total_sell": 0.0, "sell_day": 0.0, "sell_month": 0.0, "sell_year": 0.0,
             "buy_cost_day": 0.0, "buy_cost_month": 0.0, "buy_cost_year": 0.0,
             "sell_revenue_day": 0.0, "sell_revenue_month": 0.0, "sell_revenue_year": 0.0,
+            "import_power": None, "export_power": None,
+            "forecast_buy_month": None, "forecast_cost_month": None,
             "last_updated": None,
+            **dict.fromkeys(TOU_STATE_KEYS),
         }
 
+        # kWh theo giờ hôm nay / theo ngày tháng này (thuộc tính của sensor ngày/tháng)
+        self.intraday = IntradayBuckets()
+        # Kết quả service analytics theo (năm, top): (khoá dữ liệu nguồn, kết quả)
+        self._analytics: Dict[Tuple[int, int], Tuple[Any, Dict[str, Any]]] = {}
+        # Thuộc tính của sensor dự báo: tốc độ kWh/ngày + ngày dự kiến vượt từng bậc
+        self._forecast_attrs: Dict[str, Any] = {}
+        # Thay đổi baseline chờ áp ở đầu lần async_compute kế tiếp (options one-shot, rebuild)
+        self._pending_bases: Dict[Tuple[str, str], float] = {}
+        self._pending_rebuild: Dict[str, Any] | None = None
+
+        # Số đọc gần nhất (mẫu nhanh + mỗi tick) -> công suất mua/bán
+        self.samples = SampleRing()
+        self._sample_unsub = None
+
         self.data.setdefault("accepted", {"forward": None, "reverse": None})
         self.data.setdefault("day",   {"date": None,  "f_base": None, "r_base": None})
         self.data.setdefault("month", {"month": None, "f_base": None, "r_base": None})
-        self.data.setdefault("year",  {"year": None,  "f_base": None, "r_base": None, "months": {}})
+        self.data.setdefault("year",  {"year": None,  "f_base": None, "r_base": None})
+        self.data.setdefault("ledger", {})
+        self.data.setdefault("forecast", empty_forecast())
+        self._migrate_months()
 
     async def async_update(self, now):
+        job = await self.async_run(now)
+        if job is not None:
+            await self._async_submit(job)
+
+    async def async_run(self, now) -> Callable[[], None] | None:
+        """Chạy async_compute qua một đường duy nhất (tick, event, options, rebuild).
+
+        Kích hoạt tới khi đang tính dở không chạy song song mà dồn thành tối đa
+        một lần chạy tiếp theo, và chờ lần đó xong mới trả về (None). Đĩa chậm
+        chỉ làm cập nhật thưa/trễ hơn, không sinh hàng đợi hay ghi baseline chồng nhau.
+        Trả về job ghi lịch sử của lần chạy cuối cho người gọi đẩy vào luồng ghi.
+        """
+        if self._running is not None:
+            self.perf.count("updates_merged")
+            self._rerun = True
+            await asyncio.shield(self._running)
+            return None
+        self._running = self.hass.loop.create_future()
+        try:
+            job = await self.async_compute(now)
+            while self._rerun:
+                self._rerun = False
+                await self._async_submit(job)
+                job = await self.async_compute(None)
+            return job
+        finally:
+            running, self._running = self._running, None
+            self._rerun = False
+            running.set_result(None)
+
+    async def _async_submit(self, job: Callable[[], None]) -> None:
+        if self.writer is not None:
+            self.writer.submit(job)
+        else:
+            await self.hass.async_add_executor_job(job)
+
+    async def async_compute(self, now) -> Callable[[], None]:
+        """Tính + lưu + phát state trong event loop; trả về job ghi lịch sử (chạy ở executor)."""
+        self._last_run = time.monotonic()
+        self._arm_stale()
+        perf = self.perf
+        perf.count("ticks")
+        t0 = time.perf_counter()
+        self._apply_pending()
+        # Số đọc cuối cùng đã thấy trước tick này: dùng làm mốc chuyển kỳ,
+        # kể cả khi HA tắt vắt qua nửa đêm / đầu tháng / đầu năm.
+        prev = self.data["accepted"]
+        edge = (prev.get("forward"), prev.get("reverse"))
         acc_f, acc_r = self._refresh_accepted()
+        edge_f = acc_f if edge[0] is None else float(edge[0])
+        edge_r = acc_r if edge[1] is None else float(edge[1])
+        d_buy, d_sell = max(acc_f - edge_f, 0.0), max(acc_r - edge_r, 0.0)
+        self._add_sample(acc_f, acc_r)
+        t1 = time.perf_counter()
+        perf.add("refresh", t1 - t0)
 
         now_dt   = dt_util.now()
         date_str = now_dt.date().isoformat()
         month_str = now_dt.strftime("%Y-%m")
         year_str  = now_dt.strftime("%Y")
+        self.intraday.add_tick(now_dt, edge_f, edge_r, d_buy, d_sell)
 
+        # Qua năm: đổi sang CSV năm mới (writer tự tạo file + header khi ghi)
         desired_csv = os.path.join(os.path.dirname(self.csv_path), f"{year_str}.csv")
         if os.path.normpath(desired_csv) != os.path.normpath(self.csv_path):
             self.csv_path = desired_csv
-            await self.hass.async_add_executor_job(self._ensure_csv_sync, self.csv_path)
-
-        if self.data["day"]["date"] != date_str or self.data["day"]["f_base"] is None:
-            self.data["day"]["date"]  = date_str
-            self.data["day"]["f_base"] = acc_f if self.data["day"]["f_base"] is None else self.data["day"]["f_base"]
-            self.data["day"]["r_base"] = acc_r if self.data["day"]["r_base"] is None else self.data["day"]["r_base"]
-
-        if self.data["month"]["month"] != month_str or self.data["month"]["f_base"] is None:
-            self.data["month"]["month"] = month_str
-            self.data["month"]["f_base"] = acc_f if self.data["month"]["f_base"] is None else self.data["month"]["f_base"]
-            self.data["month"]["r_base"] = acc_r if self.data["month"]["r_base"] is None else self.data["month"]["r_base"]
-
-        if self.data["year"]["year"] != year_str or self.data["year"]["f_base"] is None:
-            self.data["year"] = {
-                "year": year_str,
-                "f_base": acc_f if self.data["year"]["f_base"] is None else self.data["year"]["f_base"],
-                "r_base": acc_r if self.data["year"]["r_base"] is None else self.data["year"]["r_base"],
-                "months": self.data["year"].get("months") or {},
-            }
 
-        buy_day   = max(acc_f - (self.data["day"]["f_base"]   or 0.0), 0.0)
-        buy_month = max(acc_f - (self.data["month"]["f_base"] or 0.0), 0.0)
-        buy_year  = max(acc_f - (self.data["year"]["f_base"]  or 0.0), 0.0)
+        day, month, year = self.data["day"], self.data["month"], self.data["year"]
+        last_day = day["date"]
 
-        sell_day   = max(acc_r - (self.data["day"]["r_base"]   or 0.0), 0.0)
-        sell_month = max(acc_r - (self.data["month"]["r_base"] or 0.0), 0.0)
-        sell_year  = max(acc_r - (self.data["year"]["r_base"]  or 0.0), 0.0)
+        # Qua giờ: giờ trước đã trọn -> nhập thống kê theo lô ở nền
+        if self.external_statistics:
+            hour_key = (date_str, now_dt.hour)
+            if hour_key != self._stats_hour:
+                if self._stats_hour is not None:
+                    self.async_schedule_statistics()
+                self._stats_hour = hour_key
 
-        buy_cost_month_K = self._cost_K(buy_month)
-        mtd_at_midnight = max((self.data["day"]["f_base"] or 0.0) - (self.data["month"]["f_base"] or 0.0), 0.0)
-        buy_cost_day_K = max(buy_cost_month_K - self._cost_K(mtd_at_midnight), 0.0)
+        if day["f_base"] is None:
+            day.update(date=date_str, f_base=acc_f, r_base=acc_r)
+            self.mark_dirty("day")
+        elif day["date"] != date_str:
+            await self._async_roll_up_day(edge_f, edge_r)
+            self._close_day_forecast(edge_f, now_dt.date())
+            day.update(date=date_str, f_base=edge_f, r_base=edge_r)
+            self.mark_dirty("day")
+            self._reset_tou("day")
 
-        months_map = self.data["year"].get("months") or {}
-        sum_past_months_K = sum(self._cost_K(kwh_m) for kwh_m in months_map.values())
-        buy_cost_year_K = sum_past_months_K + buy_cost_month_K
+        # HA tắt vắt qua hơn một ranh giới tháng: phần tăng lúc tắt được chia cho các tháng
+        gap: List[Tuple[str, float, float]] = []
+        if month["f_base"] is None:
+            month.update(month=month_str, f_base=acc_f, r_base=acc_r)
+            self.mark_dirty("month")
+        elif month["month"] != month_str:
+            gap = self._split_gap(month["month"], month_str, last_day, now_dt,
+                                  acc_f - edge_f, acc_r - edge_r)
+            old_f, old_r = (gap[0][1], gap[0][2]) if gap else (0.0, 0.0)
+            self._close_month(edge_f + old_f, edge_r + old_r, last_day, extra_buy=old_f)
+            mark_f, mark_r = edge_f + old_f, edge_r + old_r
+            for month_gap, b, s in gap[1:]:
+                self._close_skipped_month(month_gap, b, s)
+                mark_f, mark_r = mark_f + b, mark_r + s
+            month.update(month=month_str, f_base=mark_f, r_base=mark_r)
+            self._reset_tou("month")
 
-        sell_rev_day_K   = (sell_day   * EVN_SELL_PRICE) / 1000.0
-        sell_rev_month_K = (sell_month * EVN_SELL_PRICE) / 1000.0
-        sell_rev_year_K  = (sell_year  * EVN_SELL_PRICE) / 1000.0
+        if year["f_base"] is None:
+            year.update(year=year_str, f_base=acc_f, r_base=acc_r)
+            self.mark_dirty("year")
+        elif year["year"] != year_str:
+            # phần của các tháng thuộc năm cũ không tính vào năm mới
+            old_f = sum(b for m, b, _s in gap if m[:4] < year_str)
+            old_r = sum(s for m, _b, s in gap if m[:4] < year_str)
+            closed = _empty_closed()
+            for m, _b, _s in gap:
+                if m.startswith(year_str):   # tháng bị bỏ qua của năm mới đã chốt ở trên
+                    for key in closed:
+                        closed[key] = round(closed[key] + self.data["ledger"][m][key], 3)
+            year.update(year=year_str, f_base=edge_f + old_f, r_base=edge_r + old_r, closed=closed)
+            self.mark_dirty("year")
+            self._reset_tou("year")
+            self.async_start_archive(int(year_str))
+
+        buy_day   = max(acc_f - (day["f_base"]   or 0.0), 0.0)
+        buy_month = max(acc_f - (month["f_base"] or 0.0), 0.0)
+        buy_year  = max(acc_f - (year["f_base"]  or 0.0), 0.0)
+
+        sell_day   = max(acc_r - (day["r_base"]   or 0.0), 0.0)
+        sell_month = max(acc_r - (month["r_base"] or 0.0), 0.0)
+        sell_year  = max(acc_r - (year["r_base"]  or 0.0), 0.0)
+
+        tariff = self.tariffs.table_for(now_dt.date())
+        if self.billing_mode == BILLING_TOU:
+            tou = self._tou_tick(now_dt, d_buy, d_sell, (buy_day, buy_month, buy_year),
+                                 (sell_day, sell_month, sell_year))
+            if gap:   # tháng/năm này chỉ nhận một phần của lượng tăng lúc tắt
+                self._reseed_tou("month", acc_f, acc_r)
+                if year_str != gap[0][0][:4]:
+                    self._reseed_tou("year", acc_f, acc_r)
+            buy_cost_day_K, buy_cost_month_K = tou["day"]["cost"], tou["month"]["cost"]
+        else:
+            tou = None
+            buy_cost_month_K = tariff.cost_K(buy_month)
+            mtd_at_midnight = max((day["f_base"] or 0.0) - (month["f_base"] or 0.0), 0.0)
+            buy_cost_day_K = max(buy_cost_month_K - tariff.cost_K(mtd_at_midnight), 0.0)
+
+        forecast_kwh, forecast_cost_K = self._update_forecast(
+            now_dt, tariff, buy_month, buy_cost_month_K
+        )
+
+        sell_rev_day_K   = tariff.sell_K(sell_day)
+        sell_rev_month_K = tariff.sell_K(sell_month)
+
+        # Năm = tổng các tháng đã chốt (giữ sẵn trong ledger) + tháng hiện tại
+        closed = year["closed"]
+        buy_cost_year_K = closed["cost"] + buy_cost_month_K
+        sell_rev_year_K = closed["revenue"] + sell_rev_month_K
 
         self.state.update({
             "total_buy": acc_f, "buy_day": buy_day, "buy_month": buy_month, "buy_year": buy_year,
@@ -235,80 +569,628 @@ class DJRuntime:
             "sell_revenue_day": round(sell_rev_day_K, 1),
             "sell_revenue_month": round(sell_rev_month_K, 1),
             "sell_revenue_year": round(sell_rev_year_K, 1),
+            "forecast_buy_month": forecast_kwh,
+            "forecast_cost_month": forecast_cost_K,
             "last_updated": dt_util.now(),
+            **dict(zip(TOU_STATE_KEYS, period_values(tou))),
         })
 
-        await self.store.async_save(self.data)
-        await self._async_write_csv_row(dt_util.now())
-        async_dispatch_update(self.hass, self.entry.entry_id)
+        t2 = time.perf_counter()
+        perf.add("compute", t2 - t1)
+        await self.async_persist()
+        t3 = time.perf_counter()
+        perf.add("persist", t3 - t2)
+        self._publish()
+        perf.add("dispatch", time.perf_counter() - t3)
+        async_dispatch_update(self.hass, self.entry.entry_id, [PERF_KEY])
+        values = [self.state[k] for k in BIN_COLS]
+        return partial(self._write_history_sync, now_dt, self.csv_path, values)
+
+    # ---- rollups / retention ----
+    async def _async_roll_up_day(self, f_end: float, r_end: float) -> None:
+        """Ghi 1 dòng tổng hợp cho ngày vừa qua vào {year}.daily.csv (không đọc lại lịch sử)."""
+        day, month = self.data["day"], self.data["month"]
+        if not day["date"]:
+            return
+        buy = max(f_end - (day["f_base"] or 0.0), 0.0)
+        sell = max(r_end - (day["r_base"] or 0.0), 0.0)
+        mtd_end = max(f_end - (month["f_base"] or 0.0), 0.0)
+        tariff = self.tariffs.table_for(date.fromisoformat(day["date"]))
+        tou = self._tou_scope("day")
+        if tou is not None:
+            cost = tou["cost"]
+        else:
+            cost = tariff.cost_K(mtd_end) - tariff.cost_K(mtd_end - buy)
+        row = format_daily_row(day["date"], buy, sell, cost, tariff.sell_K(sell), f_end, r_end)
+        path = daily_path(self.base_dir, day["date"][:4])
+        await self.hass.async_add_executor_job(append_daily_sync, path, row)
+
+    def async_start_archive(self, current_year: int) -> None:
+        """Nén/compact các năm đã đóng ở nền; tick qua năm không phải chờ."""
+        self.hass.async_create_background_task(
+            self._async_archive(current_year), name=f"{DOMAIN} archive history",
+        )
+
+    async def _async_archive(self, current_year: int) -> None:
+        # chờ luồng ghi xong các dòng cuối của năm cũ trước khi động vào file
+        if self.writer is not None:
+            await self.hass.async_add_executor_job(self.writer.flush)
+        if self.retention_years:
+            await self.hass.async_add_executor_job(
+                compact_years_sync, self.base_dir, current_year - self.retention_years, self.tariffs,
+                self.history_tou,
+            )
+        await self.hass.async_add_executor_job(
+            compress_closed_years_sync, self.base_dir, current_year
+        )
+
+    # ---- long-term statistics ----
+    def async_schedule_statistics(self) -> None:
+        """Nhập các giờ chưa có vào thống kê recorder (một job tại một thời điểm)."""
+        if self._stats_task is None or self._stats_task.done():
+            self._stats_task = self.hass.async_create_background_task(
+                self._async_import_statistics(), name=f"{DOMAIN} import statistics",
+            )
+
+    async def _async_import_statistics(self) -> None:
+        from homeassistant.components.recorder import get_instance
+        from homeassistant.components.recorder.statistics import (
+            async_add_external_statistics, get_last_statistics,
+        )
+
+        # dòng cuối của giờ vừa trọn có thể vẫn đang trong hàng đợi ghi
+        if self.writer is not None:
+            await self.hass.async_add_executor_job(self.writer.flush)
+        tz = dt_util.get_default_time_zone()
+        prefix = self.entry.data.get(CONF_PREFIX, DEFAULT_PREFIX)
+        ids = {kind: statistic_id(prefix, kind) for kind in STAT_KINDS}
+        recorder = get_instance(self.hass)
+        last = {}
+        for kind, stat_id in ids.items():
+            found = await recorder.async_add_executor_job(
+                get_last_statistics, self.hass, 1, stat_id, False, {"sum"},
+            )
+            last[kind] = last_stat((found.get(stat_id) or [None])[0])
+        until = dt_util.now().replace(minute=0, second=0, microsecond=0)
+        points = await self.hass.async_add_executor_job(
+            statistics_since_sync, self.base_dir, last, until, self.tariffs, tz, self.history_tou,
+        )
+        for kind, stats in points.items():
+            meta = statistic_metadata(ids[kind], kind, prefix)
+            for i in range(0, len(stats), IMPORT_BATCH):
+                async_add_external_statistics(self.hass, meta, stats[i:i + IMPORT_BATCH])
+
+    # ---- time-of-use ----
+    def set_billing_mode(self, mode: str) -> None:
+        """Đổi cách tính tiền; rời ToU thì bỏ bộ cộng dồn (bật lại sẽ gieo lại)."""
+        self.billing_mode = mode if mode in BILLING_MODES else DEFAULT_BILLING_MODE
+        if self.billing_mode != BILLING_TOU and self.data.pop("tou", None) is not None:
+            self.mark_dirty("tou")
+
+    def _tou_scope(self, scope: str) -> Dict[str, Any] | None:
+        if self.billing_mode != BILLING_TOU:
+            return None
+        return (self.data.get("tou") or {}).get(scope)
+
+    @property
+    def history_tou(self) -> TouTariff | None:
+        """Bảng ToU để tính tiền dữ liệu lịch sử theo giờ (None = bậc thang)."""
+        return self.tou if self.billing_mode == BILLING_TOU else None
+
+    def _reseed_tou(self, scope: str, acc_f: float, acc_r: float) -> None:
+        """Baseline của `scope` vừa đổi: gieo lại riêng kỳ đó như giờ bình thường."""
+        tou = self.data.get("tou")
+        if tou is None:
+            return
+        section = self.data[scope]
+        normal_K = self.tou.price_K(dt_util.now().date(), "normal")
+        tou[scope] = seed_scope(max(acc_f - (section["f_base"] or 0.0), 0.0),
+                                max(acc_r - (section["r_base"] or 0.0), 0.0), normal_K)
+        self.mark_dirty("tou")
+
+    def _reset_tou(self, scope: str) -> None:
+        tou = self.data.get("tou")
+        if tou is not None:
+            tou[scope] = empty_scope()
+            self.mark_dirty("tou")
+
+    def _tou_tick(self, now_dt, d_buy: float, d_sell: float,
+                  buys: Tuple[float, float, float], sells: Tuple[float, float, float]) -> Dict[str, Any]:
+        """Cộng phần kWh của tick này vào khung giờ hiện hành: O(1), không quét lịch sử.
+
+        Lần đầu bật ToU giữa kỳ thì phần đã dùng trước đó được tính như giờ bình thường.
+        """
+        tou = self.data.get("tou")
+        today = now_dt.date()
+        if tou is None:
+            normal_K = self.tou.price_K(today, "normal")
+            tou = self.data["tou"] = {
+                scope: seed_scope(b, s, normal_K)
+                for scope, b, s in zip(("day", "month", "year"), buys, sells)
+            }
+            self.mark_dirty("tou")
+        elif d_buy or d_sell:
+            # phần tăng thuộc khoảng trước `now_dt` -> lấy khung của giây trước đó
+            period = self.tou.period_at(now_dt - timedelta(seconds=1))
+            add_delta(tou, period, d_buy, d_sell, d_buy * self.tou.price_K(today, period))
+            self.mark_dirty("tou")
+        return tou
+
+    # ---- month-end forecast ----
+    def _close_day_forecast(self, f_end: float, today: date) -> None:
+        """Qua ngày: đưa kWh mua của ngày vừa trọn vào EWMA tốc độ theo ngày."""
+        day = self.data["day"]
+        try:
+            gap = (today - date.fromisoformat(day["date"])).days
+        except (TypeError, ValueError):
+            gap = 1
+        close_days(self.data["forecast"], max(f_end - (day["f_base"] or 0.0), 0.0), gap)
+        self.mark_dirty("forecast")
+
+    def _update_forecast(self, now_dt, tariff, buy_month: float,
+                         buy_cost_month_K: float) -> Tuple[float | None, float | None]:
+        """(kWh, tiền K) cuối tháng dự kiến; O(số bậc) mỗi tick, không đọc lịch sử."""
+        projection = project_month(self.data["forecast"], buy_month, now_dt)
+        if projection is None:
+            self._forecast_attrs = {}
+            return None, None
+        projected, rate = projection
+        if self.billing_mode == BILLING_TOU:
+            # giá bình quân của tháng tới giờ (chưa có thì giá giờ bình thường)
+            avg_K = (buy_cost_month_K / buy_month if buy_month > 0
+                     else self.tou.price_K(now_dt.date(), "normal"))
+            cost_K = buy_cost_month_K + (projected - buy_month) * avg_K
+            crossings: List[Dict[str, Any]] = []
+        else:
+            cost_K = tariff.cost_K(projected)
+            crossings = tier_crossings(tariff.bounds, buy_month, projected, rate, now_dt)
+        self._forecast_attrs = {"daily_rate": round(rate, 3), "tier_crossings": crossings}
+        return round(projected, 3), round(cost_K, 1)
+
+    # ---- analytics ----
+    async def async_analytics(self, year: int, top: int) -> Dict[str, Any]:
+        """Hồ sơ tải của một năm, cache tới khi nguồn có dữ liệu mới.
+
+        Năm hiện tại chỉ tính tới hết hôm qua nên kết quả giữ nguyên cả ngày;
+        năm đã đóng thì theo kích thước/mtime file nguồn (đổi khi compact/nén).
+        """
+        today = dt_util.now().date()
+        if year >= today.year:
+            until = today - timedelta(days=1)
+            key: Any = (self.billing_mode, until)
+        else:
+            until = date(year, 12, 31)
+            key = (self.billing_mode,
+                   await self.hass.async_add_executor_job(source_signature, self.base_dir, year))
+        cached = self._analytics.get((year, top))
+        if cached and cached[0] == key:
+            return {**cached[1], "cached": True}
+        if self.writer is not None:
+            await self.hass.async_add_executor_job(self.writer.flush)
+        result = await self.hass.async_add_executor_job(
+            analyze_year_sync, self.base_dir, year, until,
+            dt_util.get_default_time_zone(), self.tariffs, top, self.history_tou,
+        )
+        self._analytics[(year, top)] = (key, result)
+        return {**result, "cached": False}
+
+    # ---- month ledger ----
+    def _close_month(self, f_end: float, r_end: float, last_day: str | None,
+                     extra_buy: float = 0.0) -> None:
+        """Chốt tháng cũ: đóng băng kWh mua/bán, tiền mua/bán vào ledger.
+
+        `extra_buy`: phần kWh ước tính lúc HA tắt đã gộp vào `f_end` (ToU: tính giá bình thường).
+        """
+        month = self.data["month"]
+        month_str = month["month"]
+        buy = max(f_end - (month["f_base"] or 0.0), 0.0)
+        sell = max(r_end - (month["r_base"] or 0.0), 0.0)
+        try:
+            price_day = date.fromisoformat(last_day or f"{month_str}-01")
+        except ValueError:
+            price_day = dt_util.now().date()
+        tariff = self.tariffs.table_for(price_day)
+        tou = self._tou_scope("month")
+        if tou is not None:
+            cost = tou["cost"] + extra_buy * self.tou.price_K(price_day, "normal")
+        else:
+            cost = tariff.cost_K(buy)
+        entry = {
+            "buy": round(buy, 3), "sell": round(sell, 3),
+            "cost": round(cost, 3), "revenue": round(tariff.sell_K(sell), 3),
+        }
+        if extra_buy:
+            entry["estimated"] = True
+        self._add_ledger(month_str, entry)
+
+    def _add_ledger(self, month_str: str, entry: Dict[str, Any]) -> None:
+        self.data["ledger"][month_str] = entry
+        year = self.data["year"]
+        if year["year"] and month_str.startswith(year["year"]):
+            closed = year["closed"]
+            for key in ("buy", "sell", "cost", "revenue"):
+                closed[key] = round(closed[key] + entry[key], 3)
+        self.mark_dirty("ledger", "month", "year")
+
+    def _close_skipped_month(self, month_str: str, buy: float, sell: float) -> None:
+        """Tháng HA tắt trọn: ghi ledger từ phần kWh ước tính, đánh dấu `estimated`."""
+        price_day = date.fromisoformat(f"{month_str}-01")
+        tariff = self.tariffs.table_for(price_day)
+        if self.billing_mode == BILLING_TOU:
+            cost = buy * self.tou.price_K(price_day, "normal")
+        else:
+            cost = tariff.cost_K(buy)
+        self._add_ledger(month_str, {
+            "buy": round(buy, 3), "sell": round(sell, 3),
+            "cost": round(cost, 3), "revenue": round(tariff.sell_K(sell), 3), "estimated": True,
+        })
+
+    def _split_gap(self, old: str, new: str, last_day: str | None, now_dt,
+                   d_buy: float, d_sell: float) -> List[Tuple[str, float, float]]:
+        """[(tháng, kWh mua, kWh bán)] cho tháng cũ + các tháng bị bỏ qua khi HA tắt qua >1 tháng.
+
+        Trong lúc tắt không có số đọc nào nên chỉ ước lượng: phần tăng từ tick cuối
+        (tính từ đầu ngày sau `last_day`) tới nay được chia theo tỷ lệ thời gian;
+        phần còn lại (tháng hiện tại) là phần chưa chia. Rỗng nếu chỉ qua một tháng.
+        """
+        months = _months_from(old, new)
+        if len(months) < 2:
+            return []
+        try:
+            since = dt_util.start_of_local_day(date.fromisoformat(last_day) + timedelta(days=1))
+        except (TypeError, ValueError):
+            since = dt_util.start_of_local_day(date.fromisoformat(f"{months[1]}-01"))
+        total = (now_dt - since).total_seconds()
+        out = []
+        for i, m in enumerate(months):
+            lo = max(since, dt_util.start_of_local_day(date.fromisoformat(f"{m}-01")))
+            nxt = months[i + 1] if i + 1 < len(months) else new
+            hi = min(now_dt, dt_util.start_of_local_day(date.fromisoformat(f"{nxt}-01")))
+            frac = max((hi - lo).total_seconds(), 0.0) / total if total > 0 else 0.0
+            out.append((m, d_buy * frac, d_sell * frac))
+        _LOGGER.warning(
+            "%s: HA tắt từ %s tới %s, qua %d tháng; %.3f kWh mua lúc tắt được chia theo thời gian, "
+            "ledger %s là ước tính", self.entry.entry_id, last_day, now_dt.date(), len(months),
+            d_buy, ", ".join(months),
+        )
+        return out
+
+    def _migrate_months(self) -> None:
+        """Chuyển `year.months` (kWh theo tháng, bản cũ) sang ledger + tổng đã chốt."""
+        year = self.data["year"]
+        legacy = year.pop("months", None) or {}
+        year.setdefault("closed", _empty_closed())
+        ledger = self.data["ledger"]
+        tariff = self.tariffs.table_for(dt_util.now().date())
+        for month_str, kwh in legacy.items():
+            if month_str in ledger or not isinstance(kwh, (int, float)):
+                continue
+            ledger[month_str] = {"buy": float(kwh), "sell": 0.0,
+                                 "cost": round(tariff.cost_K(kwh), 3), "revenue": 0.0}
+            year["closed"]["buy"] += float(kwh)
+            year["closed"]["cost"] += ledger[month_str]["cost"]
+        if legacy:
+            self.mark_dirty("ledger", "year")
+
+    # ---- rebuild ----
+    async def async_rebuild(self, source: str) -> Dict[str, Any]:
+        """Dựng lại baseline khi .storage mất/hỏng, rồi tính lại ngay."""
+        today = dt_util.now().date()
+        if source == "statistics":
+            rebuilt = await self._async_rebuild_from_statistics(today)
+        else:
+            tz = dt_util.get_default_time_zone()
+            years = await self.hass.async_add_executor_job(history_years, self.base_dir)
+            # mỗi năm một job executor -> các năm được đọc song song
+            summaries = await asyncio.gather(*(
+                self.hass.async_add_executor_job(summarize_year_sync, self.base_dir, y, tz)
+                for y in years
+            ))
+            rebuilt = rebuild_from_summaries(summaries, today, self.tariffs)
+        if rebuilt is None:
+            raise HomeAssistantError(f"Không có dữ liệu lịch sử ({source}) để dựng lại")
+
+        self.queue_rebuild(rebuilt)
+        await self.async_update(now=None)
+        return {"source": source, "ledger_months": sorted(self.data["ledger"]),
+                **{k: self.data[k] for k in ("accepted", "day", "month", "year")}}
+
+    async def _async_rebuild_from_statistics(self, today: date) -> Dict[str, Any] | None:
+        from homeassistant.components.recorder import get_instance
+        from homeassistant.components.recorder.statistics import statistics_during_period
+
+        tz = dt_util.get_default_time_zone()
+        ids = {self.forward_entity, self.reverse_entity}
+        year_start = dt_util.start_of_local_day(date(today.year - 1, 12, 1))
+        day_start = dt_util.start_of_local_day(today - timedelta(days=2))
+        recorder = get_instance(self.hass)
+        monthly = await recorder.async_add_executor_job(
+            statistics_during_period, self.hass, year_start, None, ids, "month", None, {"state"},
+        )
+        daily = await recorder.async_add_executor_job(
+            statistics_during_period, self.hass, day_start, None, ids, "day", None, {"state"},
+        )
+        return rebuild_from_statistics(monthly, daily, self.forward_entity, self.reverse_entity,
+                                       today, tz, self.tariffs)
+
+    # ---- sensor dispatch ----
+    _BREAKDOWN = {"buy_day": ("buy", "day"), "sell_day": ("sell", "day"),
+                  "buy_month": ("buy", "month"), "sell_month": ("sell", "month")}
+
+    def attributes_for(self, key: str) -> Dict[str, Any] | None:
+        """Thuộc tính phân rã theo giờ/ngày cho sensor ngày/tháng, dự báo cho sensor dự báo."""
+        if key == "forecast_buy_month":
+            return self._forecast_attrs
+        scope = self._BREAKDOWN.get(key)
+        return self.intraday.attributes(*scope) if scope else None
+
+    def restore_snapshot(self) -> None:
+        """Điền state từ snapshot trong .storage; coi như đã phát để tick đầu chỉ báo phần đổi."""
+        snap = self.data.get("snapshot") or {}
+        now = time.monotonic()
+        for key, val in snap.items():
+            if key not in self.state or key in _VOLATILE_KEYS:
+                continue
+            if key == "last_updated":
+                try:
+                    val = datetime.fromisoformat(val) if val else None
+                except (TypeError, ValueError):
+                    val = None
+            self.state[key] = val
+            self._published[key] = self.value_for(key)
+            self._published_at[key] = now
+
+    def value_for(self, key: str) -> Any:
+        """Giá trị sensor `key` đúng như sensor hiển thị."""
+        val = self.state.get(key)
+        if key == "last_updated" and val is not None:
+            return dt_util.as_local(val).isoformat(timespec="seconds")
+        if isinstance(val, (int, float)):
+            return round(val, 2)
+        return val
+
+    def _publish(self) -> None:
+        """So với snapshot đã phát; chỉ báo các sensor có giá trị đổi."""
+        now = time.monotonic()
+        changed = []
+        for key in self.state:
+            val = self.value_for(key)
+            if key in self._published and self._published[key] == val and (
+                not self.heartbeat or now - self._published_at[key] < self.heartbeat
+            ):
+                continue
+            self._published[key] = val
+            self._published_at[key] = now
+            changed.append(key)
+        if changed:
+            async_dispatch_update(self.hass, self.entry.entry_id, changed)
+
+    @property
+    def base_dir(self) -> str:
+        return os.path.dirname(self.csv_path)
+
+    # ---- event-driven mode ----
+    def start_event_mode(self, min_spacing_sec: int, max_stale_min: int) -> None:
+        """Chỉ tính lại khi forward/reverse thực sự tăng.
+
+        Các sự kiện dồn dập được giãn cách tối thiểu `min_spacing_sec`; nếu
+        công tơ đứng yên quá `max_stale_min` phút thì vẫn tính một lần (để qua
+        ngày/tháng/năm đúng giờ).
+        """
+        if self.unsub:
+            self.unsub()
+        self._min_spacing = float(max(min_spacing_sec, 0))
+        self._max_stale = float(max(max_stale_min, 1) * 60)
+        unsub_state = async_track_state_change_event(
+            self.hass, [self.forward_entity, self.reverse_entity], self._on_meter_event
+        )
+        self._arm_stale()
+
+        def _unsub_all() -> None:
+            unsub_state()
+            for attr in ("_pending_unsub", "_stale_unsub"):
+                cancel = getattr(self, attr)
+                if cancel:
+                    cancel()
+                    setattr(self, attr, None)
+            self._max_stale = 0.0
+        self.unsub = _unsub_all
+
+    @callback
+    def _on_meter_event(self, event) -> None:
+        new_state = event.data.get("new_state")
+        key = "forward" if event.data.get("entity_id") == self.forward_entity else "reverse"
+        val = _state_float(new_state)
+        prev = self.data["accepted"].get(key)
+        if val is None or (prev is not None and val <= prev):
+            return  # công tơ không đổi/giảm -> không làm gì
+        if self._pending_unsub:
+            return  # đã hẹn một lần tính, sự kiện này gộp vào đó
+        wait = self._min_spacing - (time.monotonic() - self._last_run)
+        if wait <= 0:
+            self.hass.async_create_task(self.async_update(None))
+        else:
+            self._pending_unsub = async_call_later(self.hass, wait, self._on_pending)
+
+    @callback
+    def _on_pending(self, now) -> None:
+        self._pending_unsub = None
+        self.hass.async_create_task(self.async_update(now))
+
+    @callback
+    def _on_stale(self, now) -> None:
+        self._stale_unsub = None
+        self.hass.async_create_task(self.async_update(now))
+
+    def _arm_stale(self) -> None:
+        if not self._max_stale:
+            return
+        if self._stale_unsub:
+            self._stale_unsub()
+        self._stale_unsub = async_call_later(self.hass, self._max_stale, self._on_stale)
+
+    # ---- high-frequency sampling ----
+    def start_sampling(self, seconds: int) -> None:
+        """Đọc công tơ mỗi `seconds` giây chỉ để tính công suất (0 = tắt).
+
+        Mẫu chỉ vào ring buffer trong RAM; tính tiền, .storage và file lịch sử
+        vẫn theo lịch interval/event như cũ.
+        """
+        self.stop_sampling()
+        if seconds > 0:
+            self._sample_unsub = async_track_time_interval(
+                self.hass, self._on_sample, timedelta(seconds=max(seconds, 2))
+            )
+
+    def stop_sampling(self) -> None:
+        if self._sample_unsub:
+            self._sample_unsub()
+            self._sample_unsub = None
+
+    @callback
+    def _on_sample(self, now) -> None:
+        f = _state_float(self.hass.states.get(self.forward_entity))
+        r = _state_float(self.hass.states.get(self.reverse_entity))
+        if f is None or r is None:
+            return
+        self._add_sample(f, r)
+        self._publish()
+
+    def _add_sample(self, forward: float, reverse: float) -> None:
+        self.samples.add(time.monotonic(), forward, reverse)
+        power = self.samples.power_kw(POWER_WINDOW_SEC)
+        if power is not None:
+            self.state["import_power"], self.state["export_power"] = power
+
+    # ---- baseline edits (options one-shot / rebuild) ----
+    def queue_baselines(self, readings: Dict[Tuple[str, str], float]) -> None:
+        """{(kỳ, "f_base"|"r_base"): số kWh mong muốn của kỳ}; áp trong pipeline."""
+        self._pending_bases.update(readings)
+
+    def queue_rebuild(self, rebuilt: Dict[str, Any]) -> None:
+        self._pending_rebuild = rebuilt
+
+    def _apply_pending(self) -> None:
+        """Áp thay đổi baseline đang chờ ở đầu async_compute.
+
+        Chạy bên trong async_run nên không xen giữa hai bước của một tick; baseline
+        tính theo số đọc `accepted` của tick trước, nên phần tăng của tick này vẫn
+        được cộng (intraday, ToU) như bình thường.
+        """
+        rebuilt, self._pending_rebuild = self._pending_rebuild, None
+        if rebuilt is not None:
+            self.data.update(rebuilt)
+            self.mark_dirty(*rebuilt)
+            if self.data.pop("tou", None) is not None:   # gieo lại từ baseline mới
+                self.mark_dirty("tou")
+        if not self._pending_bases:
+            return
+        readings, self._pending_bases = self._pending_bases, {}
+        acc = self.data["accepted"]
+        if acc.get("forward") is None or acc.get("reverse") is None:
+            self._refresh_accepted()
+        acc_f, acc_r = float(acc["forward"]), float(acc["reverse"])
+        changed = set()
+        for (section, key), value in readings.items():
+            base = max((acc_f if key == "f_base" else acc_r) - value, 0.0)
+            if self.data[section][key] != base:
+                self.data[section][key] = base
+                self.mark_dirty(section)
+                changed.add(section)
+        for section in changed:   # ToU: chỉ gieo lại kỳ có baseline mới
+            self._reseed_tou(section, acc_f, acc_r)
 
     # ---- helpers ----
     def _refresh_accepted(self) -> Tuple[float, float]:
-        def _val(entity_id: str) -> float:
-            st = self.hass.states.get(entity_id)
-            try:
-                return float(st.state) if st and st.state not in ("unknown","unavailable","none","") else 0.0
-            except Exception:
-                return 0.0
-        f = _val(self.forward_entity)
-        r = _val(self.reverse_entity)
+        f = _state_float(self.hass.states.get(self.forward_entity)) or 0.0
+        r = _state_float(self.hass.states.get(self.reverse_entity)) or 0.0
         acc = self.data.setdefault("accepted", {"forward": None, "reverse": None})
         if acc["forward"] is None or f > acc["forward"]:
             acc["forward"] = f
+            self.mark_dirty("accepted")
         if acc["reverse"] is None or r > acc["reverse"]:
             acc["reverse"] = r
+            self.mark_dirty("accepted")
         return float(acc["forward"] or 0.0), float(acc["reverse"] or 0.0)
 
-    def _cost_K(self, kwh: float) -> float:
-        remain = max(float(kwh), 0.0)
-        cost = 0.0
-        for block_kwh, price in EVN_TIERS:
-            take = remain if block_kwh is None else min(remain, block_kwh)
-            cost += take * price
-            remain -= take
-            if remain <= 0:
-                break
-        cost *= 1.08
-        return cost / 1000.0
-
-    def _ensure_csv_sync(self, path: str):
-        if not os.path.exists(path):
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(CSV_HEADER + "\n")
+    # ---- persistence ----
+    def mark_dirty(self, *sections: str) -> None:
+        self._dirty.update(sections)
+
+    def _data_to_save(self) -> Dict[str, Any]:
+        self._dirty.clear()
+        self._save_pending = False
+        # chụp state lúc ghi thật (kể cả lần ghi trễ) cho lần khởi động sau
+        self.data["snapshot"] = {
+            k: self.value_for(k) for k in self.state if k not in _VOLATILE_KEYS
+        }
+        return self.data
+
+    async def async_persist(self) -> None:
+        """Ghi .storage chỉ khi có thay đổi thật.
+
+        Đổi baseline (day/month/year: qua ngày/tháng/năm, nhập one-shot) được
+        ghi ngay; riêng bộ đếm `accepted` (và bộ cộng dồn theo khung giờ `tou`)
+        trôi theo đồng hồ thì được gom lại và ghi trễ `save_delay` giây (Store
+        tự ghi nốt khi HA tắt). Chỉ hẹn khi chưa có lần hẹn nào: gọi lại
+        async_delay_save mỗi tick sẽ dời timer mãi và lần ghi trễ không bao giờ tới.
+        """
+        if not self._dirty:
+            self.perf.count("store_skipped")
+            return
+        if self._dirty - {"accepted", "tou"} or self.save_delay <= 0:
+            self.perf.count("store_saves")
+            await self.store.async_save(self._data_to_save())
+        else:
+            self.perf.count("store_coalesced")
+            if not self._save_pending:
+                self._save_pending = True
+                self.store.async_delay_save(self._data_to_save, self.save_delay)
 
-    async def _async_write_csv_row(self, now_dt):
-        await self.hass.async_add_executor_job(self._write_csv_row_sync, now_dt)
+    async def async_flush(self) -> None:
+        if self._dirty:
+            self.perf.count("store_saves")
+            await self.store.async_save(self._data_to_save())
 
-    def _write_csv_row_sync(self, now_dt):
+    def _write_history_sync(self, now_dt, csv_path: str, values: List[float]):
+        """Ghi snapshot `values` (8 cột, thứ tự CSV) của tick `now_dt`."""
+        t0 = time.perf_counter()
         min_sec = now_dt.strftime("%M:%S")
-        row = (
-            f"{now_dt.date().isoformat()}|{now_dt.strftime('%H')}|{min_sec}"
-            f"|{self.state['total_buy']:.3f}|{self.state['buy_day']:.3f}|{self.state['buy_month']:.3f}|{self.state['buy_year']:.3f}"
-            f"|{self.state['total_sell']:.3f}|{self.state['sell_day']:.3f}|{self.state['sell_month']:.3f}|{self.state['sell_year']:.3f}"
+        row = f"{now_dt.date().isoformat()}|{now_dt.strftime('%H')}|{min_sec}|" + "|".join(
+            f"{v:.3f}" for v in values
         )
 
-        if not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) == 0:
-            with open(self.csv_path, "w", encoding="utf-8") as f:
-                f.write(CSV_HEADER + "\n")
+        # upsert theo (date, hour) chỉ chạm vào đuôi file
+        if self._csv_writer is None or self._csv_writer.path != csv_path:
+            if self._csv_writer:
+                self._csv_writer.close()
+            self._csv_writer = CsvTailWriter(csv_path)
+        appended = self._csv_writer.upsert(row)
+        size = self._csv_writer.size
+
+        if self.binary_history:
+            bin_path, idx_path = bin_paths(os.path.dirname(csv_path), now_dt.strftime("%Y"))
+            if self._bin_writer is None or self._bin_writer.path != bin_path:
+                if self._bin_writer:
+                    self._bin_writer.close()
+                self._bin_writer = BinaryHistoryWriter(bin_path, idx_path)
+            self._bin_writer.upsert(now_dt, values)
+            size += self._bin_writer.size
+
+        perf = self.perf
+        perf.count("history_appended" if appended else "history_coalesced")
+        perf.history_bytes = size
+        perf.add("history_write", time.perf_counter() - t0)
+
+    def _close_writers_sync(self) -> None:
+        for w in (self._csv_writer, self._bin_writer):
+            if w:
+                w.close()
+        self._csv_writer = self._bin_writer = None
 
-        with open(self.csv_path, "r+", encoding="utf-8") as f:
-            lines = f.readlines()
-            if len(lines) <= 1:
-                f.seek(0, os.SEEK_END); f.write(row + "\n"); return
-
-            idx = len(lines) - 1
-            while idx >= 0 and (not lines[idx].strip() or lines[idx].strip() == CSV_HEADER):
-                idx -= 1
-            if idx < 1:
-                f.seek(0, os.SEEK_END); f.write(row + "\n"); return
-
-            last = lines[idx].strip()
-            def _key(s: str):
-                p = s.split("|")
-                return (p[0], p[1]) if len(p) >= 2 else ("","")
-
-            if _key(last) == _key(row) and _key(row) != ("",""):
-                lines[idx] = row + "\n"
-                f.seek(0); f.truncate(0); f.writelines(lines)
-            else:
-                f.seek(0, os.SEEK_END); f.write(row + "\n")
+    async def async_close_history(self) -> None:
+        """Ghi nốt các dòng đang chờ và đóng file lịch sử (khi unload)."""
+        if self.writer is not None:
+            await self.hass.async_add_executor_job(self.writer.run, self._close_writers_sync)
+        else:
+            await self.hass.async_add_executor_job(self._close_writers_sync)
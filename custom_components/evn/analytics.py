@@ -0,0 +1,129 @@
+from __future__ import annotations
+import heapq
+import os
+from array import array
+from datetime import date, tzinfo
+from typing import Any, Dict, List, Optional, Tuple
+
+from .history import bin_paths, history_file
+from .query import iter_hour_deltas, iter_year
+from .rollup import daily_path
+from .tariff import TariffSchedule
+from .tou import TouTariff
+
+DEFAULT_TOP_HOURS = 10
+
+# Cột của một năm: ngày (ordinal), giờ, kWh mua/bán, tiền mua/bán (K) theo từng giờ
+Columns = Dict[str, array]
+
+
+def year_sources(base_dir: str, year: int) -> List[str]:
+    """Các file lịch sử của năm mà iter_year có thể đọc (.bin/.idx, CSV thô/nén, file ngày)."""
+    paths = [*bin_paths(base_dir, str(year)), history_file(os.path.join(base_dir, f"{year}.csv")),
+             daily_path(base_dir, str(year))]
+    return [p for p in paths if p and os.path.exists(p)]
+
+
+def source_signature(base_dir: str, year: int) -> Tuple[Any, ...]:
+    """Đổi khi file nguồn của năm đổi (ghi thêm, compact, nén)."""
+    out = []
+    for path in year_sources(base_dir, year):
+        st = os.stat(path)
+        out.append((path, st.st_size, st.st_mtime_ns))
+    return tuple(out)
+
+
+def load_year_columns_sync(base_dir: str, year: int, until: date, tz: tzinfo,
+                           tariffs: TariffSchedule, tou: Optional[TouTariff] = None) -> Columns:
+    """Đọc một lượt lịch sử năm `year` (tới hết `until`) vào các array cột.
+
+    Nhiều dòng cùng (ngày, giờ) (vd. file ghi theo phút) được cộng vào một ô.
+    """
+    cols: Columns = {
+        "day": array("l"), "hour": array("b"),
+        "buy": array("d"), "sell": array("d"), "cost": array("d"), "revenue": array("d"),
+    }
+    days, hours = cols["day"], cols["hour"]
+    buy, sell, cost, revenue = cols["buy"], cols["sell"], cols["cost"], cols["revenue"]
+    last = None
+    for d, hour, _v, db, ds, c, r in iter_hour_deltas(
+        iter_year(base_dir, year, date(year, 1, 1), until, tz), tariffs, tou
+    ):
+        key = (d, hour)
+        if key == last:
+            buy[-1] += db
+            sell[-1] += ds
+            cost[-1] += c
+            revenue[-1] += r
+            continue
+        last = key
+        days.append(d.toordinal())
+        hours.append(hour)
+        buy.append(db)
+        sell.append(ds)
+        cost.append(c)
+        revenue.append(r)
+    return cols
+
+
+def analyze_columns(cols: Columns, top: int = DEFAULT_TOP_HOURS,
+                    hourly: bool = True) -> Dict[str, Any]:
+    """Heatmap giờ × thứ (kWh trung bình), các giờ mua cao nhất, cân bằng mua/bán theo tháng."""
+    days, hours = cols["day"], cols["hour"]
+    buy, sell, cost, revenue = cols["buy"], cols["sell"], cols["cost"], cols["revenue"]
+    n = len(days)
+
+    out: Dict[str, Any] = {"rows": n, "heatmap": None, "peak_hours": None}
+    if hourly:
+        # ô = thứ * 24 + giờ; date.fromordinal(1) là thứ Hai nên thứ = (ordinal - 1) % 7
+        hm_buy = [0.0] * 168
+        hm_sell = [0.0] * 168
+        counts = [0] * 168
+        for i in range(n):
+            cell = ((days[i] - 1) % 7) * 24 + hours[i]
+            hm_buy[cell] += buy[i]
+            hm_sell[cell] += sell[i]
+            counts[cell] += 1
+
+        def _grid(values: List[float]) -> List[List[float]]:
+            return [[round(values[w * 24 + h] / counts[w * 24 + h], 3) if counts[w * 24 + h] else 0.0
+                     for h in range(24)] for w in range(7)]
+
+        out["heatmap"] = {"buy": _grid(hm_buy), "sell": _grid(hm_sell)}
+        out["peak_hours"] = [
+            {"start": f"{date.fromordinal(days[i]).isoformat()}T{hours[i]:02d}", "buy": round(buy[i], 3)}
+            for i in heapq.nlargest(top, range(n), key=buy.__getitem__)
+        ]
+
+    months: Dict[str, List[float]] = {}
+    month_of: Dict[int, str] = {}
+    for i in range(n):
+        o = days[i]
+        key = month_of.get(o)
+        if key is None:
+            key = month_of[o] = date.fromordinal(o).strftime("%Y-%m")
+        acc = months.get(key)
+        if acc is None:
+            acc = months[key] = [0.0, 0.0, 0.0, 0.0]
+        acc[0] += buy[i]
+        acc[1] += sell[i]
+        acc[2] += cost[i]
+        acc[3] += revenue[i]
+    out["months"] = [
+        {"month": k, "buy": round(a[0], 3), "sell": round(a[1], 3), "net": round(a[0] - a[1], 3),
+         "cost": round(a[2], 1), "revenue": round(a[3], 1), "balance": round(a[3] - a[2], 1)}
+        for k, a in months.items()
+    ]
+    return out
+
+
+def analyze_year_sync(base_dir: str, year: int, until: date, tz: tzinfo,
+                      tariffs: TariffSchedule, top: int = DEFAULT_TOP_HOURS,
+                      tou: Optional[TouTariff] = None) -> Dict[str, Any]:
+    sources = year_sources(base_dir, year)
+    daily = daily_path(base_dir, str(year))
+    cols = load_year_columns_sync(base_dir, year, until, tz, tariffs, tou)
+    result = analyze_columns(cols, top, hourly=any(p != daily for p in sources))
+    result.update(year=year, until=until.isoformat(),
+                  sources=[os.path.basename(p) for p in sources])
+    return result
@@ -2,7 +2,15 @@
 # DJ Billing — config_flow.py
 # - Config Flow: forward/reverse, dir, interval
 # - Options Flow:
-#     * interval 1–60 phút
+#     * chế độ cập nhật: interval (1–60 phút) hoặc event
+#       (theo đổi state công tơ, giãn cách tối thiểu + tối đa bao lâu)
+#     * độ trễ gom ghi .storage (giây)
+#     * heartbeat: ghi lại state sensor định kỳ dù giá trị không đổi
+#     * lịch sử nhị phân {year}.bin + index theo ngày (tuỳ chọn)
+#     * số năm giữ dữ liệu thô theo giờ (cũ hơn thì nén về file ngày)
+#     * đẩy kWh/tiền theo giờ vào thống kê dài hạn của recorder (kèm backfill)
+#     * lấy mẫu công tơ mỗi 2–59 giây cho sensor công suất mua/bán (0 = tắt)
+#     * cách tính tiền mua: bậc thang sinh hoạt hoặc theo khung giờ (tou.json)
 #     * 6 ô one-shot nhập kWh (buy/sell day|month|year)
 #   Khi mở Options, các ô sẽ được điền sẵn từ dj.state (nếu có).
 # ============================================
@@ -17,8 +25,15 @@ from typing import Any, Dict
 from .const import (
     DOMAIN, NAME,
     # Keys
-    CONF_FORWARD, CONF_REVERSE, CONF_DIR, CONF_INTERVAL_MIN,
-    DEFAULT_FORWARD, DEFAULT_REVERSE, DEFAULT_DIR, DEFAULT_INTERVAL_MIN,
+    CONF_FORWARD, CONF_REVERSE, CONF_DIR, CONF_INTERVAL_MIN, CONF_SAVE_DELAY_SEC,
+    CONF_UPDATE_MODE, CONF_MIN_SPACING_SEC, CONF_MAX_STALE_MIN, CONF_HEARTBEAT_MIN,
+    CONF_BINARY_HISTORY, CONF_RETENTION_YEARS, CONF_EXTERNAL_STATS, CONF_SAMPLE_SEC,
+    CONF_BILLING_MODE,
+    DEFAULT_FORWARD, DEFAULT_REVERSE, DEFAULT_DIR, DEFAULT_INTERVAL_MIN, DEFAULT_SAVE_DELAY_SEC,
+    DEFAULT_UPDATE_MODE, DEFAULT_MIN_SPACING_SEC, DEFAULT_MAX_STALE_MIN, DEFAULT_HEARTBEAT_MIN,
+    DEFAULT_BINARY_HISTORY, DEFAULT_RETENTION_YEARS, DEFAULT_EXTERNAL_STATS, DEFAULT_SAMPLE_SEC,
+    DEFAULT_BILLING_MODE,
+    UPDATE_MODES, BILLING_MODES,
     # One-shot keys (Options)
     OPT_BUY_DAY, OPT_BUY_MONTH, OPT_BUY_YEAR,
     OPT_SELL_DAY, OPT_SELL_MONTH, OPT_SELL_YEAR,
@@ -35,6 +50,36 @@ def _schema_user(defaults: Dict[str, Any]) -> vol.Schema:
             vol.Optional(CONF_INTERVAL_MIN,
                          default=defaults.get(CONF_INTERVAL_MIN, DEFAULT_INTERVAL_MIN)
                          ): vol.All(vol.Coerce(int), vol.Range(min=1, max=60)),
+            vol.Optional(CONF_UPDATE_MODE,
+                         default=defaults.get(CONF_UPDATE_MODE, DEFAULT_UPDATE_MODE)
+                         ): vol.In(UPDATE_MODES),
+            vol.Optional(CONF_MIN_SPACING_SEC,
+                         default=defaults.get(CONF_MIN_SPACING_SEC, DEFAULT_MIN_SPACING_SEC)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=0, max=600)),
+            vol.Optional(CONF_MAX_STALE_MIN,
+                         default=defaults.get(CONF_MAX_STALE_MIN, DEFAULT_MAX_STALE_MIN)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=1, max=1440)),
+            vol.Optional(CONF_SAVE_DELAY_SEC,
+                         default=defaults.get(CONF_SAVE_DELAY_SEC, DEFAULT_SAVE_DELAY_SEC)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+            vol.Optional(CONF_HEARTBEAT_MIN,
+                         default=defaults.get(CONF_HEARTBEAT_MIN, DEFAULT_HEARTBEAT_MIN)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=0, max=1440)),
+            vol.Optional(CONF_BINARY_HISTORY,
+                         default=defaults.get(CONF_BINARY_HISTORY, DEFAULT_BINARY_HISTORY)
+                         ): bool,
+            vol.Optional(CONF_RETENTION_YEARS,
+                         default=defaults.get(CONF_RETENTION_YEARS, DEFAULT_RETENTION_YEARS)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=0, max=50)),
+            vol.Optional(CONF_EXTERNAL_STATS,
+                         default=defaults.get(CONF_EXTERNAL_STATS, DEFAULT_EXTERNAL_STATS)
+                         ): bool,
+            vol.Optional(CONF_SAMPLE_SEC,
+                         default=defaults.get(CONF_SAMPLE_SEC, DEFAULT_SAMPLE_SEC)
+                         ): vol.All(vol.Coerce(int), vol.Any(0, vol.Range(min=2, max=59))),
+            vol.Optional(CONF_BILLING_MODE,
+                         default=defaults.get(CONF_BILLING_MODE, DEFAULT_BILLING_MODE)
+                         ): vol.In(BILLING_MODES),
         }
     )
 
@@ -47,6 +92,36 @@ def _schema_options(entry_data: Dict[str, Any], defaults_from_state: Dict[str, A
             vol.Optional(CONF_INTERVAL_MIN,
                          default=entry_data.get(CONF_INTERVAL_MIN, DEFAULT_INTERVAL_MIN)
                          ): vol.All(vol.Coerce(int), vol.Range(min=1, max=60)),
+            vol.Optional(CONF_UPDATE_MODE,
+                         default=entry_data.get(CONF_UPDATE_MODE, DEFAULT_UPDATE_MODE)
+                         ): vol.In(UPDATE_MODES),
+            vol.Optional(CONF_MIN_SPACING_SEC,
+                         default=entry_data.get(CONF_MIN_SPACING_SEC, DEFAULT_MIN_SPACING_SEC)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=0, max=600)),
+            vol.Optional(CONF_MAX_STALE_MIN,
+                         default=entry_data.get(CONF_MAX_STALE_MIN, DEFAULT_MAX_STALE_MIN)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=1, max=1440)),
+            vol.Optional(CONF_SAVE_DELAY_SEC,
+                         default=entry_data.get(CONF_SAVE_DELAY_SEC, DEFAULT_SAVE_DELAY_SEC)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+            vol.Optional(CONF_HEARTBEAT_MIN,
+                         default=entry_data.get(CONF_HEARTBEAT_MIN, DEFAULT_HEARTBEAT_MIN)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=0, max=1440)),
+            vol.Optional(CONF_BINARY_HISTORY,
+                         default=entry_data.get(CONF_BINARY_HISTORY, DEFAULT_BINARY_HISTORY)
+                         ): bool,
+            vol.Optional(CONF_RETENTION_YEARS,
+                         default=entry_data.get(CONF_RETENTION_YEARS, DEFAULT_RETENTION_YEARS)
+                         ): vol.All(vol.Coerce(int), vol.Range(min=0, max=50)),
+            vol.Optional(CONF_EXTERNAL_STATS,
+                         default=entry_data.get(CONF_EXTERNAL_STATS, DEFAULT_EXTERNAL_STATS)
+                         ): bool,
+            vol.Optional(CONF_SAMPLE_SEC,
+                         default=entry_data.get(CONF_SAMPLE_SEC, DEFAULT_SAMPLE_SEC)
+                         ): vol.All(vol.Coerce(int), vol.Any(0, vol.Range(min=2, max=59))),
+            vol.Optional(CONF_BILLING_MODE,
+                         default=entry_data.get(CONF_BILLING_MODE, DEFAULT_BILLING_MODE)
+                         ): vol.In(BILLING_MODES),
 
             # 6 trường one-shot (có thể bỏ trống):
             vol.Optional(OPT_BUY_DAY,   default=_d("buy_day")):   vol.Any(None, vol.Coerce(float)),
@@ -70,6 +145,16 @@ class DJConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             CONF_REVERSE: DEFAULT_REVERSE,
             CONF_DIR: DEFAULT_DIR,
             CONF_INTERVAL_MIN: DEFAULT_INTERVAL_MIN,
+            CONF_SAVE_DELAY_SEC: DEFAULT_SAVE_DELAY_SEC,
+            CONF_UPDATE_MODE: DEFAULT_UPDATE_MODE,
+            CONF_MIN_SPACING_SEC: DEFAULT_MIN_SPACING_SEC,
+            CONF_MAX_STALE_MIN: DEFAULT_MAX_STALE_MIN,
+            CONF_HEARTBEAT_MIN: DEFAULT_HEARTBEAT_MIN,
+            CONF_BINARY_HISTORY: DEFAULT_BINARY_HISTORY,
+            CONF_RETENTION_YEARS: DEFAULT_RETENTION_YEARS,
+            CONF_EXTERNAL_STATS: DEFAULT_EXTERNAL_STATS,
+            CONF_SAMPLE_SEC: DEFAULT_SAMPLE_SEC,
+            CONF_BILLING_MODE: DEFAULT_BILLING_MODE,
         }
 
         if user_input is not None:
@@ -87,16 +172,30 @@ class DJConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
 # ---------- Options Flow ----------
 
+# ô one-shot -> khoá state dùng để prefill
+_ONE_SHOT_STATE = {
+    OPT_BUY_DAY: "buy_day", OPT_BUY_MONTH: "buy_month", OPT_BUY_YEAR: "buy_year",
+    OPT_SELL_DAY: "sell_day", OPT_SELL_MONTH: "sell_month", OPT_SELL_YEAR: "sell_year",
+}
+_PREFILL_TOL = 0.0005   # sai số làm tròn khi form hiển thị lại số
+
 class DJOptionsFlowHandler(config_entries.OptionsFlow):
     def __init__(self, config_entry: config_entries.ConfigEntry) -> None:
         self._entry = config_entry
+        self._prefill: Dict[str, float] = {}
 
     async def async_step_init(self, user_input: Dict[str, Any] | None = None):
         errors: Dict[str, str] = {}
 
         if user_input is not None:
             # __init__.py sẽ đọc options này, áp dụng one-shot, rồi xóa options.
-            return self.async_create_entry(title="Options", data=user_input)
+            # Ô one-shot còn nguyên giá trị prefill = không sửa -> bỏ, để không đặt lại baseline.
+            data = {
+                k: v for k, v in user_input.items()
+                if not (k in _ONE_SHOT_STATE and v is not None and k in self._prefill
+                        and abs(float(v) - self._prefill[k]) < _PREFILL_TOL)
+            }
+            return self.async_create_entry(title="Options", data=data)
 
         # Lấy giá trị hiện thời từ runtime để prefill
         defaults_from_state = None
@@ -113,6 +212,9 @@ class DJOptionsFlowHandler(config_entries.OptionsFlow):
                 }
         except Exception:
             defaults_from_state = None
+        self._prefill = {
+            opt: defaults_from_state[key] for opt, key in _ONE_SHOT_STATE.items()
+        } if defaults_from_state else {}
 
         return self.async_show_form(
             step_id="init",
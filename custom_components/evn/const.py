@@ -11,10 +11,41 @@ CONF_FORWARD = "forward_entity_id"
 CONF_REVERSE = "reverse_entity_id"
 CONF_INTERVAL_MIN = "interval_minutes"
 CONF_DIR = "directory_path"
+CONF_SAVE_DELAY_SEC = "save_delay_seconds"
+CONF_UPDATE_MODE = "update_mode"
+CONF_MIN_SPACING_SEC = "min_spacing_seconds"
+CONF_MAX_STALE_MIN = "max_stale_minutes"
+CONF_HEARTBEAT_MIN = "heartbeat_minutes"
+CONF_BINARY_HISTORY = "binary_history"
+CONF_RETENTION_YEARS = "raw_retention_years"
+CONF_EXTERNAL_STATS = "external_statistics"
+CONF_SAMPLE_SEC = "sample_seconds"
+CONF_BILLING_MODE = "billing_mode"
+
+# Chế độ cập nhật: theo chu kỳ cố định hoặc theo sự kiện đổi state của công tơ
+UPDATE_MODE_INTERVAL = "interval"
+UPDATE_MODE_EVENT = "event"
+UPDATE_MODES = [UPDATE_MODE_INTERVAL, UPDATE_MODE_EVENT]
+
+# Cách tính tiền mua: bậc thang sinh hoạt hoặc theo khung giờ (ToU, kinh doanh)
+BILLING_TIERED = "tiered"
+BILLING_TOU = "tou"
+BILLING_MODES = [BILLING_TIERED, BILLING_TOU]
 
 DEFAULT_FORWARD = "sensor.evn_total_forward_energy"
 DEFAULT_REVERSE = "sensor.evn_total_reverse_energy"
 DEFAULT_INTERVAL_MIN = 1
+# Gom các thay đổi bộ đếm rồi mới ghi .storage (giảm ghi thẻ nhớ)
+DEFAULT_SAVE_DELAY_SEC = 600
+DEFAULT_UPDATE_MODE = UPDATE_MODE_INTERVAL
+DEFAULT_MIN_SPACING_SEC = 10   # khoảng cách tối thiểu giữa 2 lần tính (event)
+DEFAULT_MAX_STALE_MIN = 15     # quá lâu không có sự kiện thì vẫn tính lại
+DEFAULT_HEARTBEAT_MIN = 0      # 0 = sensor chỉ ghi state khi giá trị đổi
+DEFAULT_BINARY_HISTORY = False # ghi thêm {year}.bin + {year}.idx cạnh CSV
+DEFAULT_RETENTION_YEARS = 0    # giữ dữ liệu thô theo giờ N năm đã đóng; 0 = giữ mãi
+DEFAULT_EXTERNAL_STATS = False # đẩy tổng theo giờ vào thống kê dài hạn của recorder
+DEFAULT_SAMPLE_SEC = 0         # lấy mẫu công tơ mỗi N giây cho sensor công suất; 0 = tắt
+DEFAULT_BILLING_MODE = BILLING_TIERED
 
 # Thư mục mặc định mới: /config/custom_components/{DOMAIN}
 DEFAULT_DIR = f"/config/custom_components/{DOMAIN}/data"
@@ -32,6 +63,14 @@ CSV_HEADER = (
     "total_sell|sell_day|sell_month|sell_year"
 )
 
+# CSV của các năm đã đóng được nén nền thành {year}.csv.gz sau khi qua năm;
+# mọi chỗ đọc lịch sử đọc thẳng bản nén (.gz, hoặc .xz nếu nén tay bằng xz)
+ARCHIVE_SUFFIX = ".gz"
+ARCHIVE_SUFFIXES = (".gz", ".xz")
+
+# File tổng hợp theo ngày: {year}.daily.csv
+DAILY_HEADER = "date|buy|sell|cost|revenue|total_buy|total_sell"
+
 # --------------------------
 # EVN 2025 tiers + VAT
 # --------------------------
@@ -46,6 +85,39 @@ EVN_TIERS = [
 EVN_VAT = 0.08
 EVN_SELL_PRICE = 2275.0  # đ/kWh, không VAT
 
+# Các bảng giá theo ngày hiệu lực (bảng mới nhất = EVN_TIERS ở trên).
+# Có thể thêm/ghi đè bằng file TARIFF_FILE trong thư mục dữ liệu.
+EVN_TARIFFS = [
+    {
+        "effective": "2024-10-11",
+        "tiers": [(50.0, 1893.0), (50.0, 1956.0), (100.0, 2271.0),
+                  (100.0, 2860.0), (100.0, 3197.0), (None, 3302.0)],
+        "vat": EVN_VAT,
+        "sell_price": EVN_SELL_PRICE,
+    },
+    {
+        "effective": "2025-05-10",
+        "tiers": EVN_TIERS,
+        "vat": EVN_VAT,
+        "sell_price": EVN_SELL_PRICE,
+    },
+]
+TARIFF_FILE = "tariff.json"
+
+# Giá theo khung giờ (kinh doanh, cấp điện áp dưới 6 kV), đ/kWh chưa VAT.
+# T2–T7: cao điểm 09:30–11:30 + 17:00–20:00; thấp điểm 22:00–04:00; còn lại bình thường.
+# Chủ nhật: không có cao điểm. Ngày lễ (danh sách "holidays") dùng khung "holiday",
+# mặc định như chủ nhật. Có thể ghi đè bằng file TOU_FILE trong thư mục dữ liệu.
+EVN_TOU = {
+    "weekday": [["09:30", "11:30", "peak"], ["17:00", "20:00", "peak"], ["22:00", "04:00", "offpeak"]],
+    "sunday": [["22:00", "04:00", "offpeak"]],
+    "holidays": [],
+    "prices": [
+        {"effective": "2025-05-10", "peak": 5422.0, "normal": 3152.0, "offpeak": 1918.0, "vat": EVN_VAT},
+    ],
+}
+TOU_FILE = "tou.json"
+
 # --------------------------
 # Options one-shot nhập kWh
 # --------------------------
@@ -56,6 +128,23 @@ OPT_SELL_DAY = "sell_day_kwh"
 OPT_SELL_MONTH = "sell_month_kwh"
 OPT_SELL_YEAR = "sell_year_kwh"
 
+# Khoá trong hass.data[DOMAIN] của bộ điều phối dùng chung (cạnh các entry_id)
+DATA_COORDINATOR = "coordinator"
+
+# Khoá dispatcher chung của các sensor chẩn đoán (thời lượng pha, bộ đếm ghi)
+PERF_KEY = "perf"
+
+# --------------------------
+# Services
+# --------------------------
+ATTR_ENTRY_ID = "entry_id"
+SERVICE_QUERY_HISTORY = "query_history"
+SERVICE_REBUILD = "rebuild_baselines"
+REBUILD_SOURCES = ["csv", "statistics"]
+SERVICE_PROFILE = "profile"
+DEFAULT_PROFILE_TICKS = 10
+SERVICE_ANALYTICS = "analytics"
+
 # Prefix cho tên sensor
 CONF_PREFIX = "prefix"
 DEFAULT_PREFIX = "evn"
@@ -0,0 +1,115 @@
+from __future__ import annotations
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Callable, Dict, List
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.util import dt as dt_util
+
+from .writer import HistoryWriterThread
+
+_LOGGER = logging.getLogger(__name__)
+
+TICK = timedelta(minutes=1)
+# tick tới sớm hơn mốc `next_due` không quá chừng này (giây) vẫn tính là tới hạn
+_SLACK = 5.0
+
+
+class DJCoordinator:
+    """Một bộ hẹn giờ + một job ghi lịch sử cho mọi công tơ (hass.data[DOMAIN]).
+
+    Mỗi entry có chu kỳ `minutes` và một pha (phút lệch) được chọn ở pha đang ít
+    entry nhất, nên các entry cùng chu kỳ được rải đều qua các phút thay vì dồn
+    vào cùng một tick (chu kỳ mặc định 1 phút thì chỉ có một pha: mọi entry cùng
+    tick). Mỗi entry giữ mốc `next_due` (timestamp): tick nào tới sau mốc đó
+    (trừ hao `_SLACK`) thì chạy rồi dời mốc thêm `minutes` phút, nên bộ hẹn giờ
+    trôi, tới hai lần trong một phút hay lỡ một phút cũng không làm entry lỡ pha
+    và chờ thêm cả chu kỳ. Ở mỗi tick, các entry tới hạn được chạy đồng thời
+    (asyncio.gather) để phần chờ I/O của entry này (Store, executor) không chặn
+    entry khác, rồi phần ghi file của chúng được đẩy cho luồng ghi dùng chung.
+    Entry đang tính dở (event/options) thì tick chỉ được gộp vào lần chạy sau.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self._entries: Dict[str, Dict[str, Any]] = {}   # entry_id -> {dj, minutes, phase, next_due}
+        self._unsub: Callable[[], None] | None = None
+        self.writer = HistoryWriterThread()
+        self._unsub_stop = hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self._async_on_stop)
+
+    def register(self, dj, minutes: int) -> None:
+        minutes = max(int(minutes), 1)
+        self._entries.pop(dj.entry.entry_id, None)
+        load = [0] * minutes
+        for item in self._entries.values():
+            if item["minutes"] == minutes:
+                load[item["phase"]] += 1
+        phase = load.index(min(load))
+        # phút đầu tiên (tính từ bây giờ) thuộc pha đã chọn
+        n = int(dt_util.now().timestamp() // 60) + 1
+        n += (phase - n) % minutes
+        self._entries[dj.entry.entry_id] = {
+            "dj": dj, "minutes": minutes, "phase": phase, "next_due": n * 60.0,
+        }
+        if self._unsub is None:
+            self._unsub = async_track_time_interval(self.hass, self._async_tick, TICK)
+
+    def unregister(self, dj) -> None:
+        self._entries.pop(dj.entry.entry_id, None)
+        if not self._entries and self._unsub:
+            self._unsub()
+            self._unsub = None
+
+    def schedule_of(self, entry_id: str) -> Dict[str, Any] | None:
+        item = self._entries.get(entry_id)
+        if item is None:
+            return None
+        return {
+            "minutes": item["minutes"], "phase": item["phase"],
+            "next_due": dt_util.utc_from_timestamp(item["next_due"]).isoformat(),
+        }
+
+    def _due(self, now) -> List[Any]:
+        ts = now.timestamp()
+        due = []
+        for item in self._entries.values():
+            if ts < item["next_due"] - _SLACK:
+                continue
+            due.append(item["dj"])
+            period = item["minutes"] * 60.0
+            item["next_due"] += period
+            while item["next_due"] <= ts:   # lỡ nhiều chu kỳ thì chỉ chạy bù một lần
+                item["next_due"] += period
+        return due
+
+    async def _async_tick(self, now) -> None:
+        due = self._due(now)
+        results = await asyncio.gather(*(dj.async_run(now) for dj in due), return_exceptions=True)
+        jobs = []
+        for dj, result in zip(due, results):
+            if isinstance(result, BaseException):  # một công tơ lỗi không được chặn các công tơ khác
+                _LOGGER.error("Lỗi cập nhật %s", dj.entry.entry_id, exc_info=result)
+            elif result is not None:
+                jobs.append(result)
+        self.writer.submit_many(jobs)
+
+    async def _async_on_stop(self, _event) -> None:
+        self._unsub_stop = None
+        await self.hass.async_add_executor_job(self.writer.stop)
+
+    async def async_shutdown(self) -> None:
+        """Gỡ entry cuối cùng: ghi nốt hàng đợi rồi dừng luồng ghi."""
+        if self._unsub_stop:
+            self._unsub_stop()
+            self._unsub_stop = None
+        if self._unsub:
+            self._unsub()
+            self._unsub = None
+        await self.hass.async_add_executor_job(self.writer.stop)
+
+    @property
+    def idle(self) -> bool:
+        return not self._entries
@@ -0,0 +1,31 @@
+from __future__ import annotations
+from typing import Any, Dict
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DATA_COORDINATOR, DOMAIN
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> Dict[str, Any]:
+    """File diagnostics: cấu hình, trạng thái, thời lượng từng pha và bộ đếm ghi."""
+    domain_data = hass.data.get(DOMAIN, {})
+    dj = domain_data.get(entry.entry_id)
+    coordinator = domain_data.get(DATA_COORDINATOR)
+    out: Dict[str, Any] = {"entry": {"data": dict(entry.data), "options": dict(entry.options)}}
+    if dj is None:
+        return out
+    out.update({
+        "state": {key: dj.value_for(key) for key in dj.state},
+        "storage": dj.data,
+        "pending_sections": sorted(dj._dirty),
+        "perf": dj.perf.as_dict(),
+        "history": {
+            "csv_path": dj.csv_path,
+            "binary_history": dj.binary_history,
+            "retention_years": dj.retention_years,
+        },
+        "writer": dj.writer.stats() if dj.writer else None,
+        "schedule": coordinator.schedule_of(entry.entry_id) if coordinator else None,
+    })
+    return out
@@ -0,0 +1,91 @@
+from __future__ import annotations
+import re
+from datetime import date, datetime, tzinfo
+from typing import Any, Dict, List, Optional, Tuple
+
+from .const import DOMAIN
+from .query import iter_history, iter_hour_deltas
+from .rebuild import history_years
+from .tariff import TariffSchedule
+from .tou import TouTariff
+
+# Thống kê dài hạn (external statistics) theo giờ, mỗi công tơ 4 chuỗi:
+#   evn:{prefix}_buy_energy / _sell_energy  (kWh, state = chỉ số công tơ)
+#   evn:{prefix}_buy_cost / _sell_revenue   (K, đúng bậc thang theo tháng, hoặc theo khung giờ ở chế độ ToU)
+# `sum` là luỹ kế từ giờ đầu tiên đã nhập. Mỗi lần nhập chỉ đọc lịch sử từ
+# ngày của giờ đã nhập cuối, nên lần đầu chính là backfill toàn bộ CSV năm.
+
+STAT_KINDS = ("buy", "sell", "cost", "revenue")
+_SUFFIX = {"buy": "buy_energy", "sell": "sell_energy", "cost": "buy_cost", "revenue": "sell_revenue"}
+STAT_UNITS = {"buy": "kWh", "sell": "kWh", "cost": "K", "revenue": "K"}
+STAT_NAMES = {"buy": "Điện mua", "sell": "Điện bán", "cost": "Tiền điện", "revenue": "Tiền bán điện"}
+IMPORT_BATCH = 1000   # số giờ mỗi lần gọi async_add_external_statistics
+
+# (start timestamp của giờ đã nhập cuối, sum tại giờ đó)
+LastStat = Optional[Tuple[float, float]]
+
+
+def statistic_id(prefix: str, kind: str) -> str:
+    slug = re.sub(r"_+", "_", re.sub(r"[^a-z0-9_]", "_", prefix.lower())).strip("_") or DOMAIN
+    return f"{DOMAIN}:{slug}_{_SUFFIX[kind]}"
+
+
+def last_stat(row: Optional[Dict[str, Any]]) -> LastStat:
+    """Từ dòng get_last_statistics (start là timestamp hoặc datetime tuỳ bản HA)."""
+    if not row:
+        return None
+    start = row["start"]
+    ts = float(start) if isinstance(start, (int, float)) else start.timestamp()
+    return ts, float(row.get("sum") or 0.0)
+
+
+def statistic_metadata(stat_id: str, kind: str, prefix: str) -> Dict[str, Any]:
+    meta: Dict[str, Any] = {
+        "has_mean": False, "has_sum": True, "source": DOMAIN, "statistic_id": stat_id,
+        "name": f"{STAT_NAMES[kind]} ({prefix})", "unit_of_measurement": STAT_UNITS[kind],
+    }
+    try:  # HA mới: has_mean được thay bằng mean_type
+        from homeassistant.components.recorder.models import StatisticMeanType
+        meta["mean_type"] = StatisticMeanType.NONE
+    except ImportError:
+        pass
+    return meta
+
+
+def hourly_statistics(rows, tariffs: TariffSchedule, tz: tzinfo,
+                      last: Dict[str, LastStat], until: datetime,
+                      tou: Optional[TouTariff] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Điểm thống kê cho các giờ đã trọn (< until) và sau giờ đã nhập cuối của từng chuỗi."""
+    out: Dict[str, List[Dict[str, Any]]] = {k: [] for k in STAT_KINDS}
+    sums = {k: last[k][1] if last.get(k) else 0.0 for k in STAT_KINDS}
+    after = {k: last[k][0] if last.get(k) else float("-inf") for k in STAT_KINDS}
+    until_ts = until.timestamp()
+    for d, hour, v, db, ds, cost, revenue in iter_hour_deltas(rows, tariffs, tou):
+        start = datetime(d.year, d.month, d.day, hour, tzinfo=tz)
+        ts = start.timestamp()
+        if ts >= until_ts:
+            break
+        for kind, delta, state in (("buy", db, v[0]), ("sell", ds, v[4]),
+                                   ("cost", cost, None), ("revenue", revenue, None)):
+            if ts <= after[kind]:
+                continue
+            # làm tròn từng bước: nhập nối tiếp (từ sum đã lưu) và backfill lại từ đầu cho cùng kết quả
+            total = sums[kind] = round(sums[kind] + delta, 3)
+            out[kind].append({"start": start, "state": total if state is None else state, "sum": total})
+    return out
+
+
+def statistics_since_sync(base_dir: str, last: Dict[str, LastStat], until: datetime,
+                          tariffs: TariffSchedule, tz: tzinfo,
+                          tou: Optional[TouTariff] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Đọc lịch sử (thô/nén/nhị phân) từ ngày của giờ đã nhập cuối tới `until`."""
+    known = [s[0] for s in last.values() if s]
+    if len(known) == len(STAT_KINDS):
+        start = datetime.fromtimestamp(min(known), tz).date()
+    else:
+        years = history_years(base_dir)
+        if not years:
+            return {k: [] for k in STAT_KINDS}
+        start = date(years[0], 1, 1)
+    return hourly_statistics(iter_history(base_dir, start, until.date(), tz), tariffs, tz,
+                             last, until, tou)
@@ -0,0 +1,55 @@
+from __future__ import annotations
+from calendar import monthrange
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Tốc độ dùng điện theo ngày = trung bình trượt hàm mũ (EWMA) của các ngày đã trọn.
+# Lưu trong Store ở data["forecast"]; mỗi lần qua ngày chỉ cập nhật một số.
+FORECAST_SPAN_DAYS = 7
+FORECAST_ALPHA = 2.0 / (FORECAST_SPAN_DAYS + 1)
+MIN_ELAPSED_DAYS = 1.0 / 24   # chưa có ngày trọn nào: cần ít nhất 1 giờ dữ liệu trong tháng
+
+
+def empty_forecast() -> Dict[str, Any]:
+    return {"rate": None, "days": 0}
+
+
+def close_days(fc: Dict[str, Any], kwh: float, days: int = 1) -> None:
+    """Đưa lượng kWh của `days` ngày vừa trọn vào EWMA (HA tắt nhiều ngày thì chia đều)."""
+    days = max(int(days), 1)
+    per_day = max(kwh, 0.0) / days
+    rate = fc.get("rate")
+    for _ in range(min(days, FORECAST_SPAN_DAYS * 4)):   # sau ~4 span phần cũ coi như bằng 0
+        rate = per_day if rate is None else rate + FORECAST_ALPHA * (per_day - rate)
+    fc["rate"] = rate
+    fc["days"] = int(fc.get("days") or 0) + days
+
+
+def project_month(fc: Dict[str, Any], month_kwh: float,
+                  now: datetime) -> Optional[Tuple[float, float]]:
+    """(kWh cuối tháng dự kiến, kWh/ngày) = đã dùng + tốc độ × số ngày còn lại.
+
+    Chưa có ngày trọn nào thì lấy tốc độ trung bình từ đầu tháng.
+    """
+    days_in_month = monthrange(now.year, now.month)[1]
+    elapsed = now.day - 1 + (now.hour * 3600 + now.minute * 60 + now.second) / 86400.0
+    rate = fc.get("rate")
+    if rate is None:
+        if elapsed < MIN_ELAPSED_DAYS:
+            return None
+        rate = month_kwh / elapsed
+    return month_kwh + rate * max(days_in_month - elapsed, 0.0), rate
+
+
+def tier_crossings(bounds: Sequence[float], month_kwh: float, projected: float,
+                   rate: float, now: datetime) -> List[Dict[str, Any]]:
+    """Các mốc bậc chưa vượt: ngày dự kiến vượt (None nếu không tới trong tháng này)."""
+    out: List[Dict[str, Any]] = []
+    for i, bound in enumerate(bounds):
+        if bound <= month_kwh:
+            continue
+        when = None
+        if rate > 0 and bound <= projected:
+            when = (now + timedelta(days=(bound - month_kwh) / rate)).date().isoformat()
+        out.append({"tier": i + 2, "kwh": bound, "date": when})
+    return out
@@ -0,0 +1,378 @@
+from __future__ import annotations
+import gzip
+import lzma
+import mmap
+import os
+import struct
+from datetime import date, datetime
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+from .const import ARCHIVE_SUFFIXES, CSV_HEADER
+
+CSV_COLS = CSV_HEADER.count("|") + 1
+_HEADER_B = CSV_HEADER.encode("utf-8")
+_TAIL_CHUNK = 4096
+
+# (date, hour, 8 cột năng lượng theo thứ tự CSV)
+Row = Tuple[date, int, Tuple[float, ...]]
+
+
+def row_key(row: str) -> Tuple[str, str]:
+    """Khoá upsert của một dòng CSV: (date, hour)."""
+    p = row.split("|", 2)
+    return (p[0], p[1]) if len(p) >= 2 else ("", "")
+
+
+def _is_data_row(line: bytes) -> bool:
+    if not line or line == _HEADER_B:
+        return False
+    return line.count(b"|") + 1 == CSV_COLS
+
+
+def history_file(path: str) -> Optional[str]:
+    """File thật của `path`: bản thô nếu còn, nếu không thì bản đã nén (.gz/.xz)."""
+    if os.path.exists(path):
+        return path
+    for suffix in ARCHIVE_SUFFIXES:
+        if os.path.exists(path + suffix):
+            return path + suffix
+    return None
+
+
+def open_history_text(path: str):
+    """Mở file lịch sử dạng text; file nén được giải nén dần khi đọc (không bung ra đĩa)."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_csv_rows(path: str, start: Optional[date] = None,
+                  end: Optional[date] = None) -> Iterator[Row]:
+    """Đọc từng dòng (date, hour, 8 cột) trong [start, end], không nạp cả file.
+
+    `path` là tên CSV năm; nếu năm đó đã được nén thì đọc thẳng từ bản nén.
+    """
+    lo = start.isoformat() if start else ""
+    hi = end.isoformat() if end else "9999"
+    with open_history_text(history_file(path) or path) as f:
+        next(f, None)  # header
+        for line in f:
+            d = line[:10]
+            if d < lo:
+                continue
+            if d > hi:
+                break
+            p = line.rstrip("\n").split("|")
+            if len(p) != CSV_COLS:
+                continue
+            try:
+                yield date.fromisoformat(d), int(p[1]), tuple(float(x) for x in p[3:])
+            except ValueError:
+                continue
+
+
+def reverse_lines(f) -> Iterator[bytes]:
+    """Các dòng đã kết thúc bằng "\\n" của file nhị phân `f`, từ cuối lên (đọc từng khối).
+
+    Phần ghi dở sau "\\n" cuối cùng (crash giữa chừng) bị bỏ qua.
+    """
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    rest = b""
+    partial = True   # còn đang ở phần sau "\n" cuối cùng
+    while pos > 0:
+        step = min(_TAIL_CHUNK, pos)
+        pos -= step
+        f.seek(pos)
+        lines = (f.read(step) + rest).split(b"\n")
+        rest = lines[0]
+        tail = lines[1:]
+        if partial:
+            if not tail:
+                continue
+            tail.pop()
+            partial = False
+        for line in reversed(tail):
+            yield line.rstrip(b"\r")
+    if rest and not partial:
+        yield rest.rstrip(b"\r")
+
+
+def iter_csv_tail_rows(path: str, start: date, end: Optional[date] = None) -> Iterator[Row]:
+    """Các dòng trong [start, end] ở đuôi CSV thô, đọc ngược từ cuối file.
+
+    Dừng ở dòng đầu tiên trước `start` nên chỉ đọc phần đuôi (vd. tháng hiện tại)
+    thay vì quét cả file năm; kết quả trả về theo thứ tự trong file.
+    """
+    lo = start.isoformat().encode("ascii")
+    hi = (end.isoformat() if end else "9999").encode("ascii")
+    tail: List[bytes] = []
+    with open(path, "rb") as f:
+        for line in reverse_lines(f):
+            if not _is_data_row(line):
+                continue
+            d = line[:10]
+            if d < lo:
+                break
+            if d <= hi:
+                tail.append(line)
+    for line in reversed(tail):
+        p = line.decode("utf-8", "replace").split("|")
+        try:
+            yield date.fromisoformat(p[0]), int(p[1]), tuple(float(x) for x in p[3:])
+        except ValueError:
+            continue
+
+
+# -------------------- File giữ mở --------------------
+
+class _HeldFile:
+    """File nhị phân giữ mở giữa các lần ghi (chỉ dùng từ một luồng ghi).
+
+    Mỗi lần lấy chỉ tốn một stat để phát hiện file bị xoá/thay từ bên ngoài;
+    khi đó mở lại (tạo mới với nội dung `init` nếu chưa có).
+    """
+
+    def __init__(self, path: str, init: bytes = b"") -> None:
+        self.path = path
+        self._init = init
+        self._f = None
+        self._ino: Optional[int] = None
+
+    def get(self) -> Tuple[Any, bool]:
+        """(file, vừa_mở_lại)."""
+        if self._f is not None:
+            try:
+                if os.stat(self.path).st_ino == self._ino:
+                    return self._f, False
+            except FileNotFoundError:
+                pass
+            self.close()
+        if not os.path.exists(self.path):
+            with open(self.path, "wb") as f:
+                f.write(self._init)
+        self._f = open(self.path, "r+b")
+        self._ino = os.fstat(self._f.fileno()).st_ino
+        return self._f, True
+
+    def close(self) -> None:
+        if self._f is not None:
+            try:
+                self._f.close()
+            finally:
+                self._f = None
+                self._ino = None
+
+
+# -------------------- CSV tail writer --------------------
+
+class CsvTailWriter:
+    """Upsert dòng (date, hour) cuối của CSV năm mà không đọc lại cả file.
+
+    Giữ byte offset của dòng dữ liệu cuối; mỗi lần ghi chỉ seek tới đuôi
+    file, nên chi phí không phụ thuộc kích thước file. Các dòng phía trước
+    không bao giờ bị ghi đè. File được giữ mở giữa các lần ghi.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = _HeldFile(path, _HEADER_B + b"\n")
+        self._size: Optional[int] = None          # kích thước file sau lần ghi trước
+        self._last_off: Optional[int] = None      # offset của dòng dữ liệu cuối
+        self._last_key: Optional[Tuple[str, str]] = None
+
+    def upsert(self, row: str) -> bool:
+        """Ghi `row`; True nếu thêm dòng mới, False nếu ghi đè dòng cùng giờ."""
+        data = (row + "\n").encode("utf-8")
+        key = row_key(row)
+
+        f, reopened = self._file.get()
+        size = os.fstat(f.fileno()).st_size
+        if reopened or self._size is None or size != self._size:
+            # file mới mở hoặc bị sửa từ bên ngoài -> dò lại phần đuôi
+            size = self._scan_tail(f, size)
+
+        if self._last_off is not None and key == self._last_key and key != ("", ""):
+            f.seek(self._last_off)
+            f.write(data)
+            f.truncate()
+            self._size = self._last_off + len(data)
+            appended = False
+        else:
+            f.seek(size)
+            f.write(data)
+            self._last_off = size
+            self._size = size + len(data)
+            appended = True
+        self._last_key = key
+        f.flush()
+        return appended
+
+    @property
+    def size(self) -> int:
+        return self._size or 0
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _scan_tail(self, f, size: int) -> int:
+        """Tìm dòng dữ liệu hợp lệ cuối; cắt bỏ đuôi hỏng (dòng ghi dở)."""
+        self._last_off = None
+        self._last_key = None
+        chunk = _TAIL_CHUNK
+        keep: Optional[int] = None
+        while True:
+            start = max(size - chunk, 0)
+            f.seek(start)
+            buf = f.read(size - start)
+            # duyệt ngược các dòng đã kết thúc bằng "\n"; phần ghi dở sau
+            # "\n" cuối cùng sẽ bị cắt bỏ qua `keep`
+            end = buf.rfind(b"\n")
+            while end != -1:
+                begin = buf.rfind(b"\n", 0, end) + 1
+                if begin == 0 and start > 0:
+                    break               # dòng có thể bị cắt bởi cửa sổ đọc
+                line = buf[begin:end].rstrip(b"\r")
+                if _is_data_row(line):
+                    self._last_off = start + begin
+                    self._last_key = row_key(line.decode("utf-8", "replace"))
+                    keep = start + end + 1
+                    break
+                if line == _HEADER_B and begin == 0 and start == 0:
+                    keep = end + 1
+                    break
+                end = begin - 1 if begin > 0 else -1
+            if keep is not None or start == 0:
+                break
+            chunk *= 4
+
+        if keep is None:
+            # không có header lẫn dữ liệu hợp lệ
+            f.seek(0)
+            f.truncate()
+            f.write(_HEADER_B + b"\n")
+            keep = len(_HEADER_B) + 1
+        elif keep < size:
+            f.truncate(keep)
+        return keep
+
+
+# -------------------- Binary history --------------------
+#
+# {year}.bin: các bản ghi cố định 72 byte, little-endian:
+#   ts (epoch giây, float64) + 8 cột năng lượng float64 theo thứ tự CSV
+#   (total_buy, buy_day, buy_month, buy_year, total_sell, sell_day, sell_month, sell_year)
+# {year}.idx: 366 int64, ô thứ (ngày-trong-năm - 1) = số thứ tự bản ghi đầu tiên
+#   của ngày đó, -1 nếu chưa có.
+# Đọc thẳng được bằng mmap/struct hoặc numpy.memmap(dtype=BIN_DTYPE) không cần parse.
+
+BIN_RECORD = struct.Struct("<9d")
+BIN_INDEX = struct.Struct("<366q")
+BIN_DTYPE = [("ts", "<f8"), ("v", "<f8", (8,))]   # numpy.dtype(BIN_DTYPE)
+BIN_COLS = CSV_HEADER.split("|")[3:]
+
+
+def bin_paths(base_dir: str, year: str) -> Tuple[str, str]:
+    return os.path.join(base_dir, f"{year}.bin"), os.path.join(base_dir, f"{year}.idx")
+
+
+def _hour_key(ts: float, tz) -> Tuple[date, int]:
+    d = datetime.fromtimestamp(ts, tz)
+    return d.date(), d.hour
+
+
+class BinaryHistoryWriter:
+    """Upsert bản ghi theo (ngày, giờ) vào {year}.bin và cập nhật index theo ngày."""
+
+    def __init__(self, path: str, idx_path: str) -> None:
+        self.path = path
+        self.idx_path = idx_path
+        self._file = _HeldFile(path)
+        self._idx = _HeldFile(idx_path, BIN_INDEX.pack(*([-1] * 366)))
+        self._count: Optional[int] = None
+        self._last_key: Optional[Tuple[date, int]] = None
+
+    def upsert(self, now_dt: datetime, values: Sequence[float]) -> bool:
+        rec = BIN_RECORD.pack(now_dt.timestamp(), *values)
+        key = (now_dt.date(), now_dt.hour)
+
+        f, reopened = self._file.get()
+        size = os.fstat(f.fileno()).st_size
+        if reopened or self._count is None or size != self._count * BIN_RECORD.size:
+            self._count = size // BIN_RECORD.size
+            if size % BIN_RECORD.size:
+                f.truncate(self._count * BIN_RECORD.size)   # bản ghi dở do crash
+            self._last_key = None
+            if self._count:
+                f.seek((self._count - 1) * BIN_RECORD.size)
+                ts = BIN_RECORD.unpack(f.read(BIN_RECORD.size))[0]
+                self._last_key = _hour_key(ts, now_dt.tzinfo)
+
+        if self._count and key == self._last_key:
+            f.seek((self._count - 1) * BIN_RECORD.size)
+            f.write(rec)
+            f.flush()
+            return False
+        f.seek(self._count * BIN_RECORD.size)
+        f.write(rec)
+        f.flush()
+        new_day = self._last_key is None or self._last_key[0] != key[0]
+        self._count += 1
+        self._last_key = key
+
+        if new_day:
+            self._index_day(key[0], self._count - 1)
+        return True
+
+    @property
+    def size(self) -> int:
+        return (self._count or 0) * BIN_RECORD.size
+
+    def _index_day(self, day: date, recno: int) -> None:
+        slot = day.timetuple().tm_yday - 1
+        f, _ = self._idx.get()
+        f.seek(slot * 8)
+        cur = struct.unpack("<q", f.read(8))[0]
+        if cur < 0:
+            f.seek(slot * 8)
+            f.write(struct.pack("<q", recno))
+            f.flush()
+
+    def close(self) -> None:
+        self._file.close()
+        self._idx.close()
+
+
+def read_index(idx_path: str) -> List[int]:
+    if not os.path.exists(idx_path):
+        return [-1] * 366
+    with open(idx_path, "rb") as f:
+        raw = f.read(BIN_INDEX.size)
+    if len(raw) != BIN_INDEX.size:
+        return [-1] * 366
+    return list(BIN_INDEX.unpack(raw))
+
+
+def record_span(index: Sequence[int], count: int,
+                start: Optional[date], end: Optional[date]) -> Tuple[int, int]:
+    """[first, last) số thứ tự bản ghi thuộc các ngày start..end (cùng năm)."""
+    lo = 0 if start is None else start.timetuple().tm_yday - 1
+    hi = 366 if end is None else end.timetuple().tm_yday
+    first = next((index[i] for i in range(lo, 366) if index[i] >= 0), count)
+    last = next((index[i] for i in range(hi, 366) if index[i] >= 0), count)
+    return min(first, count), min(last, count)
+
+
+def iter_binary(path: str, idx_path: str, start: Optional[date] = None,
+                end: Optional[date] = None) -> Iterator[Tuple[float, ...]]:
+    """Duyệt các bản ghi (ts, 8 cột) của ngày start..end qua mmap, không parse text."""
+    if not os.path.exists(path) or os.path.getsize(path) < BIN_RECORD.size:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        count = len(mm) // BIN_RECORD.size
+        first, last = record_span(read_index(idx_path), count, start, end)
+        if first >= last:
+            return
+        yield from BIN_RECORD.iter_unpack(mm[first * BIN_RECORD.size:last * BIN_RECORD.size])
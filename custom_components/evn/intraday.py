@@ -0,0 +1,98 @@
+from __future__ import annotations
+import os
+from array import array
+from datetime import date, datetime, tzinfo
+from typing import Dict, List, Optional, Tuple
+
+from .history import iter_csv_tail_rows
+from .query import iter_history, iter_hour_deltas
+from .tariff import TariffSchedule
+
+HOURS = 24
+DAYS = 31
+_ZERO_HOURS = array("d", bytes(8 * HOURS))
+_ZERO_DAYS = array("d", bytes(8 * DAYS))
+
+
+class IntradayBuckets:
+    """kWh mua/bán theo giờ của hôm nay và theo ngày của tháng này.
+
+    Bốn array('d') cấp phát sẵn (24 và 31 ô); mỗi tick chỉ cộng phần tăng vào
+    đúng ô, qua ngày/tháng thì ghi đè bằng mảng 0 -> không đọc đĩa, không cấp phát.
+    `seen` là số đọc (forward, reverse) của dòng lịch sử cuối đã cộng vào bucket
+    lúc dựng lại; tick đầu tiên chỉ cộng phần vượt quá nó.
+    """
+
+    def __init__(self) -> None:
+        self.buy_hours = array("d", _ZERO_HOURS)
+        self.sell_hours = array("d", _ZERO_HOURS)
+        self.buy_days = array("d", _ZERO_DAYS)
+        self.sell_days = array("d", _ZERO_DAYS)
+        self.day: Optional[date] = None
+        self.seen: Optional[Tuple[float, float]] = None
+
+    def _roll(self, day: date) -> None:
+        if day == self.day:
+            return
+        self.buy_hours[:] = _ZERO_HOURS
+        self.sell_hours[:] = _ZERO_HOURS
+        if self.day is None or (day.year, day.month) != (self.day.year, self.day.month):
+            self.buy_days[:] = _ZERO_DAYS
+            self.sell_days[:] = _ZERO_DAYS
+        self.day = day
+
+    def add(self, day: date, hour: int, d_buy: float, d_sell: float) -> None:
+        self._roll(day)
+        self.buy_hours[hour] += d_buy
+        self.sell_hours[hour] += d_sell
+        self.buy_days[day.day - 1] += d_buy
+        self.sell_days[day.day - 1] += d_sell
+
+    def add_tick(self, when: datetime, edge_f: float, edge_r: float,
+                 d_buy: float, d_sell: float) -> None:
+        """Cộng phần tăng edge -> edge + d của một tick.
+
+        `accepted` được ghi trễ nên sau khi HA sập nó có thể cũ hơn dòng CSV cuối:
+        phần edge -> `seen` đã nằm trong bucket thì không cộng lại lần nữa.
+        """
+        if self.seen is not None:
+            seen_f, seen_r = self.seen
+            self.seen = None
+            d_buy = max(d_buy - max(seen_f - edge_f, 0.0), 0.0)
+            d_sell = max(d_sell - max(seen_r - edge_r, 0.0), 0.0)
+        self.add(when.date(), when.hour, d_buy, d_sell)
+
+    def attributes(self, kind: str, scope: str) -> Dict[str, List[float]]:
+        """{"hourly": [24 ô]} hoặc {"daily": [số ngày đã qua của tháng]} (kWh, 3 số lẻ)."""
+        if self.day is None:
+            return {}
+        if scope == "day":
+            buf = self.buy_hours if kind == "buy" else self.sell_hours
+            return {"hourly": [round(v, 3) for v in buf]}
+        buf = self.buy_days if kind == "buy" else self.sell_days
+        return {"daily": [round(v, 3) for v in buf[:self.day.day]]}
+
+
+def load_intraday_sync(base_dir: str, today: date, tz: tzinfo,
+                       tariffs: TariffSchedule) -> IntradayBuckets:
+    """Dựng lại từ lịch sử theo giờ của tháng hiện tại.
+
+    CSV năm hiện tại (luôn được ghi, kể cả khi bật .bin) được đọc ngược từ cuối
+    file tới đầu tháng; chưa có CSV thô thì đọc qua iter_history. Số đọc của
+    dòng cuối được giữ ở `seen` (xem add_tick).
+    """
+    start = today.replace(day=1)
+    raw = os.path.join(base_dir, f"{today.year}.csv")
+    if os.path.exists(raw):
+        rows = iter_csv_tail_rows(raw, start, today)
+    else:
+        rows = iter_history(base_dir, start, today, tz)
+    buckets = IntradayBuckets()
+    last = None
+    for d, hour, v, db, ds, _cost, _rev in iter_hour_deltas(rows, tariffs):
+        buckets.add(d, hour, db, ds)
+        last = v
+    buckets._roll(today)
+    if last is not None:
+        buckets.seen = (last[0], last[4])   # total_buy, total_sell
+    return buckets
@@ -0,0 +1,71 @@
+from __future__ import annotations
+from array import array
+from typing import Any, Dict
+
+# Các pha của một tick (theo thứ tự chạy)
+PHASES = ("refresh", "compute", "persist", "history_write", "dispatch")
+
+# Bộ đếm: lần ghi .storage ngay / gom vào lần ghi trễ / bỏ qua vì không đổi;
+# dòng lịch sử ghi đè tại chỗ (cùng giờ) thay vì thêm dòng mới; lần kích hoạt
+# cập nhật tới khi đang tính dở nên được gộp vào (tối đa) một lần chạy tiếp theo
+COUNTERS = ("ticks", "store_saves", "store_coalesced", "store_skipped",
+            "history_appended", "history_coalesced", "updates_merged")
+
+DEFAULT_WINDOW = 256
+
+
+class RollingHistogram:
+    """Thời lượng của N lần đo gần nhất trong một ring buffer cố định.
+
+    Ghi chỉ là một phép gán vào array; phân vị chỉ được tính khi đọc
+    (sensor chẩn đoán / file diagnostics), nên chi phí trên đường nóng
+    gần như bằng không.
+    """
+
+    def __init__(self, size: int = DEFAULT_WINDOW) -> None:
+        self._buf = array("d", bytes(8 * size))
+        self._size = size
+        self.count = 0
+        self.last = 0.0
+
+    def add(self, seconds: float) -> None:
+        self._buf[self.count % self._size] = seconds
+        self.count += 1
+        self.last = seconds
+
+    def summary(self) -> Dict[str, Any]:
+        """Thống kê (ms) trên cửa sổ hiện tại."""
+        n = min(self.count, self._size)
+        if not n:
+            return {"count": 0}
+        s = sorted(self._buf[:n])
+
+        def pct(p: float) -> float:
+            return round(s[min(int(p * (n - 1) + 0.5), n - 1)] * 1000, 3)
+
+        return {
+            "count": self.count, "window": n, "last": round(self.last * 1000, 3),
+            "p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99), "max": round(s[-1] * 1000, 3),
+        }
+
+
+class HotPathStats:
+    """Thời lượng từng pha + bộ đếm ghi của một DJRuntime."""
+
+    def __init__(self, window: int = DEFAULT_WINDOW) -> None:
+        self.phases: Dict[str, RollingHistogram] = {p: RollingHistogram(window) for p in PHASES}
+        self.counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.history_bytes = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase].add(seconds)
+
+    def count(self, counter: str, n: int = 1) -> None:
+        self.counters[counter] += n
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "phases_ms": {p: h.summary() for p, h in self.phases.items()},
+            "counters": dict(self.counters),
+            "history_bytes": self.history_bytes,
+        }
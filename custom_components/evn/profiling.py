@@ -0,0 +1,215 @@
+from __future__ import annotations
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Optional
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.util import dt as dt_util
+
+_LOGGER = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 5
+
+
+class ProfileSession:
+    """cProfile (+ tracemalloc tuỳ chọn) quanh tick của một DJRuntime.
+
+    Khi chạy, phiên gắn wrapper lên chính instance (`dj.async_compute`,
+    `dj._write_history_sync`); khi xong thì gỡ ra, nên lúc không profile
+    đường nóng không có thêm bất kỳ kiểm tra nào. Một đối tượng cProfile dùng
+    chung cho event loop và luồng ghi, mỗi lúc chỉ một bên bật (khoá không
+    chờ; đoạn trùng nhau thì chạy không đo và được đếm vào `_skipped`).
+
+    async_compute chỉ được đo trong các đoạn chạy đồng bộ giữa hai lần `await`
+    (xem `_ProfiledSteps`): lúc nó chờ Store/executor, profiler tắt nên các
+    coroutine khác mà event loop chạy xen vào không bị đo (và làm chậm).
+    """
+
+    def __init__(self, hass: HomeAssistant, dj, ticks: Optional[int],
+                 seconds: Optional[int], trace_memory: bool) -> None:
+        self.hass = hass
+        self.dj = dj
+        self.ticks = ticks
+        self.seconds = seconds
+        self.trace_memory = trace_memory
+        stamp = dt_util.now().strftime("%Y%m%d_%H%M%S")
+        self.stats_path = os.path.join(dj.base_dir, f"profile_{stamp}.pstats")
+        self.report_path = os.path.join(dj.base_dir, f"profile_{stamp}.txt")
+        self._profile = cProfile.Profile()
+        self._lock = threading.Lock()
+        self._done = 0
+        self._skipped = 0
+        self._started = 0.0
+        self._own_tracemalloc = False
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._unsub_timer: Optional[Callable[[], None]] = None
+        self._stopping = False
+
+    # ---- vòng đời ----
+    def start(self) -> Dict[str, Any]:
+        dj = self.dj
+        compute, write = dj.async_compute, dj._write_history_sync
+
+        async def _profiled_compute(now):
+            try:
+                return await _ProfiledSteps(self, compute(now))
+            finally:
+                self._tick_done()
+
+        def _profiled_write(*args):
+            if not self._enable():
+                return write(*args)
+            try:
+                return write(*args)
+            finally:
+                self._disable()
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._own_tracemalloc = True
+            self._snapshot = tracemalloc.take_snapshot()
+        dj.async_compute = _profiled_compute
+        dj._write_history_sync = _profiled_write
+        self._started = time.monotonic()
+        if self.seconds:
+            self._unsub_timer = async_call_later(self.hass, self.seconds, self._on_timeout)
+        return {
+            "ticks": self.ticks, "seconds": self.seconds, "tracemalloc": self.trace_memory,
+            "pstats": self.stats_path, "report": self.report_path,
+        }
+
+    def _enable(self) -> bool:
+        if not self._lock.acquire(blocking=False):
+            self._skipped += 1
+            return False
+        try:
+            self._profile.enable()
+        except ValueError:   # một profiler khác (vd. integration profiler của HA) đang bật
+            self._lock.release()
+            self._skipped += 1
+            return False
+        return True
+
+    def _disable(self) -> None:
+        self._profile.disable()
+        self._lock.release()
+
+    def _tick_done(self) -> None:
+        self._done += 1
+        if self.ticks and self._done >= self.ticks:
+            self._schedule_stop()
+
+    @callback
+    def _on_timeout(self, _now) -> None:
+        self._unsub_timer = None
+        self._schedule_stop()
+
+    def _schedule_stop(self) -> None:
+        if not self._stopping:
+            self._stopping = True
+            self.hass.async_create_task(self.async_stop())
+
+    async def async_stop(self) -> None:
+        """Ghi nốt lịch sử đang chờ (vẫn được đo), gỡ wrapper rồi ghi báo cáo."""
+        self._stopping = True
+        if self._unsub_timer:
+            self._unsub_timer()
+            self._unsub_timer = None
+        dj = self.dj
+        if dj.profile is not self:
+            return
+        if dj.writer is not None:
+            await self.hass.async_add_executor_job(dj.writer.flush)
+        dj.__dict__.pop("async_compute", None)
+        dj.__dict__.pop("_write_history_sync", None)
+        dj.profile = None
+
+        top_mem = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            end = tracemalloc.take_snapshot()
+            top_mem = _top_allocations(self._snapshot, end)
+            if self._own_tracemalloc:
+                tracemalloc.stop()
+        self._snapshot = None
+        await self.hass.async_add_executor_job(self._write_reports_sync, top_mem)
+        _LOGGER.info("Đã ghi báo cáo profile: %s, %s", self.report_path, self.stats_path)
+
+    # ---- báo cáo (executor) ----
+    def _write_reports_sync(self, top_mem: Optional[str]) -> None:
+        self._profile.dump_stats(self.stats_path)
+        buf = io.StringIO()
+        buf.write(
+            f"entry: {self.dj.entry.entry_id}\n"
+            f"ticks: {self._done}  duration: {time.monotonic() - self._started:.1f}s"
+            f"  bỏ qua (không đo): {self._skipped}\n\n"
+        )
+        try:
+            stats = pstats.Stats(self.stats_path, stream=buf)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE)
+            stats.print_stats(re.escape(PACKAGE_DIR), TOP_FUNCTIONS)
+        except TypeError:   # không có mẫu nào
+            buf.write("(không có dữ liệu cProfile)\n")
+        if top_mem is not None:
+            buf.write("\n==== tracemalloc: cấp phát tăng thêm trong " + PACKAGE_DIR + " ====\n")
+            buf.write(top_mem)
+        with open(self.report_path, "w", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+
+
+class _ProfiledSteps:
+    """Awaitable chạy coroutine từng bước, chỉ bật profiler trong mỗi bước đồng bộ."""
+
+    __slots__ = ("_session", "_coro")
+
+    def __init__(self, session: ProfileSession, coro) -> None:
+        self._session = session
+        self._coro = coro
+
+    def __await__(self):
+        session, coro = self._session, self._coro
+        value: Any = None
+        error: Optional[BaseException] = None
+        while True:
+            on = session._enable()
+            try:
+                if error is None:
+                    pending = coro.send(value)
+                else:
+                    pending = coro.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                if on:
+                    session._disable()
+            try:
+                value, error = (yield pending), None
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as err:   # huỷ task / lỗi từ future: chuyển vào coroutine
+                value, error = None, err
+
+
+def _top_allocations(start: Optional[tracemalloc.Snapshot], end: tracemalloc.Snapshot) -> str:
+    only_pkg = [tracemalloc.Filter(True, os.path.join(PACKAGE_DIR, "*"))]
+    end = end.filter_traces(only_pkg)
+    lines = []
+    if start is not None:
+        diff = end.compare_to(start.filter_traces(only_pkg), "lineno")
+        lines += [str(stat) for stat in diff[:TOP_ALLOCATIONS]]
+    lines.append("")
+    lines.append("---- đang giữ (cuối phiên) ----")
+    lines += [str(stat) for stat in end.statistics("lineno")[:TOP_ALLOCATIONS]]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,192 @@
+from __future__ import annotations
+import os
+from datetime import date, datetime, time, timedelta, tzinfo
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from .history import (
+    BIN_RECORD, Row, bin_paths, history_file, iter_binary, iter_csv_rows, read_index,
+)
+from .rollup import daily_path, iter_daily_rows
+from .tariff import TariffSchedule
+from .tou import TouTariff
+
+GRANULARITIES = ["hour", "day", "month"]
+
+
+# -------------------- Đọc lịch sử dạng stream --------------------
+
+def _iter_bin(bin_path: str, idx_path: str, start: Optional[date], end: Optional[date],
+             tz: tzinfo) -> Iterator[Row]:
+    for rec in iter_binary(bin_path, idx_path, start, end):
+        d = datetime.fromtimestamp(rec[0], tz)
+        yield d.date(), d.hour, rec[1:]
+
+
+_ONE_DAY = timedelta(days=1)
+
+
+def _hours_in_day(day: date, tz: tzinfo) -> int:
+    start = datetime.combine(day, time(), tz).timestamp()
+    end = datetime.combine(day + _ONE_DAY, time(), tz).timestamp()
+    return round((end - start) / 3600)
+
+
+def binary_days(base_dir: str, year: int, tz: tzinfo) -> Set[date]:
+    """Các ngày mà {year}.bin có đủ mọi giờ, xét từng ngày qua .idx (không quét dữ liệu).
+
+    File nhị phân chỉ là bản song song của CSV và có thể bị tắt/bật giữa năm:
+    ngày không có trong index, hoặc có ít bản ghi hơn số giờ của ngày (bật/tắt
+    giữa ngày, HA tắt vài giờ, hôm nay), đều phải đọc từ CSV.
+    """
+    bin_path, idx_path = bin_paths(base_dir, str(year))
+    if not os.path.exists(bin_path) or not os.path.exists(idx_path):
+        return set()
+    count = os.path.getsize(bin_path) // BIN_RECORD.size
+    # bản ghi nối tiếp theo thời gian -> số bản ghi của một ngày = mốc ngày có dữ liệu kế tiếp - mốc ngày đó
+    starts = [(slot, rec) for slot, rec in enumerate(read_index(idx_path)) if 0 <= rec < count]
+    jan1 = date(year, 1, 1)
+    days: Set[date] = set()
+    for n, (slot, first) in enumerate(starts):
+        nxt = starts[n + 1][1] if n + 1 < len(starts) else count
+        day = jan1 + timedelta(days=slot)
+        if day.year == year and nxt - first >= _hours_in_day(day, tz):
+            days.add(day)
+    return days
+
+
+def _day_runs(start: date, end: date, covered: Set[date]) -> Iterator[Tuple[bool, date, date]]:
+    """Chia [start, end] thành các đoạn ngày liên tiếp (đọc từ .bin?, từ, tới)."""
+    run_start, in_bin = start, start in covered
+    d = start
+    while d < end:
+        nxt = d + _ONE_DAY
+        if (nxt in covered) != in_bin:
+            yield in_bin, run_start, d
+            run_start, in_bin = nxt, not in_bin
+        d = nxt
+    yield in_bin, run_start, end
+
+
+def iter_year(base_dir: str, year: int, start: Optional[date], end: Optional[date],
+              tz: tzinfo) -> Iterator[Row]:
+    """Dòng của một năm: file nhị phân cho các ngày nó có đủ, CSV theo giờ
+    (thô/nén) cho phần còn lại, file ngày nếu dữ liệu giờ đã bị compact."""
+    bin_path, idx_path = bin_paths(base_dir, str(year))
+    csv_path = os.path.join(base_dir, f"{year}.csv")
+    day_path = daily_path(base_dir, str(year))
+    has_csv = history_file(csv_path) is not None
+    covered = binary_days(base_dir, year, tz)
+    if covered:
+        s = start or date(year, 1, 1)
+        e = end or date(year, 12, 31)
+        csv_rows: Optional[Iterator[Row]] = None
+        pending: Optional[Row] = None   # dòng CSV đã đọc quá đoạn hiện tại
+        for in_bin, a, b in _day_runs(s, e, covered):
+            if in_bin:
+                yield from _iter_bin(bin_path, idx_path, a, b, tz)
+                continue
+            if not has_csv:
+                continue
+            if csv_rows is None:   # một lượt đọc CSV dùng chung cho mọi đoạn
+                csv_rows = iter_csv_rows(csv_path, a, e)
+            if pending is not None:
+                if pending[0] > b:
+                    continue
+                if pending[0] >= a:
+                    yield pending
+                pending = None
+            for row in csv_rows:
+                if row[0] > b:
+                    pending = row
+                    break
+                if row[0] >= a:
+                    yield row
+    elif has_csv:
+        yield from iter_csv_rows(csv_path, start, end)
+    elif os.path.exists(day_path):
+        yield from iter_daily_rows(day_path, start, end)
+
+
+def iter_history(base_dir: str, start: date, end: date, tz: tzinfo) -> Iterator[Row]:
+    """Các dòng trong [start, end], stream từng năm."""
+    for year in range(start.year, end.year + 1):
+        y0 = max(start, date(year, 1, 1))
+        y1 = min(end, date(year, 12, 31))
+        yield from iter_year(base_dir, year, y0, y1, tz)
+
+
+# -------------------- Gộp theo bucket --------------------
+
+def _bucket(d: date, hour: int, granularity: str) -> str:
+    if granularity == "hour":
+        return f"{d.isoformat()}T{hour:02d}"
+    if granularity == "day":
+        return d.isoformat()
+    return d.strftime("%Y-%m")
+
+
+HourDelta = Tuple[date, int, Tuple[float, ...], float, float, float, float]
+
+
+def iter_hour_deltas(rows: Iterator[Row], tariffs: TariffSchedule,
+                     tou: Optional[TouTariff] = None) -> Iterator[HourDelta]:
+    """(date, hour, dòng, kWh mua, kWh bán, tiền mua, tiền bán) của từng giờ.
+
+    Mỗi dòng là snapshot cuối giờ; lượng trong giờ = chênh lệch buy_day/sell_day
+    so với dòng trước cùng ngày (dòng đầu ngày: chính buy_day/sell_day). Tiền mua
+    của lượng đó = giá tại vị trí luỹ kế tháng (cột buy_month), hoặc giá bình quân
+    của giờ đó theo khung giờ nếu có `tou` (chế độ tính tiền ToU).
+    """
+    prev_day: Optional[date] = None
+    prev_b = prev_s = 0.0
+    table = None
+    table_month = None
+    for d, hour, v in rows:
+        buy_day, buy_month, sell_day = v[1], v[2], v[5]
+        if d != prev_day:
+            prev_b = prev_s = 0.0
+            prev_day = d
+        db = max(buy_day - prev_b, 0.0)
+        ds = max(sell_day - prev_s, 0.0)
+        prev_b, prev_s = buy_day, sell_day
+
+        if (d.year, d.month) != table_month:
+            table = tariffs.table_for(d)
+            table_month = (d.year, d.month)
+        if tou is not None:
+            cost = db * tou.hour_price_K(d, hour)
+        else:
+            cost = table.cost_K(buy_month) - table.cost_K(buy_month - db)
+        yield d, hour, v, db, ds, cost, table.sell_K(ds)
+
+
+def aggregate(rows: Iterator[Row], granularity: str, tariffs: TariffSchedule,
+              tou: Optional[TouTariff] = None) -> Dict[str, Any]:
+    """Cộng kWh mua/bán, tiền mua (đúng bậc thang theo tháng / khung giờ) và tiền bán theo bucket."""
+    buckets: Dict[str, List[float]] = {}
+    for d, hour, _v, db, ds, cost, revenue in iter_hour_deltas(rows, tariffs, tou):
+        key = _bucket(d, hour, granularity)
+        acc = buckets.get(key)
+        if acc is None:
+            acc = buckets[key] = [0.0, 0.0, 0.0, 0.0]
+        acc[0] += db
+        acc[1] += ds
+        acc[2] += cost
+        acc[3] += revenue
+
+    out = [
+        {"start": k, "buy": round(a[0], 3), "sell": round(a[1], 3),
+         "cost": round(a[2], 1), "revenue": round(a[3], 1)}
+        for k, a in buckets.items()
+    ]
+    total = {key: round(sum(b[key] for b in out), 3 if key in ("buy", "sell") else 1)
+             for key in ("buy", "sell", "cost", "revenue")}
+    return {"granularity": granularity, "buckets": out, "total": total}
+
+
+def query_history_sync(base_dir: str, start: date, end: date, granularity: str,
+                       tariffs: TariffSchedule, tz: tzinfo,
+                       tou: Optional[TouTariff] = None) -> Dict[str, Any]:
+    result = aggregate(iter_history(base_dir, start, end, tz), granularity, tariffs, tou)
+    result.update(start=start.isoformat(), end=end.isoformat())
+    return result
@@ -0,0 +1,156 @@
+from __future__ import annotations
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .query import iter_year
+from .tariff import TariffSchedule
+
+_YEAR_FILE = re.compile(r"^(\d{4})\.(?:csv(?:\.gz|\.xz)?|daily\.csv|bin)$")
+
+
+def history_years(base_dir: str) -> List[int]:
+    """Các năm có lịch sử (thô theo giờ hoặc đã nén về file ngày)."""
+    if not os.path.isdir(base_dir):
+        return []
+    years = set()
+    for name in os.listdir(base_dir):
+        m = _YEAR_FILE.match(name)
+        if m:
+            years.add(int(m.group(1)))
+    return sorted(years)
+
+
+# -------------------- Từ file lịch sử --------------------
+
+def summarize_year_sync(base_dir: str, year: int, tz) -> Dict[str, Any]:
+    """Một lượt stream qua lịch sử năm: dòng cuối, max bộ đếm, dòng cuối mỗi tháng."""
+    last: Optional[Tuple[date, Tuple[float, ...]]] = None
+    max_f = max_r = None
+    months: Dict[str, Tuple[float, float, str]] = {}
+    for d, _hour, v in iter_year(base_dir, year, None, None, tz):
+        last = (d, v)
+        max_f = v[0] if max_f is None or v[0] > max_f else max_f
+        max_r = v[4] if max_r is None or v[4] > max_r else max_r
+        months[d.strftime("%Y-%m")] = (v[2], v[6], d.isoformat())  # buy_month, sell_month, ngày
+    return {"last": last, "max_f": max_f, "max_r": max_r, "months": months}
+
+
+def rebuild_from_summaries(summaries: Sequence[Dict[str, Any]], today: date,
+                           tariffs: TariffSchedule) -> Optional[Dict[str, Any]]:
+    """Dựng lại accepted/day/month/year/ledger từ tóm tắt các năm (theo thứ tự năm)."""
+    rows = [s for s in summaries if s.get("last")]
+    if not rows:
+        return None
+    max_f = max(s["max_f"] for s in rows)
+    max_r = max(s["max_r"] for s in rows)
+    last_day, v = rows[-1]["last"]
+    total_f, total_r = v[0], v[4]
+
+    def base(total: float, period: float, same: bool) -> float:
+        # cùng kỳ: mốc = số đọc - lượng đã dùng trong kỳ; khác kỳ: kỳ mới bắt đầu từ số đọc cuối
+        return max(total - period, 0.0) if same else total
+
+    same_year = last_day.year == today.year
+    same_month = same_year and last_day.month == today.month
+    same_day = last_day == today
+    cur_month = today.strftime("%Y-%m")
+
+    ledger: Dict[str, Dict[str, float]] = {}
+    for s in rows:
+        for month_str, (buy, sell, day_str) in s["months"].items():
+            if month_str == cur_month:
+                continue
+            tariff = tariffs.table_for(date.fromisoformat(day_str))
+            ledger[month_str] = {
+                "buy": round(buy, 3), "sell": round(sell, 3),
+                "cost": round(tariff.cost_K(buy), 3), "revenue": round(tariff.sell_K(sell), 3),
+            }
+    closed = {"buy": 0.0, "sell": 0.0, "cost": 0.0, "revenue": 0.0}
+    for month_str, entry in ledger.items():
+        if month_str.startswith(str(today.year)):
+            for key in closed:
+                closed[key] = round(closed[key] + entry[key], 3)
+
+    return {
+        "accepted": {"forward": max_f, "reverse": max_r},
+        "day": {"date": today.isoformat(),
+                "f_base": base(total_f, v[1], same_day), "r_base": base(total_r, v[5], same_day)},
+        "month": {"month": cur_month,
+                  "f_base": base(total_f, v[2], same_month), "r_base": base(total_r, v[6], same_month)},
+        "year": {"year": str(today.year),
+                 "f_base": base(total_f, v[3], same_year), "r_base": base(total_r, v[7], same_year),
+                 "closed": closed},
+        "ledger": ledger,
+    }
+
+
+# -------------------- Từ thống kê dài hạn của recorder --------------------
+
+def rebuild_from_statistics(monthly: Dict[str, List[Dict[str, Any]]],
+                            daily: Dict[str, List[Dict[str, Any]]],
+                            forward_id: str, reverse_id: str, today: date, tz,
+                            tariffs: TariffSchedule) -> Optional[Dict[str, Any]]:
+    """Dựng lại từ `state` cuối kỳ của thống kê tháng/ngày (sensor total_increasing)."""
+    def ends(stats: Dict[str, List[Dict[str, Any]]], entity_id: str, fmt: str) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        for row in stats.get(entity_id) or []:
+            if row.get("state") is None:
+                continue
+            out[_stat_start(row["start"], tz).strftime(fmt)] = float(row["state"])
+        return out
+
+    mf, mr = ends(monthly, forward_id, "%Y-%m"), ends(monthly, reverse_id, "%Y-%m")
+    if not mf:
+        return None
+    df, dr = ends(daily, forward_id, "%Y-%m-%d"), ends(daily, reverse_id, "%Y-%m-%d")
+
+    cur_month = today.strftime("%Y-%m")
+    months = sorted(mf)
+    # số đọc cuối tháng trước / cuối năm trước / cuối hôm qua (lấy gần nhất có dữ liệu)
+    def before(ends_map: Dict[str, float], key: str) -> Optional[float]:
+        prev = [k for k in ends_map if k < key]
+        return ends_map[max(prev)] if prev else None
+
+    last_f, last_r = mf[months[-1]], mr.get(months[-1], 0.0)
+    f_month = before(mf, cur_month)
+    r_month = before(mr, cur_month)
+    f_year = before(mf, f"{today.year}-01")
+    r_year = before(mr, f"{today.year}-01")
+    f_day = before(df, today.isoformat())
+    r_day = before(dr, today.isoformat())
+
+    ledger: Dict[str, Dict[str, float]] = {}
+    for i in range(1, len(months)):
+        m, pm = months[i], months[i - 1]
+        if m == cur_month:
+            continue
+        buy = max(mf[m] - mf[pm], 0.0)
+        sell = max(mr.get(m, 0.0) - mr.get(pm, 0.0), 0.0)
+        tariff = tariffs.table_for(date.fromisoformat(f"{m}-01"))
+        ledger[m] = {"buy": round(buy, 3), "sell": round(sell, 3),
+                     "cost": round(tariff.cost_K(buy), 3), "revenue": round(tariff.sell_K(sell), 3)}
+    closed = {"buy": 0.0, "sell": 0.0, "cost": 0.0, "revenue": 0.0}
+    for m, entry in ledger.items():
+        if m.startswith(str(today.year)):
+            for key in closed:
+                closed[key] = round(closed[key] + entry[key], 3)
+
+    def pick(v: Optional[float], fallback: float) -> float:
+        return fallback if v is None else v
+
+    return {
+        "accepted": {"forward": max(mf.values()), "reverse": max(mr.values()) if mr else 0.0},
+        "day": {"date": today.isoformat(), "f_base": pick(f_day, last_f), "r_base": pick(r_day, last_r)},
+        "month": {"month": cur_month, "f_base": pick(f_month, last_f), "r_base": pick(r_month, last_r)},
+        "year": {"year": str(today.year), "f_base": pick(f_year, mf[months[0]]),
+                 "r_base": pick(r_year, mr.get(months[0], 0.0)), "closed": closed},
+        "ledger": ledger,
+    }
+
+
+def _stat_start(start: Any, tz) -> datetime:
+    if isinstance(start, (int, float)):
+        return datetime.fromtimestamp(start, timezone.utc).astimezone(tz)
+    return start.astimezone(tz)
@@ -0,0 +1,157 @@
+from __future__ import annotations
+import gzip
+import os
+import re
+import shutil
+from datetime import date
+from typing import Iterable, Iterator, List, Optional
+
+from .const import ARCHIVE_SUFFIX, ARCHIVE_SUFFIXES, DAILY_HEADER
+from .history import Row, bin_paths, iter_csv_rows
+from .tariff import TariffSchedule
+from .tou import TouTariff
+
+# {year}.daily.csv: mỗi ngày một dòng
+#   date|buy|sell|cost|revenue|total_buy|total_sell
+# Ghi thêm một dòng khi qua ngày; năm cũ ngoài thời hạn lưu giữ được nén hẳn
+# về file này và xoá dữ liệu thô theo giờ ({year}.csv[.gz]/.bin/.idx).
+# CSV thô của năm đã đóng (còn trong hạn lưu giữ) được nén thành {year}.csv.gz.
+
+DAILY_COLS = DAILY_HEADER.count("|") + 1
+_RAW_CSV = re.compile(r"^(\d{4})\.csv(?:\.gz|\.xz)?$")
+
+
+def _raw_years(base_dir: str, before_year: int) -> List[int]:
+    years = set()
+    for name in os.listdir(base_dir):
+        m = _RAW_CSV.match(name)
+        if m and int(m.group(1)) < before_year:
+            years.add(int(m.group(1)))
+    return sorted(years)
+
+
+def daily_path(base_dir: str, year: str) -> str:
+    return os.path.join(base_dir, f"{year}.daily.csv")
+
+
+def format_daily_row(day: str, buy: float, sell: float, cost: float, revenue: float,
+                     total_buy: float, total_sell: float) -> str:
+    return (f"{day}|{buy:.3f}|{sell:.3f}|{cost:.3f}|{revenue:.3f}"
+            f"|{total_buy:.3f}|{total_sell:.3f}")
+
+
+def append_daily_sync(path: str, row: str) -> None:
+    new = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, "a", encoding="utf-8") as f:
+        if new:
+            f.write(DAILY_HEADER + "\n")
+        f.write(row + "\n")
+
+
+def iter_daily_rows(path: str, start: Optional[date] = None,
+                    end: Optional[date] = None) -> Iterator[Row]:
+    """Đọc file ngày dưới dạng dòng giờ tổng hợp (giờ 23) để dùng chung bộ gộp/rebuild."""
+    lo = start.isoformat() if start else ""
+    hi = end.isoformat() if end else "9999"
+    month = None
+    bm = sm = by = sy = 0.0
+    with open(path, "r", encoding="utf-8") as f:
+        next(f, None)  # header
+        for line in f:
+            p = line.rstrip("\n").split("|")
+            if len(p) != DAILY_COLS:
+                continue
+            try:
+                d = date.fromisoformat(p[0])
+                buy, sell, tb, ts = float(p[1]), float(p[2]), float(p[5]), float(p[6])
+            except ValueError:
+                continue
+            if (d.year, d.month) != month:
+                month = (d.year, d.month)
+                bm = sm = 0.0
+            bm += buy; sm += sell; by += buy; sy += sell
+            if p[0] < lo:
+                continue
+            if p[0] > hi:
+                break
+            yield d, 23, (tb, buy, bm, by, ts, sell, sm, sy)
+
+
+def daily_rows_from_raw(rows: Iterable[Row], tariffs: TariffSchedule,
+                        tou: Optional[TouTariff] = None) -> Iterator[str]:
+    """Gộp các dòng giờ thành dòng ngày (tiền mua theo vị trí bậc thang trong tháng,
+    hoặc cộng từng giờ theo giá khung giờ nếu có `tou`)."""
+    cur: Optional[date] = None
+    last = None
+    tou_cost = prev_buy = 0.0
+    for d, hour, v in rows:
+        if d != cur:
+            if cur is not None:
+                yield _daily_from_last(cur, last, tariffs, tou_cost if tou else None)
+            tou_cost = prev_buy = 0.0
+        if tou is not None:
+            tou_cost += max(v[1] - prev_buy, 0.0) * tou.hour_price_K(d, hour)
+            prev_buy = v[1]
+        cur, last = d, v
+    if cur is not None:
+        yield _daily_from_last(cur, last, tariffs, tou_cost if tou else None)
+
+
+def _daily_from_last(day: date, v, tariffs: TariffSchedule, cost: Optional[float] = None) -> str:
+    table = tariffs.table_for(day)
+    buy, mtd = v[1], v[2]
+    if cost is None:
+        cost = table.cost_K(mtd) - table.cost_K(mtd - buy)
+    return format_daily_row(day.isoformat(), buy, v[5], cost, table.sell_K(v[5]), v[0], v[4])
+
+
+def compact_years_sync(base_dir: str, before_year: int, tariffs: TariffSchedule,
+                       tou: Optional[TouTariff] = None) -> List[int]:
+    """Nén mọi năm < before_year về file ngày rồi xoá dữ liệu thô theo giờ."""
+    done: List[int] = []
+    if not os.path.isdir(base_dir):
+        return done
+    for year in _raw_years(base_dir, before_year):
+        stem = str(year)
+        raw = os.path.join(base_dir, f"{stem}.csv")
+        out = daily_path(base_dir, stem)
+        tmp = out + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(DAILY_HEADER + "\n")
+            for row in daily_rows_from_raw(iter_csv_rows(raw), tariffs, tou):
+                f.write(row + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, out)  # file ngày đầy đủ đã nằm trên đĩa trước khi xoá dữ liệu thô
+        for path in (raw, *(raw + s for s in ARCHIVE_SUFFIXES), *bin_paths(base_dir, stem)):
+            if os.path.exists(path):
+                os.remove(path)
+        done.append(int(stem))
+    return done
+
+
+def compress_closed_years_sync(base_dir: str, before_year: int) -> List[int]:
+    """Nén {year}.csv của mọi năm < before_year thành {year}.csv.gz (stream, không nạp cả file).
+
+    Bản nén được fsync + rename xong mới xoá bản thô; nếu bị ngắt giữa chừng
+    thì lần sau nén lại từ bản thô còn nguyên.
+    """
+    done: List[int] = []
+    if not os.path.isdir(base_dir):
+        return done
+    for name in sorted(os.listdir(base_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext != ".csv" or not stem.isdigit() or int(stem) >= before_year:
+            continue
+        raw = os.path.join(base_dir, name)
+        out = raw + ARCHIVE_SUFFIX
+        tmp = out + ".tmp"
+        with open(raw, "rb") as src, open(tmp, "wb") as dst:
+            with gzip.GzipFile(filename=name, mode="wb", fileobj=dst, mtime=0) as gz:
+                shutil.copyfileobj(src, gz, 1 << 20)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp, out)
+        os.remove(raw)
+        done.append(int(stem))
+    return done
@@ -0,0 +1,55 @@
+from __future__ import annotations
+from array import array
+from typing import Optional, Tuple
+
+SAMPLE_CAPACITY = 720      # 1 giờ mẫu ở 5 giây/mẫu
+POWER_WINDOW_SEC = 60.0    # công suất = trung bình trên cửa sổ này
+
+
+class SampleRing:
+    """Các số đọc forward/reverse gần nhất trong ring buffer cấp phát sẵn.
+
+    Ba array('d') song song (thời điểm monotonic, forward, reverse): thêm một
+    mẫu không cấp phát gì, và công suất chỉ cần duyệt ngược vài mẫu cuối.
+    """
+
+    def __init__(self, capacity: int = SAMPLE_CAPACITY) -> None:
+        zeros = bytes(8 * capacity)
+        self._t = array("d", zeros)
+        self._f = array("d", zeros)
+        self._r = array("d", zeros)
+        self._cap = capacity
+        self.count = 0
+
+    def __len__(self) -> int:
+        return min(self.count, self._cap)
+
+    def add(self, ts: float, forward: float, reverse: float) -> None:
+        i = self.count % self._cap
+        self._t[i] = ts
+        self._f[i] = forward
+        self._r[i] = reverse
+        self.count += 1
+
+    def power_kw(self, window: float = POWER_WINDOW_SEC) -> Optional[Tuple[float, float]]:
+        """(kW mua, kW bán) trung bình từ mẫu cũ nhất trong `window` giây tới mẫu mới nhất.
+
+        Nếu không có mẫu cũ nào trong cửa sổ (lấy mẫu thưa) thì dùng mẫu ngay trước.
+        """
+        n = len(self)
+        if n < 2:
+            return None
+        cap = self._cap
+        last = (self.count - 1) % cap
+        t_last = self._t[last]
+        j = (last - 1) % cap
+        for k in range(2, n + 1):
+            i = (self.count - k) % cap
+            if t_last - self._t[i] > window:
+                break
+            j = i
+        dt_h = (t_last - self._t[j]) / 3600.0
+        if dt_h <= 0:
+            return None
+        return (max(self._f[last] - self._f[j], 0.0) / dt_h,
+                max(self._r[last] - self._r[j], 0.0) / dt_h)
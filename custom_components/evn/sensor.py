@@ -2,13 +2,17 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Any, Callable, List
 
-from homeassistant.components.sensor import SensorEntity, SensorEntityDescription
+from homeassistant.components.sensor import (
+    SensorDeviceClass, SensorEntity, SensorEntityDescription, SensorStateClass,
+)
 from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import EntityCategory
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity import DeviceInfo
-from homeassistant.util import dt as dt_util
 
-from .const import DOMAIN, NAME, CONF_PREFIX, DEFAULT_PREFIX
+from .const import DOMAIN, NAME, CONF_PREFIX, DEFAULT_PREFIX, PERF_KEY
+from .perf import PHASES
+from .tou import TOU_STATE_KEYS
 from . import async_listen_update
 
 
@@ -36,8 +40,67 @@ DESCRIPTIONS: List[SensorEntityDescription] = [
     SensorEntityDescription(key="sell_revenue_month", translation_key="sell_revenue_month", native_unit_of_measurement="K"),
     SensorEntityDescription(key="sell_revenue_year", translation_key="sell_revenue_year", native_unit_of_measurement="K"),
 
+    # Power (kW, trung bình ~1 phút từ các mẫu gần nhất)
+    SensorEntityDescription(key="import_power", translation_key="import_power", native_unit_of_measurement="kW",
+                            device_class=SensorDeviceClass.POWER, state_class=SensorStateClass.MEASUREMENT),
+    SensorEntityDescription(key="export_power", translation_key="export_power", native_unit_of_measurement="kW",
+                            device_class=SensorDeviceClass.POWER, state_class=SensorStateClass.MEASUREMENT),
+
+    # Dự báo cuối tháng (tốc độ theo ngày EWMA + số ngày còn lại)
+    SensorEntityDescription(key="forecast_buy_month", translation_key="forecast_buy_month",
+                            native_unit_of_measurement="kWh"),
+    SensorEntityDescription(key="forecast_cost_month", translation_key="forecast_cost_month",
+                            native_unit_of_measurement="K"),
+
     # Meta
     SensorEntityDescription(key="last_updated", translation_key="last_updated"),
+
+    # kWh mua theo khung giờ (chỉ có giá trị ở chế độ tính tiền theo khung giờ)
+    *(SensorEntityDescription(key=k, translation_key=k, native_unit_of_measurement="kWh",
+                              entity_registry_enabled_default=False)
+      for k in TOU_STATE_KEYS),
+]
+
+
+# === Sensor chẩn đoán (mặc định tắt): thời lượng pha tick + bộ đếm ghi ===
+@dataclass(frozen=True, kw_only=True)
+class DJPerfDescription(SensorEntityDescription):
+    value_fn: Callable[[Any], Any]
+    attrs_fn: Callable[[Any], dict[str, Any]] | None = None
+    entity_category: EntityCategory | None = EntityCategory.DIAGNOSTIC
+    entity_registry_enabled_default: bool = False
+
+
+def _phase_description(phase: str) -> DJPerfDescription:
+    # state = p95 của cửa sổ gần nhất; thuộc tính có đủ p50/p99/max/count
+    return DJPerfDescription(
+        key=f"perf_{phase}", translation_key=f"perf_{phase}",
+        native_unit_of_measurement="ms", state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda dj: dj.perf.phases[phase].summary().get("p95"),
+        attrs_fn=lambda dj: dj.perf.phases[phase].summary(),
+    )
+
+
+def _counter_description(key: str, value_fn: Callable[[Any], Any]) -> DJPerfDescription:
+    return DJPerfDescription(
+        key=f"perf_{key}", translation_key=f"perf_{key}",
+        state_class=SensorStateClass.TOTAL_INCREASING, value_fn=value_fn,
+    )
+
+
+PERF_DESCRIPTIONS: List[DJPerfDescription] = [
+    *(_phase_description(p) for p in PHASES),
+    _counter_description("store_saves", lambda dj: dj.perf.counters["store_saves"]),
+    _counter_description("store_coalesced", lambda dj: dj.perf.counters["store_coalesced"]),
+    _counter_description("store_skipped", lambda dj: dj.perf.counters["store_skipped"]),
+    _counter_description("history_coalesced", lambda dj: dj.perf.counters["history_coalesced"]),
+    _counter_description("history_dropped", lambda dj: dj.writer.dropped if dj.writer else 0),
+    _counter_description("updates_merged", lambda dj: dj.perf.counters["updates_merged"]),
+    DJPerfDescription(
+        key="perf_history_size", translation_key="perf_history_size",
+        native_unit_of_measurement="B", device_class=SensorDeviceClass.DATA_SIZE,
+        state_class=SensorStateClass.MEASUREMENT, value_fn=lambda dj: dj.perf.history_bytes,
+    ),
 ]
 
 
@@ -52,6 +115,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_e
     )
 
     entities: list[DJSensor] = [DJSensor(hass, entry, dj, device, prefix, d) for d in DESCRIPTIONS]
+    entities += [DJPerfSensor(hass, entry, dj, device, prefix, d) for d in PERF_DESCRIPTIONS]
     async_add_entities(entities, update_before_add=True)
 
 
@@ -59,6 +123,8 @@ class DJSensor(SensorEntity):
     """Một sensor của DJ Billing."""
     _attr_should_poll = False
     _attr_has_entity_name = True  # cho phép ghép với tên dịch từ translations
+    # mảng theo giờ/ngày đổi mỗi tick -> không ghi vào recorder
+    _unrecorded_attributes = frozenset({"hourly", "daily"})
 
     def __init__(
         self,
@@ -87,7 +153,12 @@ class DJSensor(SensorEntity):
         def _update():
             self.async_write_ha_state()
 
-        self._unsub = async_listen_update(self.hass, self.entry.entry_id, _update)
+        # chỉ nhận tín hiệu khi giá trị của chính sensor này đổi
+        self._unsub = async_listen_update(self.hass, self.entry.entry_id, _update, self._signal_key)
+
+    @property
+    def _signal_key(self) -> str:
+        return self.key
 
     async def async_will_remove_from_hass(self) -> None:
         if self._unsub:
@@ -96,9 +167,26 @@ class DJSensor(SensorEntity):
 
     @property
     def native_value(self) -> Any:
-        val = self.dj.state.get(self.key)
-        if self.key == "last_updated" and val is not None:
-            return dt_util.as_local(val).isoformat(timespec="seconds")
-        if isinstance(val, (int, float)):
-            return round(val, 2)
-        return val
+        return self.dj.value_for(self.key)
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        return self.dj.attributes_for(self.key)
+
+
+class DJPerfSensor(DJSensor):
+    """Sensor chẩn đoán; mọi sensor loại này cập nhật theo một tín hiệu chung mỗi tick."""
+    entity_description: DJPerfDescription
+
+    @property
+    def _signal_key(self) -> str:
+        return PERF_KEY
+
+    @property
+    def native_value(self) -> Any:
+        return self.entity_description.value_fn(self.dj)
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        fn = self.entity_description.attrs_fn
+        return fn(self.dj) if fn else None
@@ -0,0 +1,142 @@
+from __future__ import annotations
+from typing import Any, Dict
+
+import voluptuous as vol
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
+from homeassistant.exceptions import ServiceValidationError
+from homeassistant.helpers import config_validation as cv
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    DOMAIN, ATTR_ENTRY_ID, SERVICE_QUERY_HISTORY, SERVICE_REBUILD, REBUILD_SOURCES,
+    SERVICE_PROFILE, DEFAULT_PROFILE_TICKS, SERVICE_ANALYTICS,
+)
+from .analytics import DEFAULT_TOP_HOURS
+from .profiling import ProfileSession
+from .query import GRANULARITIES, query_history_sync
+
+QUERY_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_ENTRY_ID): cv.string,
+        vol.Required("start"): cv.date,
+        vol.Required("end"): cv.date,
+        vol.Optional("granularity", default="day"): vol.In(GRANULARITIES),
+    }
+)
+
+REBUILD_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_ENTRY_ID): cv.string,
+        vol.Optional("source", default="csv"): vol.In(REBUILD_SOURCES),
+    }
+)
+
+PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_ENTRY_ID): cv.string,
+        vol.Optional("ticks"): vol.All(vol.Coerce(int), vol.Range(min=1, max=10000)),
+        vol.Optional("seconds"): vol.All(vol.Coerce(int), vol.Range(min=1, max=86400)),
+        vol.Optional("tracemalloc", default=False): cv.boolean,
+    }
+)
+
+ANALYTICS_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_ENTRY_ID): cv.string,
+        vol.Optional("year"): vol.All(vol.Coerce(int), vol.Range(min=2000, max=2100)),
+        vol.Optional("top", default=DEFAULT_TOP_HOURS): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=100)
+        ),
+    }
+)
+
+
+def _runtime(hass: HomeAssistant, call: ServiceCall):
+    """Chọn DJRuntime theo entry_id; bỏ trống khi chỉ có một công tơ."""
+    from . import DJRuntime
+    runtimes: Dict[str, Any] = {
+        k: v for k, v in hass.data.get(DOMAIN, {}).items() if isinstance(v, DJRuntime)
+    }
+    entry_id = call.data.get(ATTR_ENTRY_ID)
+    if entry_id:
+        if entry_id not in runtimes:
+            raise ServiceValidationError(f"Không tìm thấy entry {entry_id}")
+        return runtimes[entry_id]
+    if len(runtimes) != 1:
+        raise ServiceValidationError("Cần chỉ rõ entry_id khi có nhiều (hoặc không có) công tơ")
+    return next(iter(runtimes.values()))
+
+
+async def _async_query_history(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    dj = _runtime(hass, call)
+    start, end = call.data["start"], call.data["end"]
+    if end < start:
+        raise ServiceValidationError("end phải >= start")
+    # dòng của giờ hiện tại có thể vẫn đang trong hàng đợi ghi
+    if dj.writer is not None:
+        await hass.async_add_executor_job(dj.writer.flush)
+    return await hass.async_add_executor_job(
+        query_history_sync, dj.base_dir, start, end, call.data["granularity"],
+        dj.tariffs, dt_util.get_default_time_zone(), dj.history_tou,
+    )
+
+
+async def _async_rebuild(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    dj = _runtime(hass, call)
+    return await dj.async_rebuild(call.data["source"])
+
+
+async def _async_profile(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    dj = _runtime(hass, call)
+    # mỗi luồng chỉ có một hook profile: phiên thứ hai sẽ âm thầm thay phiên đầu
+    busy = next((rt for rt in hass.data.get(DOMAIN, {}).values()
+                 if getattr(rt, "profile", None) is not None), None)
+    if busy is not None:
+        raise ServiceValidationError(
+            f"Đang có một phiên profile chạy (entry {busy.entry.entry_id}); chờ phiên đó xong"
+        )
+    ticks, seconds = call.data.get("ticks"), call.data.get("seconds")
+    if ticks is None and seconds is None:
+        ticks = DEFAULT_PROFILE_TICKS
+    # dừng ở điều kiện tới trước (đủ số tick hoặc hết thời gian); báo cáo ghi vào CONF_DIR
+    dj.profile = ProfileSession(hass, dj, ticks, seconds, call.data["tracemalloc"])
+    return dj.profile.start()
+
+
+async def _async_analytics(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    dj = _runtime(hass, call)
+    year = call.data.get("year") or dt_util.now().year
+    if year > dt_util.now().year:
+        raise ServiceValidationError(f"Năm {year} chưa có dữ liệu")
+    return await dj.async_analytics(year, call.data["top"])
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    async def _query(call: ServiceCall) -> ServiceResponse:
+        return await _async_query_history(hass, call)
+
+    async def _rebuild(call: ServiceCall) -> ServiceResponse:
+        return await _async_rebuild(hass, call)
+
+    async def _profile(call: ServiceCall) -> ServiceResponse:
+        return await _async_profile(hass, call)
+
+    async def _analytics(call: ServiceCall) -> ServiceResponse:
+        return await _async_analytics(hass, call)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_QUERY_HISTORY, _query,
+        schema=QUERY_SCHEMA, supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_REBUILD, _rebuild,
+        schema=REBUILD_SCHEMA, supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_PROFILE, _profile,
+        schema=PROFILE_SCHEMA, supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_ANALYTICS, _analytics,
+        schema=ANALYTICS_SCHEMA, supports_response=SupportsResponse.ONLY,
+    )
@@ -0,0 +1,113 @@
+from __future__ import annotations
+import json
+import logging
+import os
+from bisect import bisect_right
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .const import EVN_TARIFFS, TARIFF_FILE
+
+_LOGGER = logging.getLogger(__name__)
+
+
+# -------------------- Bảng giá bậc thang --------------------
+
+class TariffTable:
+    """Bảng giá bậc thang đã tính sẵn mốc tích luỹ.
+
+    Giá một lượng kWh = 1 lần bisect + 1 phép nhân (đã gồm VAT, đơn vị K).
+    """
+
+    def __init__(self, tiers: Sequence[Tuple[Optional[float], float]], vat: float,
+                 sell_price: float, effective: Optional[date] = None) -> None:
+        self.tiers = [(None if b is None else float(b), float(p)) for b, p in tiers]
+        self.vat = float(vat)
+        self.sell_price = float(sell_price)
+        self.effective = effective or date.min
+
+        mult = (1.0 + self.vat) / 1000.0
+        self._bounds: List[float] = []   # mốc kWh kết thúc mỗi bậc hữu hạn
+        self._start: List[float] = []    # kWh bắt đầu mỗi bậc
+        self._base_K: List[float] = []   # tiền (K, có VAT) tích luỹ tới đầu bậc
+        self._price_K: List[float] = []  # giá (K/kWh, có VAT) của bậc
+        kwh = cost = 0.0
+        for block, price in self.tiers:
+            self._start.append(kwh)
+            self._base_K.append(cost * mult)
+            self._price_K.append(price * mult)
+            if block is None:
+                break
+            kwh += block
+            cost += block * price
+            self._bounds.append(kwh)
+        else:
+            # bậc cuối hữu hạn: phần vượt tính theo giá bậc cuối
+            self._start.append(kwh)
+            self._base_K.append(cost * mult)
+            self._price_K.append(self.tiers[-1][1] * mult if self.tiers else 0.0)
+        self._sell_K = self.sell_price / 1000.0
+
+    @property
+    def bounds(self) -> List[float]:
+        return list(self._bounds)
+
+    def cost_K(self, kwh: float) -> float:
+        x = kwh if kwh > 0.0 else 0.0
+        i = bisect_right(self._bounds, x)
+        return self._base_K[i] + (x - self._start[i]) * self._price_K[i]
+
+    def sell_K(self, kwh: float) -> float:
+        return max(kwh, 0.0) * self._sell_K
+
+
+# -------------------- Lịch sử bảng giá theo ngày hiệu lực --------------------
+
+class TariffSchedule:
+    """Các bảng giá có ngày hiệu lực; chọn bảng theo ngày bằng bisect."""
+
+    def __init__(self, tables: Iterable[TariffTable]) -> None:
+        self.tables = sorted(tables, key=lambda t: t.effective)
+        if not self.tables:
+            raise ValueError("Cần ít nhất một bảng giá")
+        self._dates = [t.effective for t in self.tables]
+
+    def table_for(self, day: date) -> TariffTable:
+        i = bisect_right(self._dates, day) - 1
+        return self.tables[max(i, 0)]
+
+
+def _table_from_dict(d: Dict[str, Any]) -> TariffTable:
+    eff = d.get("effective")
+    return TariffTable(
+        tiers=[(b, p) for b, p in d["tiers"]],
+        vat=d.get("vat", 0.0),
+        sell_price=d.get("sell_price", 0.0),
+        effective=date.fromisoformat(eff) if eff else None,
+    )
+
+
+def default_schedule() -> TariffSchedule:
+    return TariffSchedule(_table_from_dict(d) for d in EVN_TARIFFS)
+
+
+def load_schedule_sync(base_dir: str) -> TariffSchedule:
+    """Đọc `tariff.json` trong thư mục dữ liệu (nếu có) để đổi giá không cần sửa code.
+
+    File là list các bảng {"effective": "YYYY-MM-DD", "tiers": [[50, 1984], ...,
+    [null, 3460]], "vat": 0.08, "sell_price": 2275}; gộp thêm vào bảng mặc định.
+    """
+    schedule = default_schedule()
+    path = os.path.join(base_dir, TARIFF_FILE)
+    if not os.path.exists(path):
+        return schedule
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        tables = [_table_from_dict(d) for d in raw]
+    except Exception as err:
+        _LOGGER.warning("Bỏ qua %s không hợp lệ: %s", path, err)
+        return schedule
+    by_date = {t.effective: t for t in schedule.tables}
+    by_date.update({t.effective: t for t in tables})
+    return TariffSchedule(by_date.values())
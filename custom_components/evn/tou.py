@@ -0,0 +1,150 @@
+from __future__ import annotations
+import json
+import logging
+import os
+from bisect import bisect_right
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from .const import EVN_TOU, TOU_FILE
+
+_LOGGER = logging.getLogger(__name__)
+
+PERIODS = ("peak", "normal", "offpeak")
+_SLOTS = 48   # nửa giờ một ô
+DAY_TYPES = ("weekday", "sunday", "holiday")
+
+
+def _slot(hhmm: str) -> int:
+    h, m = hhmm.split(":")
+    return int(h) * 2 + int(m) // 30
+
+
+def _day_slots(ranges: Sequence[Sequence[str]]) -> bytes:
+    """[["09:30", "11:30", "peak"], ["22:00", "04:00", "offpeak"], ...] -> 48 ô chỉ số PERIODS.
+
+    Ô không thuộc khoảng nào là giờ bình thường; khoảng qua nửa đêm được chia đôi.
+    """
+    slots = bytearray([PERIODS.index("normal")] * _SLOTS)
+    for start, end, period in ranges:
+        idx = PERIODS.index(period)
+        a, b = _slot(start), _slot(end) or _SLOTS
+        for i in (range(a, b) if a < b else list(range(a, _SLOTS)) + list(range(0, b))):
+            slots[i] = idx
+    return bytes(slots)
+
+
+class TouCalendar:
+    """Khung giờ cao điểm/bình thường/thấp điểm cho ngày thường (T2–T7), chủ nhật và ngày lễ.
+
+    Tra một thời điểm = một phép so ngày lễ + một lần đánh chỉ số mảng 48 ô.
+    """
+
+    def __init__(self, days: Dict[str, Sequence[Sequence[str]]], holidays: Iterable[date] = ()) -> None:
+        self._slots = {t: _day_slots(days.get(t, days.get("sunday", ()))) for t in DAY_TYPES}
+        self.holidays = frozenset(holidays)
+
+    def day_type(self, day: date) -> str:
+        if day in self.holidays:
+            return "holiday"
+        return "sunday" if day.weekday() == 6 else "weekday"
+
+    def slots_for(self, day: date) -> bytes:
+        return self._slots[self.day_type(day)]
+
+    def period_at(self, when: datetime) -> str:
+        slots = self.slots_for(when.date())
+        return PERIODS[slots[when.hour * 2 + when.minute // 30]]
+
+
+class TouTariff:
+    """Lịch khung giờ + giá theo khung có ngày hiệu lực (K/kWh, đã gồm VAT)."""
+
+    def __init__(self, calendar: TouCalendar, prices: Iterable[Dict[str, Any]]) -> None:
+        self.calendar = calendar
+        tables = sorted(prices, key=lambda p: p.get("effective") or "")
+        if not tables:
+            raise ValueError("Cần ít nhất một bảng giá theo khung giờ")
+        self._dates = [date.fromisoformat(p["effective"]) if p.get("effective") else date.min
+                       for p in tables]
+        mults = [(1.0 + float(p.get("vat", 0.0))) / 1000.0 for p in tables]
+        self._price_K = [{k: float(p[k]) * m for k in PERIODS} for p, m in zip(tables, mults)]
+
+    def price_K(self, day: date, period: str) -> float:
+        i = max(bisect_right(self._dates, day) - 1, 0)
+        return self._price_K[i][period]
+
+    def period_at(self, when: datetime) -> str:
+        return self.calendar.period_at(when)
+
+    def hour_price_K(self, day: date, hour: int) -> float:
+        """Giá bình quân của một giờ (hai ô nửa giờ) cho dữ liệu lịch sử theo giờ."""
+        slots = self.calendar.slots_for(day)
+        prices = self._price_K[max(bisect_right(self._dates, day) - 1, 0)]
+        return (prices[PERIODS[slots[hour * 2]]] + prices[PERIODS[slots[hour * 2 + 1]]]) / 2.0
+
+
+def _tou_from_dict(raw: Dict[str, Any]) -> TouTariff:
+    holidays = [date.fromisoformat(d) for d in raw.get("holidays", [])]
+    days = {t: raw[t] for t in DAY_TYPES if t in raw}
+    return TouTariff(TouCalendar(days, holidays), raw["prices"])
+
+
+def default_tou() -> TouTariff:
+    return _tou_from_dict(EVN_TOU)
+
+
+def load_tou_sync(base_dir: str) -> TouTariff:
+    """Đọc `tou.json` trong thư mục dữ liệu (nếu có); khoá nào có trong file thì thay mặc định.
+
+    {"weekday": [["09:30", "11:30", "peak"], ...], "sunday": [...], "holiday": [...],
+     "holidays": ["2025-09-02", ...],
+     "prices": [{"effective": "2025-05-10", "peak": 5422, "normal": 3152, "offpeak": 1918, "vat": 0.08}]}
+    """
+    path = os.path.join(base_dir, TOU_FILE)
+    if not os.path.exists(path):
+        return default_tou()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = {**EVN_TOU, **json.load(f)}
+        return _tou_from_dict(raw)
+    except Exception as err:
+        _LOGGER.warning("Bỏ qua %s không hợp lệ: %s", path, err)
+        return default_tou()
+
+
+# -------------------- Bộ cộng dồn theo khung giờ (lưu trong Store) --------------------
+
+TOU_SCOPES = ("day", "month", "year")
+
+
+def empty_scope() -> Dict[str, Any]:
+    return {"buy": dict.fromkeys(PERIODS, 0.0), "sell": dict.fromkeys(PERIODS, 0.0), "cost": 0.0}
+
+
+def seed_scope(buy: float, sell: float, price_normal_K: float) -> Dict[str, Any]:
+    """Phần đã dùng trước khi bật ToU: tính như giờ bình thường."""
+    scope = empty_scope()
+    scope["buy"]["normal"] = buy
+    scope["sell"]["normal"] = sell
+    scope["cost"] = buy * price_normal_K
+    return scope
+
+
+def add_delta(tou: Dict[str, Dict[str, Any]], period: str, d_buy: float, d_sell: float,
+              cost_K: float) -> None:
+    for scope in TOU_SCOPES:
+        acc = tou[scope]
+        acc["buy"][period] += d_buy
+        acc["sell"][period] += d_sell
+        acc["cost"] += cost_K
+
+
+def period_values(tou: Optional[Dict[str, Dict[str, Any]]]) -> List[Any]:
+    """[buy_peak_day, buy_normal_day, ..., buy_offpeak_year] theo thứ tự TOU_STATE_KEYS."""
+    if not tou:
+        return [None] * (len(PERIODS) * len(TOU_SCOPES))
+    return [tou[scope]["buy"][p] for scope in TOU_SCOPES for p in PERIODS]
+
+
+TOU_STATE_KEYS = [f"buy_{p}_{scope}" for scope in TOU_SCOPES for p in PERIODS]
@@ -0,0 +1,162 @@
+from __future__ import annotations
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 1000
+MAX_BATCH = 256
+
+Job = Callable[[], None]
+
+
+class _Control:
+    """Job điều khiển (flush, đóng file): không bị bỏ khi hàng đợi đầy, không đếm vào `written`."""
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn: Job) -> None:
+        self.fn = fn
+
+
+def _noop() -> None:
+    pass
+
+
+class HistoryWriterThread:
+    """Luồng nền riêng ghi lịch sử, thay cho mỗi tick một job executor của HA.
+
+    Event loop chỉ `submit` job vào hàng đợi có giới hạn (không bao giờ chặn);
+    luồng này rút job theo lô khi bị dồn. Các writer (CsvTailWriter, ...) giữ
+    file mở giữa các lần ghi vì luôn chỉ chạy trên đúng luồng này. Hàng đợi đầy
+    thì bỏ job ghi cũ nhất và đếm vào `dropped`; job điều khiển (flush, đóng file,
+    dừng luồng) thì chờ chỗ trống (có timeout) chứ không đẩy job ghi nào ra.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_QUEUE_SIZE, name: str = "evn_history_writer") -> None:
+        self._queue: "queue.Queue[Job | _Control | None]" = queue.Queue(maxsize=maxsize)
+        self._name = name
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.max_backlog = 0
+
+    # ---- phía event loop ----
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+
+    def submit(self, job: Job) -> None:
+        self.start()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._replace_oldest(job)
+        backlog = self._queue.qsize()
+        if backlog > self.max_backlog:
+            self.max_backlog = backlog
+
+    def _replace_oldest(self, job: Job) -> None:
+        """Hàng đợi đầy: thay job ghi cũ nhất bằng `job`, giữ nguyên job điều khiển/dừng."""
+        q = self._queue
+        with q.mutex:
+            if len(q.queue) < q.maxsize:   # luồng ghi vừa rút bớt
+                q.queue.append(job)
+                q.unfinished_tasks += 1
+                q.not_empty.notify()
+                return
+            for i, item in enumerate(q.queue):
+                if item is not None and not isinstance(item, _Control):
+                    del q.queue[i]
+                    q.queue.append(job)
+                    break
+            # toàn job điều khiển: bỏ chính job mới
+        self.dropped += 1
+
+    def submit_many(self, jobs: Iterable[Job]) -> None:
+        for job in jobs:
+            self.submit(job)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backlog": self.backlog, "max_backlog": self.max_backlog,
+            "written": self.written, "dropped": self.dropped, "batches": self.batches,
+        }
+
+    # ---- chạy trong executor (chặn) ----
+    def run(self, job: Job, timeout: float = 30.0) -> bool:
+        """Chạy `job` trên luồng ghi sau mọi job đã gửi trước đó và chờ nó xong."""
+        if self._thread is None or not self._thread.is_alive():
+            job()
+            return True
+        done = threading.Event()
+
+        def _control() -> None:
+            try:
+                job()
+            finally:
+                done.set()
+
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(_Control(_control), timeout=timeout)
+        except queue.Full:
+            _LOGGER.warning("Hàng đợi ghi lịch sử vẫn đầy sau %.0fs", timeout)
+            return False
+        return done.wait(max(deadline - time.monotonic(), 0.0))
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Chờ tới khi mọi job đã gửi trước đó được ghi xong."""
+        return self.run(_noop, timeout)
+
+    def stop(self, timeout: float = 30.0) -> None:
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            _LOGGER.warning("Không dừng được luồng ghi lịch sử: hàng đợi vẫn đầy")
+        self._thread.join(timeout)
+        self._thread = None
+
+    # ---- luồng ghi ----
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            batch = [job]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            for item in batch:
+                if item is None:
+                    stop = True
+                elif isinstance(item, _Control):
+                    try:
+                        item.fn()
+                    except Exception:
+                        _LOGGER.exception("Lỗi ghi lịch sử")
+                else:
+                    try:
+                        item()
+                        self.written += 1
+                    except Exception:
+                        _LOGGER.exception("Lỗi ghi lịch sử")
+                self._queue.task_done()
+            self.batches += 1
+            if stop:
+                return